@@ -0,0 +1,288 @@
+"""
+Batch runner for compiling and executing many CASL II programs.
+
+Jobs come from either a directory of `*.cas` source files or a JSONL manifest,
+and are fanned out across a process pool. One JSON result per job is written
+to the output as soon as it completes.
+
+Manifest lines are JSON objects with these fields:
+    id                Job name (defaults to the line number).
+    source | path     The CASL II source text, or a path to it (relative to the manifest).
+    memory            Optional initial data: {"address": [word, ...], ...}.
+                      Addresses may be decimal, or hexadecimal with a '#' prefix.
+    registers         Optional initial values of GR0-GR7.
+    dump              Optional memory ranges to report: [[start, end], ...] (end exclusive).
+    max_instructions  Optional per-job instruction budget.
+    time_limit        Optional per-job wall-clock limit in seconds.
+
+Memory ranges must lie inside the 65536-word address space. A job that
+fails validation gets the status 'invalid_job'; null limits mean the default.
+So does a manifest line that is not a JSON object, has neither `source` nor
+`path`, or names a file that cannot be read; its result carries the line
+number, and the rest of the batch still runs.
+
+For a source directory, a `<name>.json` file next to `<name>.cas` may supply
+the same optional fields for that job.
+
+Usage:
+    python batch.py SOURCES [--jobs N] [--max-instructions N] [--time-limit S] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from compilor import Compiler
+from simulator import COMET2Simulator
+
+DEFAULT_MAX_INSTRUCTIONS = 10_000_000
+DEFAULT_TIME_LIMIT = 10.0
+MEMORY_SIZE = COMET2Simulator.MEMORY_SIZE
+
+
+def _parse_address(value):
+    """Parses a decimal or '#'-prefixed hexadecimal address."""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"Invalid address {value!r}")
+    try:
+        address = value if isinstance(value, int) else \
+            int(value[1:], 16) if value.startswith('#') else int(value)
+    except ValueError:
+        raise ValueError(f"Invalid address {value!r}") from None
+    if not 0 <= address < MEMORY_SIZE:
+        raise ValueError(f"Address {value!r} is outside memory")
+    return address
+
+
+def _is_word(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def initial_memory(job):
+    """
+    Validates a job's "memory" field.
+
+    Returns:
+        A list of (start address, array('H') of words), masked to 16 bits.
+
+    Raises:
+        ValueError: An address is malformed, or a range does not fit in memory.
+    """
+    memory = job.get('memory') or {}
+    if not isinstance(memory, dict):
+        raise ValueError("'memory' must be an object of address: [words]")
+    ranges = []
+    for address, words in memory.items():
+        start = _parse_address(address)
+        if not isinstance(words, list) or not all(_is_word(w) for w in words):
+            raise ValueError(f"Memory at {address!r} must be a list of integers")
+        if start + len(words) > MEMORY_SIZE:
+            raise ValueError(f"Memory at {address!r} ({len(words)} words) runs past the end of memory")
+        ranges.append((start, array('H', [w & COMET2Simulator.WORD_MASK for w in words])))
+    return ranges
+
+
+def validate_job(job):
+    """
+    Checks a job's optional fields before anything is run.
+
+    Raises:
+        ValueError: With a message describing the first problem found.
+    """
+    initial_memory(job)
+    registers = job.get('registers') or []
+    if not isinstance(registers, list) or len(registers) > 8 or not all(_is_word(v) for v in registers):
+        raise ValueError("'registers' must be a list of at most 8 integers")
+    for start, end in job.get('dump') or []:
+        if not (_is_word(start) and _is_word(end) and 0 <= start <= end <= MEMORY_SIZE):
+            raise ValueError(f"Invalid dump range [{start}, {end}]")
+    for name in ('max_instructions', 'time_limit'):
+        value = job.get(name)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+            raise ValueError(f"'{name}' must be a non-negative number")
+
+
+def job_limits(job, max_instructions, time_limit):
+    """Returns the job's (max_instructions, time_limit); missing or null fields take the given defaults."""
+    job_max = job.get('max_instructions')
+    job_time = job.get('time_limit')
+    return (max_instructions if job_max is None else int(job_max),
+            time_limit if job_time is None else float(job_time))
+
+
+def load_jobs(path):
+    """
+    Reads job descriptions from a source directory or a JSONL manifest.
+    A manifest line or sidecar file that cannot be read does not stop the
+    batch: it becomes a job with a 'load_error' (and the manifest 'line'),
+    which `run_job` reports as 'invalid_job'.
+
+    Args:
+        path (str): A directory of `*.cas` files or a JSONL manifest file.
+
+    Returns:
+        A list of job dicts, each with the source text inlined.
+    """
+    jobs = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if not name.endswith('.cas'):
+                continue
+            job = {'id': name[:-len('.cas')]}
+            sidecar = os.path.join(path, job['id'] + '.json')
+            try:
+                if os.path.exists(sidecar):
+                    with open(sidecar) as f:
+                        fields = json.load(f)
+                    if not isinstance(fields, dict):
+                        raise ValueError(f"{job['id']}.json must hold a JSON object")
+                    job.update(fields)
+                with open(os.path.join(path, name)) as f:
+                    job['source'] = f.read()
+            except json.JSONDecodeError as e:
+                job = {'id': name[:-len('.cas')], 'load_error': f"Invalid JSON in {job['id']}.json: {e}"}
+            except (ValueError, OSError) as e:
+                job = {'id': name[:-len('.cas')], 'load_error': str(e)}
+            jobs.append(job)
+        return jobs
+
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            job = {'id': str(line_num)}
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("A manifest line must be a JSON object")
+                job.update(record)
+                if 'source' not in job:
+                    if 'path' not in job:
+                        raise ValueError("A job needs a 'source' or a 'path'")
+                    with open(os.path.join(base, job['path'])) as source_file:
+                        job['source'] = source_file.read()
+            except json.JSONDecodeError as e:
+                job = {'id': job['id'], 'line': line_num, 'load_error': f"Invalid JSON: {e}"}
+            except (ValueError, TypeError, OSError) as e:
+                job = {'id': job['id'], 'line': line_num, 'load_error': str(e)}
+            jobs.append(job)
+    return jobs
+
+
+def run_job(job, max_instructions=DEFAULT_MAX_INSTRUCTIONS, time_limit=DEFAULT_TIME_LIMIT):
+    """
+    Compiles and runs a single job quietly and returns its result.
+
+    Args:
+        job (dict): A job description as returned by `load_jobs`.
+        max_instructions (int): Instruction budget unless the job sets its own.
+        time_limit (float): Wall-clock limit unless the job sets its own.
+
+    Returns:
+        A JSON-serializable dict with the job's status, final machine state,
+        step count and timings.
+    """
+    result = {'id': job['id']}
+    if 'load_error' in job:
+        if 'line' in job:
+            result['line'] = job['line']
+        result.update(status='invalid_job', error=job['load_error'])
+        return result
+    try:
+        validate_job(job)
+    except (ValueError, TypeError) as e:
+        result.update(status='invalid_job', error=str(e))
+        return result
+    try:
+        compile_start = time.perf_counter()
+        compiler = Compiler(verbose=False)
+        machine_code = compiler.compile(job['source'])
+        compile_time = time.perf_counter() - compile_start
+        if machine_code is None:
+            result.update(status='compile_error', error=compiler.error,
+                          timings={'compile': compile_time})
+            return result
+
+        simulator = COMET2Simulator(verbose=False)
+        simulator.load_program(machine_code, compiler.start_address)
+        simulator.pr = compiler.entry_point
+        apply_initial_state(simulator, job)
+
+        stats = simulator.run_turbo(*job_limits(job, max_instructions, time_limit))
+    except Exception as e:
+        result.update(status='crash', error=f"{type(e).__name__}: {e}")
+        return result
+
+    result.update(final_state(simulator, stats, job))
+    result['timings'] = {'compile': compile_time, 'run': stats['elapsed']}
+    return result
+
+
+def apply_initial_state(simulator, job):
+    """
+    Writes a job's optional initial memory and registers into a loaded
+    simulator. Memory is written through `store_words`, so patched code is
+    decoded again. Raises ValueError (before writing anything) if the
+    memory ranges are invalid.
+    """
+    for start, words in initial_memory(job):
+        simulator.store_words(start, words)
+    for i, value in enumerate(job.get('registers') or []):
+        simulator.gr[i] = value & simulator.WORD_MASK
+
+
+def final_state(simulator, stats, job):
+    """Returns the result fields describing a finished run of a job."""
+    return {
+        'status': stats['status'],
+        'error': simulator.fault,
+        'registers': list(simulator.gr),
+        'pr': simulator.pr,
+        'flags': {'of': simulator.of, 'sf': simulator.sf, 'zf': simulator.zf},
+        'memory': [{'start': start, 'words': list(simulator.memory[start:end])}
+                   for start, end in job.get('dump', [])],
+        'steps': stats['instructions'],
+    }
+
+
+def run_batch(jobs, workers=None, max_instructions=DEFAULT_MAX_INSTRUCTIONS, time_limit=DEFAULT_TIME_LIMIT):
+    """
+    Runs jobs across a process pool.
+
+    Yields:
+        Result dicts in completion order.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_job, job, max_instructions, time_limit) for job in jobs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile and run many CASL II programs in parallel.")
+    parser.add_argument('sources', help="directory of .cas files or JSONL manifest")
+    parser.add_argument('--jobs', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--max-instructions', type=int, default=DEFAULT_MAX_INSTRUCTIONS)
+    parser.add_argument('--time-limit', type=float, default=DEFAULT_TIME_LIMIT)
+    parser.add_argument('--output', help="write JSONL results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs(args.sources)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for result in run_batch(jobs, args.jobs, args.max_instructions, args.time_limit):
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Compares the two-pass assembler (`Compiler.compile`, whose hexadecimal words
+are converted to integers as the simulator does) with the single-pass
+assembler (`Compiler.compile_single_pass`) on generated sources.
+
+Usage:
+    python benchmarks/assembler_passes.py [--blocks N] [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compilor import Compiler
+
+
+def generate_source(blocks):
+    """
+    Returns a CASL II source of `blocks` repetitions of a small loop body.
+    Every block jumps forward to the next one, so half of the label
+    references are forward references.
+    """
+    lines = ["MAIN     START"]
+    for i in range(blocks):
+        lines += [
+            f"L{i}      LD    GR1,A{i}",
+            f"         ADDA  GR1,B{i}",
+            f"         LD    GR2,GR1",
+            f"         ST    GR1,C{i}",
+            f"         JUMP  L{i + 1}",
+            f"A{i}      DC    {i % 1000}",
+            f"B{i}      DC    {i % 7},{i % 11}",
+            f"C{i}      DS    2",
+        ]
+    lines += [f"L{blocks}      RET", "         END"]
+    return "\n".join(lines)
+
+
+def best_time(function, repeat):
+    """Returns (best wall-clock time, last result) over `repeat` calls."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark single-pass against two-pass assembly.")
+    parser.add_argument('--blocks', type=int, default=4000, help="generated blocks (8 lines, 15 words each)")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    source = generate_source(args.blocks)
+    line_count = source.count('\n') + 1
+    compiler = Compiler(verbose=False)
+
+    def two_pass():
+        return [int(word, 16) for word in compiler.compile(source)]
+
+    two_pass_time, two_pass_words = best_time(two_pass, args.repeat)
+    single_pass_time, single_pass_words = best_time(lambda: compiler.compile_single_pass(source), args.repeat)
+
+    if two_pass_words != single_pass_words.tolist():
+        print("MISMATCH: the assemblers produced different images.")
+        return 1
+    print(f"Source: {line_count} lines, {len(single_pass_words)} words")
+    print(f"Two-pass:    {two_pass_time * 1000:8.1f} ms  {line_count / two_pass_time:12,.0f} lines/s")
+    print(f"Single-pass: {single_pass_time * 1000:8.1f} ms  {line_count / single_pass_time:12,.0f} lines/s")
+    print(f"Speedup: {two_pass_time / single_pass_time:.2f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
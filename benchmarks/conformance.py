@@ -0,0 +1,501 @@
+"""
+Per-instruction conformance and throughput suite for the COMET II engines.
+
+Conformance: every instruction form in isa.INSTRUCTION_SET (except SVC,
+whose effect belongs to the attached I/O backend) is executed on edge-case
+operands (0, 1, 7FFF, 8000, FFFF, ...), shift counts (0, 1, 15, 16, 17,
+FFFF, ...) and flag combinations, and the final registers, flags, PR, SP and
+memory are compared with an independent reference model written in plain
+signed and unsigned integer arithmetic. The fused superinstructions
+(LD/ADDA/ST groups, compare and conditional jump, LAD and JUMP) are
+checked with the sequences they replace. Engines:
+
+    plain     COMET2Simulator.run_turbo without fusion
+    turbo     COMET2Simulator.run_turbo (fused handlers where they apply)
+    block     BlockCompiler.run
+    vector    VectorCOMET2Simulator.run (skipped if NumPy is missing)
+
+Throughput: instructions/s of each instruction form on the plain
+interpreter and the block compiler, measured on straight-line runs of one
+instruction after a warm-up run.
+
+Usage:
+    python benchmarks/conformance.py [--no-throughput] [--repeat N] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import sys
+from array import array
+from collections import namedtuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import isa
+from block_compiler import BlockCompiler
+from simulator import COMET2Simulator
+
+try:
+    from vector_simulator import VectorCOMET2Simulator
+except ImportError:
+    VectorCOMET2Simulator = None
+
+EDGE_VALUES = [0x0000, 0x0001, 0x0002, 0x1234, 0x5555, 0x7FFE, 0x7FFF,
+               0x8000, 0x8001, 0xAAAA, 0xFFFE, 0xFFFF]
+SHIFT_COUNTS = [0, 1, 2, 7, 14, 15, 16, 17, 18, 31, 0x8000, 0xFFFF]
+FLAG_STATES = [(of, sf, zf) for of in (0, 1) for sf in (0, 1) for zf in (0, 1)]
+
+# Case layout: code from 0, an operand word at DATA, jump and return
+# targets (zero memory, so HALT) at TARGET, and a stack inside the window.
+DATA = 0x10
+TARGET = 0x20
+STACK = 0x28
+WINDOW = (0, 0x30)
+
+FORMAT_OPERANDS = {isa.FORMAT_R_ADR: 'r,adr', isa.FORMAT_ADR: 'adr', isa.FORMAT_NONE: '',
+                   isa.FORMAT_R_R: 'r1,r2', isa.FORMAT_R: 'r'}
+
+# One executed instruction: the isa.Instruction and its decoded fields.
+Step = namedtuple('Step', 'entry r x adr')
+# A program (instruction words from address 0) with its initial state.
+Case = namedtuple('Case', 'name words steps state')
+
+SHIFTS = ('SLA', 'SRA', 'SLL', 'SRL')
+BRANCHES = ('JUMP', 'JPL', 'JMI', 'JNZ', 'JZE', 'JOV')
+
+
+def form_name(entry):
+    return f"{entry.mnemonic} {FORMAT_OPERANDS[entry.format]}".strip()
+
+
+def signed(value):
+    return value - 0x10000 if value & 0x8000 else value
+
+
+# --- Reference model ---
+
+def _shift_reference(mnemonic, value, count):
+    """Shifts one bit at a time; OF is the last bit shifted out (0 for a count of 0)."""
+    sign = value & 0x8000
+    overflow = 0
+    for _ in range(count):
+        if mnemonic == 'SLA':
+            overflow = (value >> 14) & 1
+            value = sign | ((value << 1) & 0x7FFF)
+        elif mnemonic == 'SRA':
+            overflow = value & 1
+            value = sign | (value >> 1)
+        elif mnemonic == 'SLL':
+            overflow = value >> 15
+            value = (value << 1) & 0xFFFF
+        else:
+            overflow = value & 1
+            value >>= 1
+    return value, overflow
+
+
+def _arithmetic_reference(mnemonic, a, b):
+    """Returns (result, OF) of an arithmetic or logical instruction."""
+    if mnemonic in ('ADDA', 'SUBA'):
+        exact = signed(a) + signed(b) if mnemonic == 'ADDA' else signed(a) - signed(b)
+        return exact % 0x10000, int(not -0x8000 <= exact <= 0x7FFF)
+    if mnemonic in ('ADDL', 'SUBL'):
+        exact = a + b if mnemonic == 'ADDL' else a - b
+        return exact % 0x10000, int(not 0 <= exact <= 0xFFFF)
+    if mnemonic == 'AND':
+        return a & b, 0
+    if mnemonic == 'OR':
+        return a | b, 0
+    return a ^ b, 0
+
+
+def reference_run(case):
+    """
+    Executes a case's steps on the reference model.
+
+    Returns:
+        The expected final state (see `final_state`).
+    """
+    state = case.state
+    gr = list(state['gr'])
+    of, sf, zf = state['flags']
+    sp = state['sp']
+    memory = dict(state['memory'])
+    steps = {}
+    address = 0
+    for step in case.steps:
+        steps[address] = step
+        address += step.entry.length
+
+    pr, halted = 0, False
+    while pr in steps and not halted:
+        entry, r, x, adr = steps[pr]
+        pr += entry.length
+        mnemonic = entry.mnemonic
+        register_form = entry.format == isa.FORMAT_R_R
+        ea = (adr + gr[x]) % 0x10000 if x and not register_form else adr
+        operand = gr[x] if register_form else memory.get(ea, 0)
+        if mnemonic == 'LD':
+            gr[r] = operand
+            of, sf, zf = 0, operand >> 15, int(operand == 0)
+        elif mnemonic == 'ST':
+            memory[ea] = gr[r]
+        elif mnemonic == 'LAD':
+            gr[r] = ea
+        elif mnemonic in ('ADDA', 'SUBA', 'ADDL', 'SUBL', 'AND', 'OR', 'XOR'):
+            gr[r], of = _arithmetic_reference(mnemonic, gr[r], operand)
+            sf, zf = gr[r] >> 15, int(gr[r] == 0)
+        elif mnemonic in ('CPA', 'CPL'):
+            a, b = (signed(gr[r]), signed(operand)) if mnemonic == 'CPA' else (gr[r], operand)
+            of, sf, zf = 0, int(a < b), int(a == b)
+        elif mnemonic in SHIFTS:
+            gr[r], of = _shift_reference(mnemonic, gr[r], ea)
+            sf, zf = gr[r] >> 15, int(gr[r] == 0)
+        elif mnemonic in BRANCHES:
+            taken = {'JUMP': True, 'JPL': not sf and not zf, 'JMI': sf == 1, 'JNZ': zf == 0,
+                     'JZE': zf == 1, 'JOV': of == 1}[mnemonic]
+            if taken:
+                pr = ea
+        elif mnemonic == 'PUSH':
+            sp = (sp - 1) % 0x10000
+            memory[sp] = ea
+        elif mnemonic == 'POP':
+            gr[r] = memory.get(sp, 0)
+            sp = (sp + 1) % 0x10000
+        elif mnemonic == 'CALL':
+            sp = (sp - 1) % 0x10000
+            memory[sp] = pr
+            pr = ea
+        elif mnemonic == 'RET':
+            if sp == 0:
+                halted = True
+            else:
+                pr = memory.get(sp, 0)
+                sp = (sp + 1) % 0x10000
+    if not halted:
+        pr += 1   # the HALT (zero word) that ends every case
+    return {'gr': gr, 'flags': (of, sf, zf), 'pr': pr, 'sp': sp,
+            'memory': {address: memory.get(address, 0) for address in watched_addresses(case)}}
+
+
+def watched_addresses(case):
+    """Memory words compared after a case: the operand word and the stack."""
+    return sorted({DATA, DATA + 1, STACK - 2, STACK - 1, STACK, 0xFFFF} | set(case.state['memory']))
+
+
+# --- Cases ---
+
+def encode(steps):
+    words = []
+    for entry, r, x, adr in steps:
+        words.append(entry.opcode << 8 | r << 4 | x)
+        if entry.length == 2:
+            words.append(adr)
+    return words
+
+
+def make_case(name, steps, gr=None, flags=(0, 0, 0), sp=0, memory=None):
+    registers = [0] * 8
+    for index, value in (gr or {}).items():
+        registers[index] = value
+    state = {'gr': registers, 'flags': flags, 'sp': sp, 'memory': dict(memory or {})}
+    return Case(name, encode(steps), steps, state)
+
+
+def instruction_cases(entry):
+    """Returns the conformance cases of one instruction form."""
+    mnemonic = entry.mnemonic
+    name = form_name(entry)
+    cases = []
+    flag_cycle = FLAG_STATES * len(EDGE_VALUES)
+    if mnemonic in SHIFTS:
+        for i, value in enumerate(EDGE_VALUES):
+            for count in SHIFT_COUNTS:
+                flags = flag_cycle[i]
+                # The count as a constant, and through an index register.
+                cases.append(make_case(name, [Step(entry, 1, 0, count)], {1: value}, flags))
+                cases.append(make_case(name, [Step(entry, 1, 2, 0)], {1: value, 2: count}, flags))
+    elif entry.format == isa.FORMAT_R_ADR:
+        for i, a in enumerate(EDGE_VALUES):
+            for j, b in enumerate(EDGE_VALUES):
+                flags = flag_cycle[i + j]
+                cases.append(make_case(name, [Step(entry, 1, 0, DATA)], {1: a}, flags, memory={DATA: b}))
+            # Indexed, with the index register also the target register.
+            cases.append(make_case(name, [Step(entry, 3, 3, DATA - 3)], {3: 3}, flag_cycle[i],
+                                   memory={DATA: a}))
+            cases.append(make_case(name, [Step(entry, 1, 2, DATA - 5)], {1: a, 2: 5}, flag_cycle[i],
+                                   memory={DATA: EDGE_VALUES[-1 - i]}))
+    elif entry.format == isa.FORMAT_R_R:
+        for i, a in enumerate(EDGE_VALUES):
+            for j, b in enumerate(EDGE_VALUES):
+                cases.append(make_case(name, [Step(entry, 1, 2, 0)], {1: a, 2: b}, flag_cycle[i + j]))
+            cases.append(make_case(name, [Step(entry, 4, 4, 0)], {4: a}, flag_cycle[i]))
+    elif mnemonic in BRANCHES:
+        for flags in FLAG_STATES:
+            cases.append(make_case(name, [Step(entry, 0, 0, TARGET)], flags=flags))
+            cases.append(make_case(name, [Step(entry, 0, 5, TARGET - 7)], {5: 7}, flags))
+    elif mnemonic == 'PUSH':
+        for i, value in enumerate(EDGE_VALUES):
+            cases.append(make_case(name, [Step(entry, 0, 0, value)], flags=flag_cycle[i], sp=STACK))
+            cases.append(make_case(name, [Step(entry, 0, 6, value)], {6: 3}, flag_cycle[i], sp=STACK))
+    elif mnemonic == 'POP':
+        for i, value in enumerate(EDGE_VALUES):
+            cases.append(make_case(name, [Step(entry, 7, 0, 0)], flags=flag_cycle[i], sp=STACK - 1,
+                                   memory={STACK - 1: value}))
+    elif mnemonic == 'CALL':
+        for flags in FLAG_STATES:
+            cases.append(make_case(name, [Step(entry, 0, 0, TARGET)], flags=flags, sp=STACK))
+            cases.append(make_case(name, [Step(entry, 0, 1, TARGET - 1)], {1: 1}, flags, sp=STACK))
+    elif mnemonic == 'RET':
+        for flags in FLAG_STATES:
+            cases.append(make_case(name, [Step(entry, 0, 0, 0)], flags=flags, sp=STACK - 1,
+                                   memory={STACK - 1: TARGET}))
+            # An empty stack halts.
+            cases.append(make_case(name, [Step(entry, 0, 0, 0)], flags=flags, sp=0))
+    return cases
+
+
+def fused_cases():
+    """Cases for the instruction sequences that the simulator fuses."""
+    ld, adda, st = isa.ENCODE['LD'], isa.ENCODE['ADDA'], isa.ENCODE['ST']
+    sequences = {
+        'LD;ADDA;ST': [Step(ld, 1, 0, DATA), Step(adda, 1, 0, DATA + 1), Step(st, 1, 0, DATA)],
+        'LD;ADDA': [Step(ld, 1, 0, DATA), Step(adda, 1, 0, DATA + 1)],
+        'ADDA;ST': [Step(adda, 1, 0, DATA + 1), Step(st, 1, 0, DATA)],
+        'LD;ST': [Step(ld, 1, 0, DATA + 1), Step(st, 1, 0, DATA)],
+    }
+    cases = []
+    for name, steps in sequences.items():
+        for i, a in enumerate(EDGE_VALUES):
+            for j, b in enumerate(EDGE_VALUES):
+                cases.append(make_case(name, steps, {1: b}, FLAG_STATES[(i + j) % 8],
+                                       memory={DATA: a, DATA + 1: b}))
+
+    # A compare and a conditional jump, taken (to TARGET) or not.
+    for compare in (isa.ENCODE['CPA'], isa.ENCODE['CPL'],
+                    isa.REGISTER_FORMS['CPA'], isa.REGISTER_FORMS['CPL']):
+        register_form = compare.format == isa.FORMAT_R_R
+        for mnemonic in ('JPL', 'JMI', 'JNZ', 'JZE', 'JOV'):
+            steps = [Step(compare, 1, 2, 0) if register_form else Step(compare, 1, 0, DATA),
+                     Step(isa.ENCODE[mnemonic], 0, 0, TARGET)]
+            name = f"{form_name(compare)};{mnemonic}"
+            for i, a in enumerate(EDGE_VALUES):
+                for j, b in enumerate(EDGE_VALUES):
+                    cases.append(make_case(name, steps, {1: a, 2: b}, FLAG_STATES[(i + j) % 8],
+                                           memory={DATA: b}))
+
+    # LAD and JUMP, directly and through the register LAD just loaded.
+    lad, jump = isa.ENCODE['LAD'], isa.ENCODE['JUMP']
+    for i, a in enumerate(EDGE_VALUES):
+        for k in range(8):
+            flags = FLAG_STATES[(i + k) % 8]
+            cases.append(make_case('LAD;JUMP', [Step(lad, 1, 0, a), Step(jump, 0, 0, TARGET + k)],
+                                   {1: k}, flags))
+            cases.append(make_case('LAD;JUMP', [Step(lad, 1, 0, k), Step(jump, 0, 1, TARGET)],
+                                   {1: a}, flags))
+    return cases
+
+
+def all_cases():
+    cases = []
+    for entry in isa.DECODE:
+        if entry is not None and entry.mnemonic != 'SVC':
+            cases.extend(instruction_cases(entry))
+    return cases + fused_cases()
+
+
+# --- Engines ---
+
+def final_state(case, gr, flags, pr, sp, memory):
+    return {'gr': [int(value) for value in gr], 'flags': tuple(int(flag) for flag in flags),
+            'pr': int(pr), 'sp': int(sp),
+            'memory': {address: int(memory(address)) for address in watched_addresses(case)}}
+
+
+def _prepared_simulator(case, fusion):
+    simulator = COMET2Simulator(verbose=False, fusion=fusion)
+    for address, value in case.state['memory'].items():
+        simulator.memory[address] = value
+    # Loaded after the data so that fusion analysis sees the final image.
+    simulator.load_image(array('H', case.words))
+    simulator.gr[:] = array('H', case.state['gr'])
+    simulator.of, simulator.sf, simulator.zf = case.state['flags']
+    simulator.sp = case.state['sp']
+    return simulator
+
+
+def run_scalar(case, engine):
+    """Runs a case on 'plain', 'turbo' or 'block' and returns its final state."""
+    simulator = _prepared_simulator(case, fusion=engine != 'plain')
+    if engine == 'block':
+        BlockCompiler(simulator).run(max_instructions=100)
+    else:
+        simulator.run_turbo(max_instructions=100)
+    return final_state(case, simulator.gr, (simulator.of, simulator.sf, simulator.zf),
+                       simulator.pr, simulator.sp, simulator.memory.__getitem__)
+
+
+def run_vector(cases):
+    """Runs cases that share one program as lanes of a VectorCOMET2Simulator."""
+    words = cases[0].words
+    vector = VectorCOMET2Simulator(len(cases))
+    vector.load_program([f"{word:04X}" for word in words], 0, WINDOW)
+    for lane, case in enumerate(cases):
+        vector.gr[lane] = case.state['gr']
+        vector.of[lane], vector.sf[lane], vector.zf[lane] = case.state['flags']
+        vector.sp[lane] = case.state['sp']
+        for address, value in case.state['memory'].items():
+            vector.memory[lane, address - WINDOW[0]] = value
+    vector.run(max_instructions=100)
+
+    def reader(lane):
+        def read(address):
+            if WINDOW[0] <= address < WINDOW[1]:
+                return vector.memory[lane, address - WINDOW[0]]
+            return vector.image[address]
+        return read
+
+    return [final_state(case, vector.gr[lane], (vector.of[lane], vector.sf[lane], vector.zf[lane]),
+                        vector.pr[lane], vector.sp[lane], reader(lane))
+            for lane, case in enumerate(cases)]
+
+
+def describe(case, expected, actual):
+    fields = [name for name in ('gr', 'flags', 'pr', 'sp', 'memory') if expected[name] != actual[name]]
+    state = case.state
+    return (f"{case.name} words={' '.join(f'{w:04X}' for w in case.words)} gr={state['gr']} "
+            f"flags={state['flags']} sp={state['sp']:04X} memory={state['memory']}: "
+            + "; ".join(f"{name} {actual[name]} != expected {expected[name]}" for name in fields))
+
+
+def check_conformance(cases, verbose_failures=5):
+    """
+    Runs every case on every engine.
+
+    Returns:
+        {form name: {engine: failures}} and the number of failures.
+    """
+    engines = ['plain', 'turbo', 'block'] + (['vector'] if VectorCOMET2Simulator is not None else [])
+    expected = [reference_run(case) for case in cases]
+    results = {}
+    failures = 0
+
+    def record(case, engine, want, got):
+        nonlocal failures
+        counts = results.setdefault(case.name, dict.fromkeys(engines, 0))
+        if want != got:
+            counts[engine] += 1
+            failures += 1
+            if failures <= verbose_failures:
+                print(f"  FAIL [{engine}] {describe(case, want, got)}")
+
+    for case, want in zip(cases, expected):
+        for engine in ('plain', 'turbo', 'block'):
+            record(case, engine, want, run_scalar(case, engine))
+
+    if VectorCOMET2Simulator is not None:
+        groups = {}
+        for index, case in enumerate(cases):
+            groups.setdefault(tuple(case.words), []).append(index)
+        for indexes in groups.values():
+            for index, got in zip(indexes, run_vector([cases[i] for i in indexes])):
+                record(cases[index], 'vector', expected[index], got)
+    return results, failures
+
+
+# --- Throughput ---
+
+THROUGHPUT_LENGTH = 4000   # instructions per straight-line run
+
+
+def throughput_program(entry):
+    """
+    Returns (words, initial SP, stack contents) for a straight-line run of
+    THROUGHPUT_LENGTH copies of one instruction followed by HALT. Branches
+    and CALL target the next copy; RET and POP consume a prepared stack.
+    """
+    mnemonic = entry.mnemonic
+    words, stack = [], {}
+    data = THROUGHPUT_LENGTH * entry.length + 1
+    for i in range(THROUGHPUT_LENGTH):
+        address = len(words)
+        if entry.format == isa.FORMAT_R_R:
+            words.append(entry.opcode << 8 | 0x12)
+        elif entry.format == isa.FORMAT_R:
+            words.append(entry.opcode << 8 | 0x10)
+        elif entry.format == isa.FORMAT_NONE:
+            words.append(entry.opcode << 8)
+            stack[0x8000 + i] = address + 1
+        elif mnemonic in SHIFTS:
+            words += [entry.opcode << 8 | 0x10, 1]
+        elif entry.format == isa.FORMAT_R_ADR:
+            words += [entry.opcode << 8 | 0x10, data]
+        else:
+            words += [entry.opcode << 8, address + 2]
+    if mnemonic == 'POP':
+        stack = {0x8000 + i: i for i in range(THROUGHPUT_LENGTH)}
+    sp = 0x8000 if stack else 0
+    return words + [0x0000, 0x0123], sp, stack
+
+
+def measure_throughput(entry, repeat):
+    """Returns (plain, block) instructions/s for one instruction form."""
+    words, sp, stack = throughput_program(entry)
+    rates = []
+    for use_blocks in (False, True):
+        simulator = COMET2Simulator(verbose=False, fusion=False)
+        simulator.load_image(array('H', words))
+        engine = BlockCompiler(simulator) if use_blocks else None
+        best = None
+        for _ in range(repeat + 1):   # the first run warms the decode and block caches
+            for address, value in stack.items():
+                simulator.memory[address] = value
+            simulator.pr, simulator.sp = 0, sp
+            simulator.gr[:] = array('H', [0, 0x1234, 3, 0, 0, 0, 0, 0])
+            stats = engine.run() if use_blocks else simulator.run_turbo()
+            elapsed = stats['elapsed']
+            if best is None or elapsed < best:
+                best = elapsed
+        rates.append(stats['instructions'] / best if best > 0 else 0.0)
+    return rates
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check every COMET II instruction on every engine and time it.")
+    parser.add_argument('--no-throughput', action='store_true', help="only run the conformance checks")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per measurement (best is kept)")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    cases = all_cases()
+    print(f"Conformance: {len(cases)} cases"
+          + ("" if VectorCOMET2Simulator is not None else " (NumPy missing: vector engine skipped)"))
+    results, failures = check_conformance(cases)
+    for name, counts in results.items():
+        status = "ok" if not any(counts.values()) else \
+            ", ".join(f"{engine}: {count} failed" for engine, count in counts.items() if count)
+        print(f"  {name:<14} {status}")
+    print(f"{failures} failures")
+
+    metrics = {}
+    if not args.no_throughput:
+        print(f"\n{'Throughput':<14} {'plain':>14} {'block':>14}   (instructions/s)")
+        for entry in isa.DECODE:
+            if entry is None or entry.mnemonic == 'SVC':
+                continue
+            plain, block = measure_throughput(entry, args.repeat)
+            name = form_name(entry)
+            metrics[f'throughput.{name}.plain_instructions_per_s'] = plain
+            metrics[f'throughput.{name}.block_instructions_per_s'] = block
+            print(f"  {name:<12} {plain:>14,.0f} {block:>14,.0f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'conformance': results, 'failures': failures, 'metrics': metrics}, f, indent=1)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,265 @@
+"""
+Benchmark suite for the assembler and the simulator.
+
+Workloads are the CASL II programs in benchmarks/corpus (each `<name>.cas`
+may have a `<name>.json` sidecar in the batch.py job format, whose "expect"
+field gives the memory words, by label, and OUT records the run must
+produce) and generated stress sources.
+
+Measured:
+    startup    Starting Python and importing the compiler and simulator (in
+               a subprocess), and constructing a Compiler and a simulator.
+    assemble   Compiler.compile and Compiler.compile_single_pass, lines/s.
+    simulate   COMET2Simulator.run_turbo and BlockCompiler.run,
+               instructions/s, with the final status and whether the
+               expected results were produced.
+    memory     Peak traced allocation (tracemalloc) while assembling the
+               largest stress source and while running the corpus.
+
+Results are printed and can be written as JSON (--output). Given an
+earlier results file (--compare), every metric that got worse by more than
+--threshold is listed and the exit status is 1. Metric names ending in
+'_per_s' are better when higher; all others ('_s', '_bytes') when lower.
+
+Usage:
+    python benchmarks/run_suite.py [--repeat N] [--output FILE] [--compare FILE] [--threshold F]
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from assembler_passes import best_time, generate_source
+from batch import apply_initial_state, load_jobs
+from block_compiler import BlockCompiler
+from compilor import Compiler
+from simulator import COMET2Simulator
+from svc_io import BufferedBackend
+
+CORPUS = os.path.join(ROOT, 'benchmarks', 'corpus')
+MAX_INSTRUCTIONS = 10_000_000
+
+
+def generate_table_source(words):
+    """Returns a source made of one large DC table of `words` constants, 16 per line."""
+    lines = ["TABLE    START", "         RET"]
+    for i in range(0, words, 16):
+        label = "TAB" if i == 0 else ""
+        values = ",".join(str((i + j) * 7919 % 65536 - 32768) for j in range(min(16, words - i)))
+        lines.append(f"{label:<8} DC    {values}")
+    lines.append("         END")
+    return "\n".join(lines)
+
+
+def generate_straight_line_source(blocks):
+    """
+    Returns a branch-free source of `blocks` LD/ADDA/ST/LAD groups that
+    accumulates into C, with its expected result.
+    """
+    lines = ["LINE     START", "         LAD   GR2,0"]
+    for _ in range(blocks):
+        lines += ["         LD    GR1,C",
+                  "         ADDA  GR1,A",
+                  "         ST    GR1,C",
+                  "         LAD   GR2,1,GR2"]
+    lines += ["         ST    GR2,N", "         RET", "A        DC    3", "C        DC    0", "N        DS    1", "         END"]
+    return "\n".join(lines), {'memory': {'C': [3 * blocks & 0xFFFF], 'N': [blocks]}}
+
+
+def stress_jobs():
+    """Returns generated simulator workloads as corpus-style jobs."""
+    source, expect = generate_straight_line_source(8000)
+    return [{'id': 'stress_straight_line', 'source': source, 'expect': expect}]
+
+
+def stress_sources():
+    """Returns [(name, source)] of generated assembler workloads."""
+    return [
+        ('stress_blocks', generate_source(4000)),
+        ('stress_table', generate_table_source(32768)),
+    ]
+
+
+def check_expectations(job, compiler, simulator, backend):
+    """True or False for whether the run produced the job's "expect" results, None if it has none."""
+    expect = job.get('expect')
+    if not expect:
+        return None
+    for label, words in expect.get('memory', {}).items():
+        address = compiler.symbol_table[label]
+        if simulator.memory[address:address + len(words)].tolist() != words:
+            return False
+    if 'output' in expect and backend.records != expect['output']:
+        return False
+    return True
+
+
+def run_program(job, compiler, engine):
+    """
+    Runs an assembled corpus job once on a fresh simulator.
+    :param engine: 'turbo' or 'block'.
+    :return: (run statistics, whether the expected results were produced).
+    """
+    simulator = COMET2Simulator(verbose=False)
+    simulator.load_program(compiler.machine_code, compiler.start_address)
+    simulator.pr = compiler.entry_point
+    apply_initial_state(simulator, job)
+    backend = BufferedBackend(job.get('input'))
+    backend.attach(simulator)
+    max_instructions = job.get('max_instructions', MAX_INSTRUCTIONS)
+    if engine == 'block':
+        stats = BlockCompiler(simulator).run(max_instructions)
+    else:
+        stats = simulator.run_turbo(max_instructions)
+    return stats, check_expectations(job, compiler, simulator, backend)
+
+
+def measure_startup(repeat):
+    metrics = {}
+    command = [sys.executable, '-c', 'import compilor, simulator']
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    metrics['startup.import_s'] = best
+    metrics['startup.compiler_init_s'] = min(timeit.repeat(lambda: Compiler(verbose=False), number=100, repeat=repeat)) / 100
+    metrics['startup.simulator_init_s'] = min(timeit.repeat(lambda: COMET2Simulator(verbose=False), number=100, repeat=repeat)) / 100
+    return metrics
+
+
+def measure_assembler(workloads, repeat):
+    metrics = {}
+    compiler = Compiler(verbose=False)
+    for name, source in workloads:
+        lines = source.count('\n') + 1
+        two_pass, _ = best_time(lambda: compiler.compile(source), repeat)
+        single_pass, _ = best_time(lambda: compiler.compile_single_pass(source), repeat)
+        metrics[f'assemble.{name}.two_pass_lines_per_s'] = lines / two_pass
+        metrics[f'assemble.{name}.single_pass_lines_per_s'] = lines / single_pass
+    return metrics
+
+
+def measure_simulator(jobs, repeat):
+    metrics, runs = {}, {}
+    for job in jobs:
+        compiler = Compiler(verbose=False)
+        if compiler.compile(job['source']) is None:
+            runs[job['id']] = {'status': 'compile_error', 'error': compiler.error}
+            continue
+        for engine in ('turbo', 'block'):
+            best = None
+            for _ in range(repeat):
+                stats, correct = run_program(job, compiler, engine)
+                if best is None or stats['elapsed'] < best['elapsed']:
+                    best = stats
+            key = f"{job['id']}.{engine}"
+            runs[key] = {'status': best['status'], 'instructions': best['instructions'], 'correct': correct}
+            if best['elapsed'] > 0:
+                metrics[f'simulate.{key}.instructions_per_s'] = best['instructions'] / best['elapsed']
+    return metrics, runs
+
+
+def measure_memory(workloads, jobs):
+    metrics = {}
+    name, source = max(workloads, key=lambda workload: len(workload[1]))
+    tracemalloc.start()
+    Compiler(verbose=False).compile(source)
+    metrics[f'memory.assemble.{name}_bytes'] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    for job in jobs:
+        compiler = Compiler(verbose=False)
+        if compiler.compile(job['source']) is not None:
+            run_program(job, compiler, 'turbo')
+    metrics['memory.simulate.corpus_bytes'] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return metrics
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Returns [(metric, old, new, change)] for metrics that got worse by more than `threshold`."""
+    regressions = []
+    for name, new in results['metrics'].items():
+        old = baseline.get('metrics', {}).get(name)
+        if not old or new is None:
+            continue
+        change = new / old - 1
+        worse = -change if name.endswith('_per_s') else change
+        if worse > threshold:
+            regressions.append((name, old, new, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the assembler and simulator benchmark suite.")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per measurement (best is kept)")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--compare', help="results file of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="relative change reported as a regression")
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs(CORPUS) + stress_jobs()
+    workloads = [(job['id'], job['source']) for job in jobs] + stress_sources()
+
+    metrics = {}
+    metrics.update(measure_startup(args.repeat))
+    metrics.update(measure_assembler(workloads, args.repeat))
+    simulate_metrics, runs = measure_simulator(jobs, args.repeat)
+    metrics.update(simulate_metrics)
+    metrics.update(measure_memory(workloads, jobs))
+
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+        },
+        'metrics': metrics,
+        'runs': runs,
+    }
+
+    for name, value in metrics.items():
+        print(f"{name:<60} {value:>16,.6g}")
+    print()
+    for name, run in runs.items():
+        print(f"{name:<30} {run.get('status')!s:<14} {run.get('instructions', 0):>10} instructions  "
+              f"correct={run.get('correct')}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        print(f"\nCompared with {args.compare} ({baseline.get('meta', {}).get('revision')}):")
+        for name, old, new, change in regressions:
+            print(f"  REGRESSION {name}: {old:,.6g} -> {new:,.6g} ({change:+.1%})")
+        if regressions:
+            return 1
+        print("  no regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
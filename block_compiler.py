@@ -0,0 +1,475 @@
+# block_compiler.py
+# An optional execution engine that translates basic blocks of COMET II code
+# into generated Python functions.
+
+import time
+import instructions
+
+
+class _BlockSource:
+    """
+    Accumulates the source of one generated block function.
+    Registers are kept in local variables (g0-g7) while the block runs and are
+    written back to the simulator at every exit from the block. The flags are
+    kept as the word they were last derived from (`fv`: SF is its sign bit,
+    ZF is set if it is zero) and the overflow flag (`fo`).
+    """
+    def __init__(self, start_address):
+        self.start_address = start_address
+        self.body = []
+        self.loaded = set()   # registers read into locals in the prologue
+        self.dirty = set()    # registers written by the block
+        self.sets_flags = False
+        self.terminated = False   # the last instruction always leaves the block
+        self.count = 0        # instructions translated so far
+
+    def reg(self, index):
+        """Returns the local variable name holding register `index`."""
+        self.loaded.add(index)
+        return f"g{index}"
+
+    def write_reg(self, index):
+        """Returns the local variable name for a register the block writes."""
+        self.loaded.add(index)
+        self.dirty.add(index)
+        return f"g{index}"
+
+    def set_flags(self, name, overflow="0"):
+        """Records that SF and ZF are now derived from the local `name`, and OF from `overflow`."""
+        self.body.append(f"    fv = {name}")
+        self.body.append(f"    fo = {overflow}")
+        self.sets_flags = True
+
+    def flag_test(self, condition):
+        """
+        Returns an expression for a branch condition ('pl', 'mi', 'nz', 'ze'
+        or 'ov') on the current flags.
+        """
+        if self.sets_flags:
+            return {'pl': "0 < fv < 0x8000", 'mi': "fv >= 0x8000", 'nz': "fv != 0",
+                    'ze': "fv == 0", 'ov': "fo"}[condition]
+        return {'pl': "not (sim.sf or sim.zf)", 'mi': "sim.sf", 'nz': "not sim.zf",
+                'ze': "sim.zf", 'ov': "sim.of"}[condition]
+
+    def exit_lines(self, next_pr, executed, indent):
+        """Lines that write the state back and leave the block."""
+        pad = " " * indent
+        lines = [f"{pad}gr[{i}] = g{i}" for i in sorted(self.dirty)]
+        if self.sets_flags:
+            lines.append(f"{pad}sim.of = fo")
+            lines.append(f"{pad}sim.sf = fv >> 15")
+            lines.append(f"{pad}sim.zf = 1 if fv == 0 else 0")
+        lines.append(f"{pad}return {next_pr}, {executed}")
+        return lines
+
+    def render(self, next_pr):
+        """Returns the complete source of the block function."""
+        lines = [f"def block_{self.start_address:04X}(sim):",
+                 "    gr = sim.gr",
+                 "    memory = sim.memory",
+                 "    store = sim._store",
+                 "    code_words = sim._code_words"]
+        lines.extend(f"    g{i} = gr[{i}]" for i in sorted(self.loaded))
+        lines.extend(self.body)
+        if not self.terminated:
+            lines.extend(self.exit_lines(next_pr, self.count, 4))
+        return "\n".join(lines) + "\n"
+
+
+class BlockCompiler:
+    """
+    Runs a COMET2Simulator by compiling basic blocks into Python functions.
+
+    A block is a straight-line run of instructions starting at some address.
+    It ends with an unconditional JUMP or a CALL, or before HALT, RET, SVC or
+    any other instruction without a translator, which then runs through the
+    simulator's interpreter. A conditional branch leaves the block when taken
+    and otherwise continues it. Blocks are cached by start address. When a store hits
+    a word of cached code, the affected blocks are discarded and execution
+    returns to the interpreter, so self-modifying programs behave exactly as
+    they do under `COMET2Simulator.run`.
+    """
+    MAX_BLOCK_LENGTH = 64
+
+    def __init__(self, simulator):
+        """
+        Attaches the block compiler to a simulator.
+        :param simulator: The COMET2Simulator whose program should be executed.
+        """
+        self.simulator = simulator
+        # start address -> (function, instruction count), or None if the
+        # instruction at that address cannot start a block.
+        self.blocks = {}
+        # word address -> start addresses of the blocks covering that word
+        self._block_words = {}
+        simulator._invalidation_hooks.append(self._invalidate)
+
+        # Maps interpreter handlers to the methods that translate them.
+        self.translators = {
+            instructions.ld_mem: self._emit_ld_mem,
+            instructions.ld_reg: self._emit_ld_reg,
+            instructions.st: self._emit_st,
+            instructions.lad: self._emit_lad,
+            instructions.push: self._emit_push,
+            instructions.pop: self._emit_pop,
+            instructions.call: self._emit_call,
+            instructions.jump: self._emit_jump,
+        }
+        for name in self.ALU_OPERATIONS:
+            self.translators[getattr(instructions, f"{name}_mem")] = self._alu_mem_translator(name)
+            self.translators[getattr(instructions, f"{name}_reg")] = self._alu_reg_translator(name)
+        for name in ('cpa', 'cpl'):
+            self.translators[getattr(instructions, f"{name}_mem")] = self._compare_mem_translator(name)
+            self.translators[getattr(instructions, f"{name}_reg")] = self._compare_reg_translator(name)
+        for name in self.SHIFTS:
+            self.translators[getattr(instructions, name)] = self._shift_translator(name)
+        for name in ('jpl', 'jmi', 'jnz', 'jze', 'jov'):
+            self.translators[getattr(instructions, name)] = self._branch_translator(name[1:])
+
+    def _invalidate(self, address):
+        """Drops every block covering `address` (all blocks if None)."""
+        if address is None:
+            self.blocks.clear()
+            self._block_words.clear()
+            return
+        for start in self._block_words.pop(address, ()):
+            self.blocks.pop(start, None)
+
+    def _effective_address(self, source, x, adr):
+        """Emits the effective address calculation and returns its expression."""
+        if x == 0:
+            return str(adr)
+        source.body.append(f"    ea = ({adr} + {source.reg(x)}) & 0xFFFF")
+        return "ea"
+
+    def _emit_ld_mem(self, source, pr, r, x, adr):
+        ea = self._effective_address(source, x, adr)
+        target = source.write_reg(r)
+        source.body.append(f"    {target} = memory[{ea}]")
+        source.set_flags(target)
+
+    def _emit_ld_reg(self, source, pr, r1, r2):
+        value = source.reg(r2)
+        target = source.write_reg(r1)
+        source.body.append(f"    {target} = {value}")
+        source.set_flags(target)
+
+    def _emit_st(self, source, pr, r, x, adr):
+        ea = self._effective_address(source, x, adr)
+        value = source.reg(r)
+        source.body.append(f"    hit = {ea} in code_words")
+        source.body.append(f"    store({ea}, {value})")
+        # A store into cached code invalidates it; leave the block right away.
+        source.body.append("    if hit:")
+        source.body.extend(source.exit_lines(pr + 2, source.count + 1, 8))
+
+    def _emit_lad(self, source, pr, r, x, adr):
+        ea = self._effective_address(source, x, adr)
+        target = source.write_reg(r)
+        source.body.append(f"    {target} = {ea}")
+
+    # (result, overflow) templates over the old register value {a} and the
+    # operand {b}; the result is assigned to {t}. An overflow of None means
+    # OF = 0, and then {a} and {b} need no temporaries.
+    ALU_OPERATIONS = {
+        'adda': ("({a} + {b}) & 0xFFFF", "(({a} ^ {t}) & ({b} ^ {t})) >> 15"),
+        'suba': ("({a} - {b}) & 0xFFFF", "(({a} ^ {b}) & ({a} ^ {t})) >> 15"),
+        'addl': ("({a} + {b}) & 0xFFFF", "({a} + {b}) >> 16"),
+        'subl': ("({a} - {b}) & 0xFFFF", "1 if {a} < {b} else 0"),
+        'and': ("{a} & {b}", None),
+        'or': ("{a} | {b}", None),
+        'xor': ("{a} ^ {b}", None),
+    }
+
+    def _emit_alu(self, source, name, r, operand):
+        result, overflow = self.ALU_OPERATIONS[name]
+        target = source.write_reg(r)
+        if overflow is None:
+            source.body.append(f"    {target} = {result.format(a=target, b=operand)}")
+            source.set_flags(target)
+            return
+        source.body.append(f"    a = {target}")
+        source.body.append(f"    b = {operand}")
+        source.body.append(f"    {target} = {result.format(a='a', b='b')}")
+        source.set_flags(target, overflow.format(a='a', b='b', t=target))
+
+    def _alu_mem_translator(self, name):
+        def emit(source, pr, r, x, adr):
+            ea = self._effective_address(source, x, adr)
+            self._emit_alu(source, name, r, f"memory[{ea}]")
+        return emit
+
+    def _alu_reg_translator(self, name):
+        def emit(source, pr, r1, r2):
+            self._emit_alu(source, name, r1, source.reg(r2))
+        return emit
+
+    def _emit_compare(self, source, name, r, operand):
+        # The flags only need the sign and zero-ness of the difference.
+        value = source.reg(r)
+        if name == 'cpa':
+            source.body.append(f"    d = ({value} ^ 0x8000) - ({operand} ^ 0x8000)")
+        else:
+            source.body.append(f"    d = {value} - {operand}")
+        source.body.append("    d = 0x8000 if d < 0 else (1 if d else 0)")
+        source.set_flags("d")
+
+    def _compare_mem_translator(self, name):
+        def emit(source, pr, r, x, adr):
+            ea = self._effective_address(source, x, adr)
+            self._emit_compare(source, name, r, f"memory[{ea}]")
+        return emit
+
+    def _compare_reg_translator(self, name):
+        def emit(source, pr, r1, r2):
+            self._emit_compare(source, name, r1, source.reg(r2))
+        return emit
+
+    # Result templates over the register {a} and the shift count {n}, and the
+    # table of the bit shifted out last, per count (see instructions.py).
+    SHIFTS = {
+        'sla': ("({a} & 0x8000) | (({a} << {n}) & 0x7FFF)", 'SLA_OUT_BIT'),
+        'sra': ("(({a} - (({a} & 0x8000) << 1)) >> {n}) & 0xFFFF", 'SRA_OUT_BIT'),
+        'sll': ("({a} << {n}) & 0xFFFF", 'SLL_OUT_BIT'),
+        'srl': ("{a} >> {n}", 'SRL_OUT_BIT'),
+    }
+
+    def _shift_translator(self, name):
+        result, table = self.SHIFTS[name]
+
+        def emit(source, pr, r, x, adr):
+            target = source.write_reg(r)
+            if x == 0:
+                # A constant count: clamp it and look up the bit now.
+                count = min(adr, instructions.SHIFT_LIMIT)
+                out_bit = getattr(instructions, table)[count]
+                source.body.append(f"    a = {target}")
+                source.body.append(f"    {target} = {result.format(a='a', n=count)}")
+                source.set_flags(target, f"1 if a & {out_bit} else 0" if out_bit else "0")
+                return
+            ea = self._effective_address(source, x, adr)
+            source.body.append(f"    n = {ea} if {ea} < {instructions.SHIFT_LIMIT} else {instructions.SHIFT_LIMIT}")
+            source.body.append(f"    a = {target}")
+            source.body.append(f"    {target} = {result.format(a='a', n='n')}")
+            source.set_flags(target, f"1 if a & {table}[n] else 0")
+        return emit
+
+    def _branch_translator(self, condition):
+        def emit(source, pr, r, x, adr):
+            ea = self._effective_address(source, x, adr)
+            source.body.append(f"    if {source.flag_test(condition)}:")
+            source.body.extend(source.exit_lines(ea, source.count + 1, 8))
+        return emit
+
+    def _emit_jump(self, source, pr, r, x, adr):
+        ea = self._effective_address(source, x, adr)
+        source.body.extend(source.exit_lines(ea, source.count + 1, 4))
+        source.terminated = True
+
+    def _emit_call(self, source, pr, r, x, adr):
+        ea = self._effective_address(source, x, adr)
+        source.body.append("    sp = sim.sp = (sim.sp - 1) & 0xFFFF")
+        source.body.append(f"    store(sp, {pr + 2})")
+        source.body.extend(source.exit_lines(ea, source.count + 1, 4))
+        source.terminated = True
+
+    def _emit_push(self, source, pr, r, x, adr):
+        ea = self._effective_address(source, x, adr)
+        source.body.append("    sp = sim.sp = (sim.sp - 1) & 0xFFFF")
+        source.body.append("    hit = sp in code_words")
+        source.body.append(f"    store(sp, {ea})")
+        source.body.append("    if hit:")
+        source.body.extend(source.exit_lines(pr + 2, source.count + 1, 8))
+
+    def _emit_pop(self, source, pr, r, x):
+        target = source.write_reg(r)
+        source.body.append("    sp = sim.sp")
+        source.body.append(f"    {target} = memory[sp]")
+        source.body.append("    sim.sp = (sp + 1) & 0xFFFF")
+
+    def _compile_block(self, start):
+        """
+        Translates the block starting at `start` and caches it.
+        :return: A (function, instruction count) pair, or None if the
+                 instruction at `start` cannot be translated.
+        """
+        simulator = self.simulator
+        source = _BlockSource(start)
+        pr = start
+        while source.count < self.MAX_BLOCK_LENGTH:
+            entry = simulator._decoded.get(pr) or simulator._decode_at(pr)
+            if entry is None:
+                break
+            exec_func, args, next_pr, _ = entry
+            translator = self.translators.get(exec_func)
+            if translator is None:
+                break
+            translator(source, pr, *args)
+            source.count += 1
+            pr = next_pr
+            if source.terminated:
+                break
+
+        if source.count == 0:
+            block = None
+            end = simulator._decoded[start][2] if start in simulator._decoded else start + 1
+        else:
+            namespace = {table: getattr(instructions, table) for _, table in self.SHIFTS.values()}
+            code = compile(source.render(pr), f"<block {start:04X}>", "exec")
+            exec(code, namespace)
+            block = (namespace[f"block_{start:04X}"], source.count)
+            end = pr
+
+        self.blocks[start] = block
+        for word_address in range(start, end):
+            self._block_words.setdefault(word_address, []).append(start)
+        return block
+
+    def run(self, max_instructions=None, time_limit=None):
+        """
+        Executes the loaded program using compiled blocks where possible.
+        Takes the same limits and returns the same statistics as
+        `COMET2Simulator.run_turbo`.
+        """
+        simulator = self.simulator
+        if simulator._step_hooks or simulator._write_watches:
+            # Step hooks need to see every instruction, and a watched store
+            # must stop the machine right away; blocks would hide both.
+            return simulator.run_turbo(max_instructions, time_limit)
+        blocks = self.blocks
+        check_interval = simulator.DEADLINE_CHECK_INTERVAL
+
+        simulator._begin_run()
+        status = None
+        executed = 0
+        next_check = check_interval
+        start_time = time.perf_counter()
+        deadline = None if time_limit is None else start_time + time_limit
+
+        while simulator.is_running:
+            if max_instructions is not None and executed >= max_instructions:
+                status = 'budget'
+                break
+            if deadline is not None and executed >= next_check:
+                next_check = executed + check_interval
+                if time.perf_counter() >= deadline:
+                    status = 'deadline'
+                    break
+
+            pr = simulator.pr
+            block = blocks[pr] if pr in blocks else self._compile_block(pr)
+            if block is not None and (max_instructions is None
+                                      or block[1] <= max_instructions - executed):
+                simulator.pr, count = block[0](simulator)
+                executed += count
+                continue
+
+            # Block terminators, untranslatable code and traps (breakpoints,
+            # read watchpoints) use the interpreter.
+            if simulator._step() is None:
+                # The Program Counter was out of bounds; nothing was executed.
+                status = 'error'
+                break
+            if not simulator.is_running:
+                executed, status = simulator._stop_result(executed)
+            else:
+                executed += 1
+
+        if status in ('budget', 'deadline'):
+            simulator.is_running = False
+        if simulator.io is not None:
+            simulator.io.flush()
+        elapsed = time.perf_counter() - start_time
+        return {
+            'status': status,
+            'instructions': executed,
+            'elapsed': elapsed,
+            'mips': executed / elapsed / 1e6 if elapsed > 0 else 0.0,
+        }
+
+
+def compare_with_interpreter(machine_code, start_address=0, max_instructions=None):
+    """
+    Runs `machine_code` once through `COMET2Simulator.run_turbo` and once
+    through a BlockCompiler, and returns a list of differences in registers,
+    flags, Program Counter and memory (empty if both engines agree).
+    """
+    from simulator import COMET2Simulator
+
+    results = []
+    for use_blocks in (False, True):
+        simulator = COMET2Simulator(verbose=False)
+        simulator.load_program(machine_code, start_address)
+        if use_blocks:
+            stats = BlockCompiler(simulator).run(max_instructions=max_instructions)
+        else:
+            stats = simulator.run_turbo(max_instructions=max_instructions)
+        results.append((simulator, stats))
+
+    (interp, interp_stats), (blocks, block_stats) = results
+    differences = []
+    for name in ('status', 'instructions'):
+        if interp_stats[name] != block_stats[name]:
+            differences.append(f"{name}: {interp_stats[name]} != {block_stats[name]}")
+    for name in ('pr', 'sp', 'of', 'sf', 'zf'):
+        if getattr(interp, name) != getattr(blocks, name):
+            differences.append(f"{name}: {getattr(interp, name)} != {getattr(blocks, name)}")
+    for i in range(8):
+        if interp.gr[i] != blocks.gr[i]:
+            differences.append(f"GR{i}: {interp.gr[i]} != {blocks.gr[i]}")
+    for address, (a, b) in enumerate(zip(interp.memory, blocks.memory)):
+        if a != b:
+            differences.append(f"mem[{address:04X}]: {a} != {b}")
+    return differences
+
+
+if __name__ == '__main__':
+    import random
+
+    import isa
+
+    # Differential test: random programs built from every instruction but
+    # SVC, including branches, subroutine calls and stores that overwrite
+    # code that has already been compiled. A quarter of the statements are
+    # pairs that the interpreter fuses: a compare and a conditional jump, or
+    # LAD and JUMP.
+    choices = [entry for entry in isa.DECODE if entry is not None and entry.mnemonic != 'SVC']
+    compares = [isa.ENCODE['CPA'], isa.ENCODE['CPL'], isa.REGISTER_FORMS['CPA'], isa.REGISTER_FORMS['CPL']]
+    jumps = [isa.ENCODE[mnemonic] for mnemonic in ('JPL', 'JMI', 'JNZ', 'JZE', 'JOV')]
+    rng = random.Random(2024)
+    failures = 0
+    for trial in range(200):
+        program = []
+        length = rng.randint(1, 40)
+        for _ in range(length):
+            if rng.random() < 0.25:
+                pair = rng.choice([(rng.choice(compares), rng.choice(jumps)),
+                                   (isa.ENCODE['LAD'], isa.ENCODE['JUMP'])])
+            else:
+                pair = (rng.choice(choices),)
+            for entry in pair:
+                r = 0 if entry.format in (isa.FORMAT_ADR, isa.FORMAT_NONE) else rng.randint(0, 7)
+                x = 0 if entry.format in (isa.FORMAT_R, isa.FORMAT_NONE) else rng.choice([0, 0, 0, rng.randint(1, 7)])
+                program.append(f"{entry.opcode:02X}{r}{x}")
+                if entry.length == 2:
+                    program.append(f"{rng.randint(0, 2 * length + 8):04X}")
+        program.append('0000')
+
+        differences = compare_with_interpreter(program, max_instructions=10_000)
+        if differences:
+            failures += 1
+            print(f"Trial {trial}: engines disagree on {program}")
+            for line in differences[:10]:
+                print("  " + line)
+
+    # Programs that run off the end of memory: the fault does not count the
+    # fetch that failed.
+    for machine_code in (['1412'], ['1210'], ['1412', '1412']):
+        differences = compare_with_interpreter(machine_code, 0x10000 - len(machine_code), max_instructions=100)
+        if differences:
+            failures += 1
+            print(f"Out-of-bounds program {machine_code}: engines disagree")
+            for line in differences[:10]:
+                print("  " + line)
+
+    print(f"\nDifferential test complete: {203 - failures}/203 programs agree.")
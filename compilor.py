@@ -1,61 +1,88 @@
 import re
+import sys
+from array import array
 from operands import OPCODE_MAP, REGISTER_MAP
+import isa
+from isa import FORMAT_R_ADR, FORMAT_ADR, FORMAT_NONE, FORMAT_R_R, FORMAT_R
+import object_file
+from peephole import PeepholeOptimizer
+
+# Number of words buffered before compile_stream hands them to its sink.
+STREAM_CHUNK_WORDS = 4096
+
+# Macro instructions, and the SVC service numbers used by IN and OUT (see svc_io).
+MACROS = {'IN', 'OUT', 'RPUSH', 'RPOP'}
+SVC_NUMBERS = {'IN': '1', 'OUT': '2'}
 
 class Compiler:
     """
     A two-pass assembler for a subset of the CASL II language.
     This assembler builds a symbol table in the first pass and generates
-    machine code in the second pass.
+    machine code in the second pass. `compile_incremental` reuses the work of
+    the previous call for editor-style recompilation, and `compile_single_pass`
+    assembles in one pass straight to integer words.
     """
-    def __init__(self):
-        """Initializes the compiler's state."""
+    def __init__(self, verbose=True, optimize=False):
+        """
+        Initializes the compiler's state.
+
+        Args:
+            verbose (bool): Print progress banners and errors while compiling.
+            optimize (bool): Run the peephole optimizer between the two passes.
+        """
+        self.verbose = verbose
+        self.optimize = optimize
+        self.optimization_report = None  # Report of the last optimization, if any
+        self.error = None  # Message of the last compilation error, if any
         self.symbol_table = {}
         self.intermediate_representation = []
         self.machine_code = []
         self.start_address = 0
+        self.entry_point = 0
+        self.line_map = []
+
+        # State kept between calls to compile_incremental.
+        self._line_cache = {}        # source line text -> parsed line (or None)
+        self._encoding_cache = {}    # encoding key -> list of machine words
+        self._previous_lines = []
+        # For each source line, the location counter and IR length before it
+        # (plus one final entry for the end of the source).
+        self._line_locations = []
+        self._line_ir_lengths = []
 
         # Use the imported maps
         self.OPCODE_MAP = OPCODE_MAP
         self.REGISTER_MAP = REGISTER_MAP
 
-        # Maps opcodes to their corresponding handler function for the second pass.
+        # Maps opcodes to their corresponding handler function for the second
+        # pass. Machine instructions are handled by operand format (from isa).
+        handlers_by_format = {
+            FORMAT_R_ADR: self._handle_format_r_adr,   # OPCODE r, adr (or r1, r2)
+            FORMAT_ADR: self._handle_format_adr,       # OPCODE adr
+            FORMAT_R: self._handle_no_operand,         # POP r
+            FORMAT_NONE: self._handle_no_operand,      # RET
+        }
         self.instruction_handlers = {
-            # Format: OPCODE r, adr (or r1, r2)
-            'LD': self._handle_format_r_adr,
-            'ST': self._handle_format_r_adr,
-            'LAD': self._handle_format_r_adr,
-            'ADDA': self._handle_format_r_adr,
-            'SUBA': self._handle_format_r_adr,
-            'ADDL': self._handle_format_r_adr,
-            'SUBL': self._handle_format_r_adr,
-            'AND': self._handle_format_r_adr,
-            'OR': self._handle_format_r_adr,
-            'XOR': self._handle_format_r_adr,
-            'CPA': self._handle_format_r_adr,
-            'CPL': self._handle_format_r_adr,
-            'SLA': self._handle_format_r_adr,
-            'SRA': self._handle_format_r_adr,
-            'SLL': self._handle_format_r_adr,
-            'SRL': self._handle_format_r_adr,
-
-            # Format: OPCODE adr
-            'JUMP': self._handle_format_adr,
-            'JPL': self._handle_format_adr,
-            'JMI': self._handle_format_adr,
-            'JNZ': self._handle_format_adr,
-            'JZE': self._handle_format_adr,
-            'JOV': self._handle_format_adr,
-            'PUSH': self._handle_format_adr,
-            'CALL': self._handle_format_adr,
-            'SVC': self._handle_format_adr,
-
-            # Format: No operands (or single register)
-            'POP': self._handle_no_operand, # Will need a slight modification
-            'RET': self._handle_no_operand,
-            'NOP': self._handle_no_operand,
-            
+            mnemonic: handlers_by_format[instruction.format] for mnemonic, instruction in isa.ENCODE.items()
+        }
+        self.instruction_handlers.update({
             # Special Directives
-            'DC': self._handle_dc
+            'DC': self._handle_dc,
+
+            # Macro Instructions
+            'IN': self._handle_macro,
+            'OUT': self._handle_macro,
+            'RPUSH': self._handle_macro,
+            'RPOP': self._handle_macro,
+        })
+
+        # Precomputed (first word without r/x fields, operand format, first
+        # word of the register-to-register form or None) for each machine
+        # instruction, used by compile_single_pass.
+        self.opcode_table = {
+            mnemonic: (instruction.opcode << 8, instruction.format,
+                       isa.REGISTER_FORMS[mnemonic].opcode << 8 if mnemonic in isa.REGISTER_FORMS else None)
+            for mnemonic, instruction in isa.ENCODE.items()
         }
 
 
@@ -69,23 +96,44 @@ class Compiler:
         Returns:
             A list of strings representing the machine code, or None on error.
         """
-        print("--- Starting Compilation ---")
+        self.error = None
+        self._log("--- Starting Compilation ---")
         try:
             # First pass: Build symbol table and intermediate representation.
             self.first_pass(source_code)
-            print("\n--- First Pass Complete ---")
-            print("Symbol Table:", self.symbol_table)
+            self._log("\n--- First Pass Complete ---")
+            self._log(f"Symbol Table: {self.symbol_table}")
+
+            # Optional: rewrite the intermediate representation in place.
+            if self.optimize:
+                self.optimization_report = PeepholeOptimizer(self).optimize()
+                self._log("\n--- Optimization Complete ---")
+                self._log(f"Optimization Report: {self.optimization_report}")
 
             # Second pass: Generate machine code from the intermediate representation.
             self.second_pass()
-            print("\n--- Second Pass Complete ---")
-            print("Generated Machine Code:", self.machine_code)
+            self._log("\n--- Second Pass Complete ---")
+            self._log(f"Generated Machine Code: {self.machine_code}")
 
             return self.machine_code
-        except (ValueError, NameError) as e:
-            print(f"Compilation Error: {e}")
+        except (ValueError, NameError, KeyError) as e:
+            self._compilation_error(e)
             return None
 
+    def _compilation_error(self, e):
+        """Records and reports an error raised while compiling."""
+        if isinstance(e, KeyError):
+            # Raised by the symbol table or register map lookups.
+            self.error = f"Undefined symbol or register: {e}"
+        else:
+            self.error = str(e)
+        self._log(f"Compilation Error: {self.error}")
+
+    def _log(self, message):
+        """Prints a progress message unless the compiler is quiet."""
+        if self.verbose:
+            print(message)
+
     def _parse_line(self, line):
         """
         Parses a single line of assembly code into its components.
@@ -100,7 +148,7 @@ class Compiler:
         if not line or line.startswith(';'):
             return None
         if ';' in line:
-            line = line.split(';', 1)[0].strip()
+            line = self._strip_comment(line).strip()
 
         parts = line.split(None, 1)
         first_word = parts[0]
@@ -129,113 +177,593 @@ class Compiler:
             raise ValueError(f"Unknown opcode '{opcode}' on line: '{original_line.strip()}'")
 
         # Split operands string by comma into a list.
-        operands = [op.strip() for op in operands_str.split(',')] if operands_str else []
+        operands = self._split_operands(operands_str) if operands_str else []
         return {'label': label, 'opcode': opcode, 'operands': operands}
 
+    def _strip_comment(self, line):
+        """Removes a ';' comment, ignoring semicolons inside quoted strings."""
+        if "'" not in line:
+            return line.split(';', 1)[0]
+        quoted = False
+        for i, char in enumerate(line):
+            if char == "'":
+                quoted = not quoted
+            elif char == ';' and not quoted:
+                return line[:i]
+        return line
+
+    def _split_operands(self, operands_str):
+        """Splits an operand field at the commas outside quoted strings."""
+        if "'" not in operands_str:
+            return [op.strip() for op in operands_str.split(',')]
+        operands, start, quoted = [], 0, False
+        for i, char in enumerate(operands_str):
+            if char == "'":
+                quoted = not quoted
+            elif char == ',' and not quoted:
+                operands.append(operands_str[start:i].strip())
+                start = i + 1
+        operands.append(operands_str[start:].strip())
+        return operands
+
     def first_pass(self, source_code):
         """
         Processes the source code to build the symbol table and intermediate representation.
         The location counter is updated based on instruction and directive lengths.
         """
-        location_counter = 0
-        lines = source_code.split('\n')
+        self._scan_lines(source_code.split('\n'), 0, self._parse_line)
+
+    def _scan_lines(self, lines, start, parse):
+        """
+        Runs the first pass over lines[start:], continuing from the location
+        counter, intermediate representation and symbol table produced by
+        lines[:start] in the previous scan.
+
+        Args:
+            lines (list): All source lines.
+            start (int): Index of the first line to (re)process.
+            parse (callable): Turns a line into a parsed dict, or None.
+        """
+        if start == 0:
+            self.symbol_table = {}
+            self.intermediate_representation = []
+            self._line_locations = [0]
+            self._line_ir_lengths = [0]
+        else:
+            # Forget everything the old lines[start:] contributed.
+            ir_length = self._line_ir_lengths[start]
+            for stale in self.intermediate_representation[ir_length:]:
+                if stale['label'] and self.symbol_table.get(stale['label']) == stale['address']:
+                    del self.symbol_table[stale['label']]
+            del self.intermediate_representation[ir_length:]
+            del self._line_locations[start + 1:]
+            del self._line_ir_lengths[start + 1:]
+        location_counter = self._line_locations[start]
         
-        for line_num, line in enumerate(lines):
-            parsed = self._parse_line(line)
-            if not parsed:
-                continue
+        for line_num in range(start, len(lines)):
+            parsed = parse(lines[line_num])
+            if parsed:
+                # Store the parsed instruction with its memory address (and source
+                # line number, for debugging tools) for the second pass.
+                parsed['address'] = location_counter
+                parsed['line'] = line_num + 1
+                self.intermediate_representation.append(parsed)
 
-            # Store the parsed instruction with its memory address for the second pass.
-            parsed['address'] = location_counter
-            self.intermediate_representation.append(parsed)
-
-            # If a label exists, add it to the symbol table with the current address.
-            if parsed['label']:
-                if parsed['label'] in self.symbol_table:
-                    raise NameError(f"Duplicate label definition: '{parsed['label']}'")
-                self.symbol_table[parsed["label"]] = location_counter
-
-            # Increment location counter based on instruction or directive.
-            opcode = parsed['opcode']
-            if opcode in self.OPCODE_MAP:
-                if opcode == 'DS':
-                    # DS reserves a block of memory specified by the operand.
-                    size = int(parsed['operands'][0])
-                    location_counter += size
-                elif opcode == 'DC':
-                    # DC reserves one word for each constant defined.
-                    location_counter += len(parsed['operands'])
-                else:
-                    # For standard instructions, get the length from the opcode map.
-                    _, length = self.OPCODE_MAP[opcode]
-                    location_counter += length
-            elif opcode != 'START' and opcode != 'END':
-                # This check is redundant if _parse_line is correct, but serves as a safeguard.
-                raise ValueError(f"Unknown opcode: '{opcode}'")
+                # If a label exists, add it to the symbol table with the current address.
+                if parsed['label']:
+                    if parsed['label'] in self.symbol_table:
+                        raise NameError(f"Duplicate label definition: '{parsed['label']}'")
+                    self.symbol_table[parsed["label"]] = location_counter
+
+                # Increment location counter based on instruction or directive.
+                location_counter += self._statement_length(parsed['opcode'], parsed['operands'])
 
-    def second_pass(self):
+            self._line_locations.append(location_counter)
+            self._line_ir_lengths.append(len(self.intermediate_representation))
+
+    def _statement_length(self, opcode, operands):
+        """Returns the number of memory words a statement occupies."""
+        if opcode in self.OPCODE_MAP:
+            if opcode == 'DS':
+                # DS reserves a block of memory specified by the operand.
+                return int(operands[0])
+            elif opcode == 'DC':
+                # DC reserves one word for each constant defined (and for
+                # each character of a string).
+                length = len(operands)
+                for const in operands:
+                    if self._is_string(const):
+                        length += len(self._string_words(const)) - 1
+                return length
+            elif len(operands) == 2 and operands[1] in self.REGISTER_MAP and opcode in isa.REGISTER_FORMS:
+                # Register-to-register forms are one word.
+                return 1
+            else:
+                # For standard instructions, get the length from the opcode map.
+                _, length = self.OPCODE_MAP[opcode]
+                return length
+        elif opcode != 'START' and opcode != 'END':
+            # This check is redundant if _parse_line is correct, but serves as a safeguard.
+            raise ValueError(f"Unknown opcode: '{opcode}'")
+        return 0
+
+    def second_pass(self, encoding_cache=None):
         """
         Generates machine code by iterating through the intermediate representation.
         Uses the completed symbol table to resolve addresses.
+
+        Args:
+            encoding_cache (dict): Optional words from a previous pass, keyed by
+                opcode, operands and the values of the symbols they reference.
+                Instructions found in it are not encoded again.
+
+        Returns:
+            The encodings used by this pass, in the same form as `encoding_cache`.
         """
         self.machine_code = [] # Ensure list is empty before starting
+        self.line_map = []
+        self.entry_point = self.start_address
+        used_encodings = {}
         for instruction in self.intermediate_representation:
             opcode = instruction['opcode']
 
+            # START may name the label where execution begins.
+            if opcode == 'START':
+                if instruction['operands']:
+                    self.entry_point = self.symbol_table[instruction['operands'][0]]
+                continue
+
             # Skip directives that do not generate code.
-            if opcode in ['START', 'END', 'DS']:
+            if opcode == 'END':
                 continue
-            
-            # Delegate to the appropriate handler based on the opcode.
-            handler = self.instruction_handlers.get(opcode)
-            if handler:
-                handler(instruction)
+
+            if opcode != 'DS':
+                self.line_map.append((instruction['address'], instruction['line']))
+
+            operands = instruction['operands']
+            key = (opcode, tuple(operands), tuple(self.symbol_table.get(op) for op in operands))
+            words = None
+            if encoding_cache is not None:
+                words = encoding_cache.get(key)
+            if words is None:
+                words = self._encode(instruction)
+            used_encodings[key] = words
+            self.machine_code.extend(words)
+        return used_encodings
+
+    def _encode(self, instruction):
+        """Returns the machine words (hex strings) for one statement."""
+        opcode = instruction['opcode']
+
+        # DS reserves zero-filled words so that later addresses line up.
+        if opcode == 'DS':
+            return ["0000"] * int(instruction['operands'][0])
+
+        # Delegate to the appropriate handler based on the opcode.
+        handler = self.instruction_handlers.get(opcode)
+        if handler:
+            return handler(instruction)
+        # This warning helps identify which instructions lack a generation handler.
+        self._log(f"Warning: Second pass handler for opcode '{opcode}' is not yet implemented.")
+        return []
+
+    def _parse_constant(self, text):
+        """Converts a decimal or '#'-prefixed hexadecimal constant to a 16-bit word."""
+        if text.startswith('#'):
+            return int(text[1:], 16) & 0xFFFF
+        return int(text) & 0xFFFF
+
+    def _is_constant(self, text):
+        """True if the operand is a numeric constant rather than a label."""
+        return text.startswith('#') or text.lstrip('+-').isdigit()
+
+    def _is_string(self, text):
+        """True if the operand is a quoted string constant."""
+        return len(text) >= 2 and text[0] == "'" and text[-1] == "'"
+
+    def _string_words(self, text):
+        """Returns the character codes of a quoted string ('' stands for a quote)."""
+        chars = text[1:-1].replace("''", "'")
+        if not chars:
+            raise ValueError(f"Empty string constant {text}")
+        return list(chars.encode('latin-1'))
+
+    def _constant_words(self, operands):
+        """Returns the words defined by the operands of a DC statement."""
+        words = []
+        for const in operands:
+            if self._is_string(const):
+                words.extend(self._string_words(const))
+            else:
+                words.append(self._parse_constant(const))
+        return words
+
+    def _index_register(self, operands, position):
+        """Returns the x field for the optional index register operand at `position`."""
+        if len(operands) <= position:
+            return 0
+        x = self.REGISTER_MAP[operands[position]]
+        if x == 0:
+            raise ValueError("GR0 cannot be used as an index register")
+        return x
+
+    def _resolve_address(self, operand):
+        """Returns the address named by a label or given as a numeric constant."""
+        if operand not in self.symbol_table and self._is_constant(operand):
+            return self._parse_constant(operand)
+        return self.symbol_table[operand]
+
+    def _parse_cached(self, line):
+        """Parses a line, reusing the result for identical line text."""
+        if line in self._line_cache:
+            parsed = self._line_cache[line]
+        else:
+            parsed = self._parse_line(line)
+            self._line_cache[line] = parsed
+        # The first pass adds 'address' and 'line', so hand out a copy.
+        return dict(parsed) if parsed else None
+
+    def compile_incremental(self, source_code):
+        """
+        Recompiles `source_code` reusing the results of the previous call.
+
+        Parsed lines are cached by their text, the first pass restarts at the
+        first line that differs from the previous source, and only statements
+        whose operands or referenced symbol values changed are encoded again.
+
+        Args:
+            source_code (str): The complete, edited CASL II source.
+
+        Returns:
+            A dict with 'machine_code' (the full image), 'changes' (a list of
+            (address, old word, new word) tuples, None where the image grew or
+            shrank) and 'first_changed_line' (1-based), or None on error.
+        """
+        self.error = None
+        lines = source_code.split('\n')
+        previous = self._previous_lines
+        start = 0
+        limit = min(len(lines), len(previous))
+        while start < limit and lines[start] == previous[start]:
+            start += 1
+        if start == len(lines) == len(previous):
+            return {'machine_code': self.machine_code, 'changes': [], 'first_changed_line': None}
+
+        old_code = self.machine_code
+        try:
+            self._scan_lines(lines, start, self._parse_cached)
+            self._encoding_cache = self.second_pass(self._encoding_cache)
+        except (ValueError, NameError, KeyError) as e:
+            # The cached first-pass state is unreliable now; start over next
+            # time, and keep diffing against the last successful image.
+            self._previous_lines = []
+            self.machine_code = old_code
+            self._compilation_error(e)
+            return None
+        self._previous_lines = lines
+
+        # Keep the line cache from growing without bound while editing.
+        if len(self._line_cache) > 2 * len(lines):
+            self._line_cache = {line: self._line_cache[line] for line in set(lines) if line in self._line_cache}
+
+        changes = []
+        for i in range(max(len(old_code), len(self.machine_code))):
+            old = old_code[i] if i < len(old_code) else None
+            new = self.machine_code[i] if i < len(self.machine_code) else None
+            if old != new:
+                changes.append((self.start_address + i, old, new))
+        return {'machine_code': self.machine_code, 'changes': changes, 'first_changed_line': start + 1}
+
+    def compile_stream(self, source, sink):
+        """
+        Compiles a source of any size with bounded memory.
+
+        Lines are read once from `source`. The intermediate form is kept as
+        compact tuples, with consecutive DC constants packed into 16-bit
+        arrays, and the machine words are handed to `sink` in chunks of
+        STREAM_CHUNK_WORDS instead of being collected in `machine_code`.
+
+        Args:
+            source: Any iterable of source lines, such as an open text file.
+            sink: A binary file-like object (receives little-endian words, as
+                in the object file format) or a callable (receives array('H')
+                chunks).
+
+        Returns:
+            A dict with 'words' (number of words written), 'start_address' and
+            'entry_point', or None on error. The symbol table is left in
+            `symbol_table`.
+        """
+        self.error = None
+        self.symbol_table = {}
+        self.intermediate_representation = []
+        self.machine_code = []
+        self.line_map = []
+        if hasattr(sink, 'write'):
+            def emit(chunk):
+                if sys.byteorder != 'little':
+                    chunk.byteswap()
+                sink.write(chunk.tobytes())
+        else:
+            emit = sink
+
+        try:
+            records = self._stream_first_pass(source)
+            words = self._stream_second_pass(records, emit)
+        except (ValueError, NameError, KeyError) as e:
+            self._compilation_error(e)
+            return None
+        return {'words': words, 'start_address': self.start_address, 'entry_point': self.entry_point}
+
+    def _stream_first_pass(self, source):
+        """
+        First pass for compile_stream. Returns a list of compact records
+        (opcode, operands, address), where operands is a tuple of strings,
+        an array('H') of packed DC constants, or a DS size.
+        """
+        records = []
+        location_counter = 0
+        for line in source:
+            parsed = self._parse_line(line)
+            if not parsed:
+                continue
+            label, opcode, operands = parsed['label'], parsed['opcode'], parsed['operands']
+            if label:
+                if label in self.symbol_table:
+                    raise NameError(f"Duplicate label definition: '{label}'")
+                self.symbol_table[label] = location_counter
+
+            length = self._statement_length(opcode, operands)
+            if opcode == 'DC':
+                constants = array('H', self._constant_words(operands))
+                last = records[-1] if records else None
+                if last and last[0] == 'DC' and last[2] + len(last[1]) == location_counter:
+                    last[1].extend(constants)
+                else:
+                    records.append(('DC', constants, location_counter))
+            elif opcode == 'DS':
+                records.append(('DS', length, location_counter))
+            elif opcode != 'END':
+                records.append((opcode, tuple(operands), location_counter))
+            location_counter += length
+        return records
+
+    def _stream_second_pass(self, records, emit):
+        """Second pass for compile_stream. Returns the number of words emitted."""
+        self.entry_point = self.start_address
+        buffer = array('H')
+        written = 0
+        for opcode, operands, address in records:
+            if opcode == 'START':
+                if operands:
+                    self.entry_point = self.symbol_table[operands[0]]
+                continue
+            if opcode == 'DC':
+                buffer.extend(operands)
+            elif opcode == 'DS':
+                remaining = operands
+                while remaining:
+                    count = min(remaining, STREAM_CHUNK_WORDS)
+                    buffer.extend(array('H', bytes(2 * count)))
+                    remaining -= count
+                    if len(buffer) >= STREAM_CHUNK_WORDS:
+                        written += len(buffer)
+                        emit(buffer)
+                        buffer = array('H')
             else:
-                # This warning helps identify which instructions lack a generation handler.
-                print(f"Warning: Second pass handler for opcode '{opcode}' is not yet implemented.")
+                words = self._encode({'opcode': opcode, 'operands': list(operands)})
+                buffer.extend(int(word, 16) for word in words)
+
+            if len(buffer) >= STREAM_CHUNK_WORDS:
+                written += len(buffer)
+                emit(buffer)
+                buffer = array('H')
+        if buffer:
+            written += len(buffer)
+            emit(buffer)
+        return written
+
+    def compile_single_pass(self, source_code):
+        """
+        Assembles `source_code` in a single pass, encoding each statement
+        directly to integer words from `opcode_table`.
+
+        References to labels that are not yet defined are emitted as zero and
+        recorded in a fixup list; the words are backpatched as soon as the label
+        is defined. The output is identical to the two-pass `compile`.
+
+        Args:
+            source_code (str): The CASL II source code to compile.
+
+        Returns:
+            An array('H') of machine words (ready for `load_image` or
+            `object_file.encode_object`), or None on error. `symbol_table`,
+            `entry_point` and `line_map` are filled in as by `compile`.
+        """
+        assembled = self._single_pass(source_code, relocatable=False)
+        return None if assembled is None else assembled[0]
+
+    def compile_module(self, source_code):
+        """
+        Assembles one START/END program unit as a relocatable module for
+        linker.py, in a single pass.
+
+        The unit is assembled at address 0. Every word holding the address of
+        one of its own labels is listed as a relocation, and labels it uses
+        but does not define are imports, resolved by the linker against the
+        other modules' exports. As in CASL II, a unit exports one name: its
+        START label, whose value is the unit's entry point.
+
+        Args:
+            source_code (str): The CASL II source of one program unit.
+
+        Returns:
+            An object_file.ObjectModule, or None on error.
+        """
+        assembled = self._single_pass(source_code, relocatable=True)
+        if assembled is None:
+            return None
+        image, relocations, imports, name = assembled
+        exports = {name: self.entry_point} if name else {}
+        return object_file.ObjectModule(name, image, self.entry_point, exports,
+                                        dict(self.symbol_table), relocations, imports)
+
+    def _single_pass(self, source_code, relocatable):
+        """
+        The single pass behind `compile_single_pass` and `compile_module`.
+
+        Returns:
+            (image, relocations, imports, START label), or None on error.
+            Unless `relocatable`, an undefined label is an error and only the
+            image is meaningful.
+        """
+        self.error = None
+        self.symbol_table = {}
+        self.intermediate_representation = []
+        self.machine_code = []
+        self.line_map = []
+        self.entry_point = self.start_address
+
+        image = array('H')
+        append = image.append
+        symbols = self.symbol_table
+        registers = self.REGISTER_MAP
+        table = self.opcode_table
+        line_map = self.line_map
+        fixups = {}  # label -> indexes of image words waiting for its address
+        label_references = []  # indexes of image words holding a label's address
+        entry_label = module_name = None
+
+        def emit_address(operand):
+            address = symbols.get(operand)
+            if address is None:
+                if self._is_constant(operand):
+                    append(self._parse_constant(operand))
+                    return
+                fixups.setdefault(operand, []).append(len(image))
+                address = 0
+            label_references.append(len(image))
+            append(address)
+
+        def emit_instruction(opcode, operands):
+            first, operand_format, register_form = table[opcode]
+            if operand_format == FORMAT_R_ADR:
+                r = registers[operands[0]]
+                if operands[1] in registers:
+                    # Register-to-register: one word, the second register in the x field.
+                    if register_form is None or len(operands) > 2:
+                        raise ValueError(f"{opcode} has no register-to-register form")
+                    append(register_form | r << 4 | registers[operands[1]])
+                else:
+                    x = self._index_register(operands, 2) if len(operands) > 2 else 0
+                    append(first | r << 4 | x)
+                    emit_address(operands[1])
+            elif operand_format == FORMAT_ADR:
+                x = self._index_register(operands, 1) if len(operands) > 1 else 0
+                append(first | x)
+                emit_address(operands[0])
+            elif operand_format == FORMAT_R:
+                append(first | (registers[operands[0]] if operands else 0) << 4)
+            else:
+                append(first)
+
+        try:
+            for line_num, line in enumerate(source_code.split('\n'), 1):
+                parsed = self._parse_line(line)
+                if not parsed:
+                    continue
+                label, opcode, operands = parsed['label'], parsed['opcode'], parsed['operands']
+                location = len(image)
+
+                if label:
+                    if label in symbols:
+                        raise NameError(f"Duplicate label definition: '{label}'")
+                    if location > 0xFFFF:
+                        raise ValueError(f"Label '{label}' lies outside the 64K-word address space")
+                    symbols[label] = location
+                    # Backpatch the references made before the definition.
+                    for index in fixups.pop(label, ()):
+                        image[index] = location
+
+                if opcode in table:
+                    emit_instruction(opcode, operands)
+                elif opcode in MACROS:
+                    for statement in self._expand_macro(parsed):
+                        emit_instruction(statement['opcode'], statement['operands'])
+                elif opcode == 'DC':
+                    image.extend(self._constant_words(operands))
+                elif opcode == 'DS':
+                    image.frombytes(bytes(2 * int(operands[0])))
+                    continue
+                else:
+                    # START may name the label where execution begins.
+                    if opcode == 'START':
+                        module_name = label
+                        if operands:
+                            entry_label = operands[0]
+                    continue
+                line_map.append((location, line_num))
+
+            if entry_label is not None:
+                self.entry_point = symbols[entry_label]
+            if fixups and not relocatable:
+                raise KeyError(next(iter(fixups)))
+        except (ValueError, NameError, KeyError) as e:
+            self._compilation_error(e)
+            return None
+        if not relocatable:
+            return image, None, None, module_name
+        external = {index for indexes in fixups.values() for index in indexes}
+        relocations = [index for index in label_references if index not in external]
+        return image, relocations, fixups, module_name
 
     def _handle_format_r_adr(self, instruction):
         """
         Generates code for instructions like 'LD r, adr' or 'ADDA r1, r2'.
-        Format: [Opcode][r][x] [Address/Register]
+        Format: [Opcode][r][x] [Address], or [Opcode][r1][r2] for the
+        one-word register-to-register form.
         """
         op_hex = self.OPCODE_MAP[instruction['opcode']][0]
         operands = instruction['operands']
         
         r_val = self.REGISTER_MAP[operands[0]]
-        x_val = 0  # Index register is not implemented, default to 0.
+        x_val = 0  # No index register
 
         # Check if the second operand is a register or a symbol
         if operands[1] in self.REGISTER_MAP:
-            # It's a register-to-register instruction (e.g., LD GR1, GR2)
-            # The second operand register becomes the x_val
-            x_val = self.REGISTER_MAP[operands[1]]
-            second_word = "0000" # No memory address needed
+            # It's a register-to-register instruction (e.g., LD GR1, GR2),
+            # with its own opcode; the second register is the x field.
+            register_form = isa.REGISTER_FORMS.get(instruction['opcode'])
+            if register_form is None or len(operands) > 2:
+                raise ValueError(f"{instruction['opcode']} has no register-to-register form")
+            return [f"{register_form.opcode:02X}{r_val}{self.REGISTER_MAP[operands[1]]}"]
         else:
-            # It's a register-memory instruction (e.g., LD GR1, A)
-            address = self.symbol_table[operands[1]]
+            # It's a register-memory instruction (e.g., LD GR1, A or LAD GR1, 5,
+            # with an optional index register: LD GR1, A, GR2)
+            address = self._resolve_address(operands[1])
+            x_val = self._index_register(operands, 2)
             second_word = f"{address:04X}"
 
         first_word = f"{op_hex}{r_val}{x_val}"
-        self.machine_code.extend([first_word, second_word])
+        return [first_word, second_word]
 
 
     def _handle_format_adr(self, instruction):
         """
-        Generates code for instructions like 'JUMP adr'.
+        Generates code for instructions like 'JUMP adr' or 'PUSH 0, GR1'.
         Format: [Opcode][r][x] [Address], where r is 0.
         """
         op_hex = self.OPCODE_MAP[instruction['opcode']][0]
         operands = instruction['operands']
         
-        address = self.symbol_table[operands[0]]
+        address = self._resolve_address(operands[0])
         r_val = 0 # The 'r' field is unused in this format.
-        x_val = 0 # Index register is not implemented, default to 0.
+        x_val = self._index_register(operands, 1)
         
         # Construct the two words of machine code.
         first_word = f"{op_hex}{r_val}{x_val}"
         second_word = f"{address:04X}"
-        self.machine_code.extend([first_word, second_word])
+        return [first_word, second_word]
 
     def _handle_no_operand(self, instruction):
         """
@@ -251,18 +779,58 @@ class Compiler:
                 r_val = self.REGISTER_MAP[instruction['operands'][0]]
         
         machine_word = f"{op_hex}{r_val}{x_val}"
-        self.machine_code.append(machine_word)
+        return [machine_word]
 
     def _handle_dc(self, instruction):
         """
         Generates code for the 'DC' (Define Constant) directive.
         """
-        for const in instruction['operands']:
-            # TODO: Extend to handle hex ('#FFFF') and string constants.
-            value = int(const)
-            # Format constant as a 16-bit (4-digit hex) machine word.
-            machine_word = f"{value:04X}"
-            self.machine_code.append(machine_word)
+        # Format each constant (or string character) as a 16-bit machine word.
+        return [f"{value:04X}" for value in self._constant_words(instruction['operands'])]
+
+    def _expand_macro(self, instruction):
+        """
+        Returns the machine instruction statements that a macro instruction
+        (IN, OUT, RPUSH or RPOP) stands for.
+        """
+        opcode, operands = instruction['opcode'], instruction['operands']
+        if opcode in SVC_NUMBERS:
+            # IN buf,len / OUT buf,len: pass the addresses in GR1 and GR2.
+            if len(operands) != 2:
+                raise ValueError(f"{opcode} takes a buffer and a length operand")
+            expansion = [('PUSH', ['0', 'GR1']), ('PUSH', ['0', 'GR2']),
+                         ('LAD', ['GR1', operands[0]]), ('LAD', ['GR2', operands[1]]),
+                         ('SVC', [SVC_NUMBERS[opcode]]),
+                         ('POP', ['GR2']), ('POP', ['GR1'])]
+        elif opcode == 'RPUSH':
+            expansion = [('PUSH', ['0', f'GR{i}']) for i in range(1, 8)]
+        else:
+            expansion = [('POP', [f'GR{i}']) for i in range(7, 0, -1)]
+        return [{'opcode': op, 'operands': ops} for op, ops in expansion]
+
+    def _handle_macro(self, instruction):
+        """Generates code for a macro instruction by encoding its expansion."""
+        words = []
+        for statement in self._expand_macro(instruction):
+            words.extend(self.instruction_handlers[statement['opcode']](statement))
+        return words
+
+    def to_object(self):
+        """
+        Encodes the most recently compiled program in the binary object format,
+        including the symbol table and the address-to-source-line map.
+
+        Returns:
+            The object file contents as bytes.
+        """
+        words = [int(word, 16) for word in self.machine_code]
+        return object_file.encode_object(words, self.start_address, self.entry_point,
+                                         self.symbol_table, self.line_map)
+
+    def write_object(self, path):
+        """Writes the most recently compiled program to `path` as an object file."""
+        with open(path, 'wb') as f:
+            f.write(self.to_object())
 
 
 if __name__ == "__main__":
@@ -281,4 +849,14 @@ if __name__ == "__main__":
     """
     # Instantiate and run the compiler.
     compiler = Compiler()
-    compiler.compile(casl_program)
\ No newline at end of file
+    compiler.compile(casl_program)
+    # The same program, assembled line by line straight into a byte buffer.
+    import io
+    stream = io.BytesIO()
+    summary = Compiler(verbose=False).compile_stream(io.StringIO(casl_program), stream)
+    print(f"Streamed {summary['words']} words ({len(stream.getvalue())} bytes)")
+
+    # The same program through the peephole optimizer.
+    optimizing = Compiler(verbose=False, optimize=True)
+    optimizing.compile(casl_program)
+    print(f"Optimized: {optimizing.optimization_report}")
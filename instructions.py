@@ -1,74 +1,422 @@
 # instructions.py
 # This file contains the execution logic for each COMET II instruction.
+#
+# Two-word (memory format) handlers take an optional `addr_word`. When it is
+# omitted they fetch the address word at the Program Counter themselves; the
+# predecoded path in the simulator passes the cached word instead.
+#
+# Registers and memory hold unsigned 16-bit words; results wrap around.
+
+WORD_MASK = 0xFFFF
+SIGN_BIT = 0x8000
+
+# Shift counts are effective addresses (0-65535). Counts above 17 shift out
+# every bit exactly as 17 does, so handlers clamp the count to SHIFT_LIMIT
+# and look up the bit that becomes OF (the last bit shifted out) here.
+SHIFT_LIMIT = 17
+# SLA shifts bits 0-14 left, keeping the sign: the n-th shift moves out bit 15-n.
+SLA_OUT_BIT = [0] + [1 << (15 - n) for n in range(1, 16)] + [0, 0]
+# SRA shifts right, copying the sign: the n-th shift moves out bit n-1 (the sign from n = 16 on).
+SRA_OUT_BIT = [0] + [1 << (n - 1) for n in range(1, 17)] + [SIGN_BIT]
+# SLL: the n-th shift moves out bit 16-n.
+SLL_OUT_BIT = [0] + [1 << (16 - n) for n in range(1, 17)] + [0]
+# SRL: the n-th shift moves out bit n-1.
+SRL_OUT_BIT = [0] + [1 << (n - 1) for n in range(1, 17)] + [0]
+
+# Flag rules (OF, SF, ZF):
+#   LD, AND, OR, XOR          OF = 0, SF and ZF from the result
+#   ADDA, SUBA                OF = signed overflow
+#   ADDL, SUBL                OF = carry out / borrow
+#   CPA, CPL                  OF = 0, SF = r < operand, ZF = r == operand
+#                             (signed for CPA, unsigned for CPL)
+#   SLA, SRA, SLL, SRL        OF = last bit shifted out
+#   LAD, ST, jumps, stack     flags unchanged
 
 def ld_reg(simulator, r1, r2):
     """Executes LD r1, r2 (Register-to-Register Load)"""
-    simulator.gr[r1] = simulator.gr[r2]
-    simulator._update_flags(simulator.gr[r1])
-    if simulator.debug:
-        print(f"  EXECUTING: LD GR{r1}, GR{r2} -> GR{r1} = {simulator.gr[r1]}")
+    value = simulator.gr[r2]
+    simulator.gr[r1] = value
+    simulator.of = 0
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
 
-def ld_mem(simulator, r, x):
+def ld_mem(simulator, r, x, addr_word=None):
     """Executes LD r, addr, x (Memory-to-Register Load)"""
-    addr_word = simulator._fetch()
-    effective_address = simulator._get_effective_address(r, x, addr_word)
-    
-    # Ensure we don't read past memory bounds
-    if 0 <= effective_address < simulator.MEMORY_SIZE:
-        simulator.gr[r] = simulator.memory[effective_address]
-        simulator._update_flags(simulator.gr[r])
-        if simulator.debug:
-            print(f"  EXECUTING: LD GR{r}, mem[{effective_address:04X}] -> GR{r} = {simulator.gr[r]}")
-    else:
-        print(f"Error: Memory read out of bounds at address {effective_address:04X}")
-        simulator.is_running = False
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    gr = simulator.gr
+    value = simulator.memory[addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK]
+    gr[r] = value
+    simulator.of = 0
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
 
-def st(simulator, r, x):
+def st(simulator, r, x, addr_word=None):
     """Executes ST r, addr, x (Store)"""
-    addr_word = simulator._fetch()
-    effective_address = simulator._get_effective_address(r, x, addr_word)
-    
-    if 0 <= effective_address < simulator.MEMORY_SIZE:
-        simulator.memory[effective_address] = simulator.gr[r]
-        if simulator.debug:
-            print(f"  EXECUTING: ST GR{r}, mem[{effective_address:04X}] -> mem[{effective_address:04X}] = {simulator.gr[r]}")
-    else:
-        print(f"Error: Memory write out of bounds at address {effective_address:04X}")
-        simulator.is_running = False
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    gr = simulator.gr
+    simulator._store(addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK, gr[r])
 
-def lad(simulator, r, x):
-    """Executes LAD r, addr, x (Load Address)"""
-    addr_word = simulator._fetch()
-    effective_address = simulator._get_effective_address(r, x, addr_word)
-    simulator.gr[r] = effective_address
-    simulator._update_flags(simulator.gr[r])
-    if simulator.debug:
-        print(f"  EXECUTING: LAD GR{r}, {effective_address:04X} -> GR{r} = {simulator.gr[r]}")
+def lad(simulator, r, x, addr_word=None):
+    """Executes LAD r, addr, x (Load Address); the flags are unchanged"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    gr = simulator.gr
+    gr[r] = addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK
+
+# --- Arithmetic ---
 
 def adda_reg(simulator, r1, r2):
-    """Executes ADDA r1, r2 (Register-to-Register Add)"""
-    simulator.gr[r1] += simulator.gr[r2]
-    simulator._update_flags(simulator.gr[r1])
-    if simulator.debug:
-        print(f"  EXECUTING: ADDA GR{r1}, GR{r2} -> GR{r1} = {simulator.gr[r1]}")
-
-def adda_mem(simulator, r, x):
-    """Executes ADDA r, addr, x (Memory-to-Register Add)"""
-    addr_word = simulator._fetch()
-    effective_address = simulator._get_effective_address(r, x, addr_word)
-    
-    if 0 <= effective_address < simulator.MEMORY_SIZE:
-        simulator.gr[r] += simulator.memory[effective_address]
-        simulator._update_flags(simulator.gr[r])
-        if simulator.debug:
-            print(f"  EXECUTING: ADDA GR{r}, mem[{effective_address:04X}] -> GR{r} = {simulator.gr[r]}")
+    """Executes ADDA r1, r2 (Register-to-Register Add Arithmetic)"""
+    gr = simulator.gr
+    a, b = gr[r1], gr[r2]
+    value = (a + b) & WORD_MASK
+    gr[r1] = value
+    simulator.of = ((a ^ value) & (b ^ value)) >> 15
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+def adda_mem(simulator, r, x, addr_word=None):
+    """Executes ADDA r, addr, x (Memory-to-Register Add Arithmetic)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    gr = simulator.gr
+    a = gr[r]
+    b = simulator.memory[addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK]
+    value = (a + b) & WORD_MASK
+    gr[r] = value
+    simulator.of = ((a ^ value) & (b ^ value)) >> 15
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+def suba_reg(simulator, r1, r2):
+    """Executes SUBA r1, r2 (Register-to-Register Subtract Arithmetic)"""
+    gr = simulator.gr
+    a, b = gr[r1], gr[r2]
+    value = (a - b) & WORD_MASK
+    gr[r1] = value
+    simulator.of = ((a ^ b) & (a ^ value)) >> 15
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+def suba_mem(simulator, r, x, addr_word=None):
+    """Executes SUBA r, addr, x (Memory-to-Register Subtract Arithmetic)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    gr = simulator.gr
+    a = gr[r]
+    b = simulator.memory[addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK]
+    value = (a - b) & WORD_MASK
+    gr[r] = value
+    simulator.of = ((a ^ b) & (a ^ value)) >> 15
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+def addl_reg(simulator, r1, r2):
+    """Executes ADDL r1, r2 (Register-to-Register Add Logical)"""
+    gr = simulator.gr
+    total = gr[r1] + gr[r2]
+    value = total & WORD_MASK
+    gr[r1] = value
+    simulator.of = total >> 16
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+def addl_mem(simulator, r, x, addr_word=None):
+    """Executes ADDL r, addr, x (Memory-to-Register Add Logical)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    gr = simulator.gr
+    total = gr[r] + simulator.memory[addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK]
+    value = total & WORD_MASK
+    gr[r] = value
+    simulator.of = total >> 16
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+def subl_reg(simulator, r1, r2):
+    """Executes SUBL r1, r2 (Register-to-Register Subtract Logical)"""
+    gr = simulator.gr
+    difference = gr[r1] - gr[r2]
+    value = difference & WORD_MASK
+    gr[r1] = value
+    simulator.of = (difference >> 16) & 1   # borrow: the difference is negative
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+def subl_mem(simulator, r, x, addr_word=None):
+    """Executes SUBL r, addr, x (Memory-to-Register Subtract Logical)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    gr = simulator.gr
+    difference = gr[r] - simulator.memory[addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK]
+    value = difference & WORD_MASK
+    gr[r] = value
+    simulator.of = (difference >> 16) & 1
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+# --- Logical ---
+
+def and_reg(simulator, r1, r2):
+    """Executes AND r1, r2"""
+    gr = simulator.gr
+    value = gr[r1] & gr[r2]
+    gr[r1] = value
+    simulator.of = 0
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+def and_mem(simulator, r, x, addr_word=None):
+    """Executes AND r, addr, x"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    gr = simulator.gr
+    value = gr[r] & simulator.memory[addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK]
+    gr[r] = value
+    simulator.of = 0
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+def or_reg(simulator, r1, r2):
+    """Executes OR r1, r2"""
+    gr = simulator.gr
+    value = gr[r1] | gr[r2]
+    gr[r1] = value
+    simulator.of = 0
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+def or_mem(simulator, r, x, addr_word=None):
+    """Executes OR r, addr, x"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    gr = simulator.gr
+    value = gr[r] | simulator.memory[addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK]
+    gr[r] = value
+    simulator.of = 0
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+def xor_reg(simulator, r1, r2):
+    """Executes XOR r1, r2"""
+    gr = simulator.gr
+    value = gr[r1] ^ gr[r2]
+    gr[r1] = value
+    simulator.of = 0
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+def xor_mem(simulator, r, x, addr_word=None):
+    """Executes XOR r, addr, x"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    gr = simulator.gr
+    value = gr[r] ^ simulator.memory[addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK]
+    gr[r] = value
+    simulator.of = 0
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+# --- Comparison ---
+# Flipping the sign bit of both operands turns a signed comparison into an
+# unsigned one, so CPA and CPL share the same flag computation.
+
+def cpa_reg(simulator, r1, r2):
+    """Executes CPA r1, r2 (Compare Arithmetic)"""
+    gr = simulator.gr
+    difference = (gr[r1] ^ SIGN_BIT) - (gr[r2] ^ SIGN_BIT)
+    simulator.of = 0
+    simulator.sf = (difference >> 16) & 1
+    simulator.zf = 0 if difference else 1
+
+def cpa_mem(simulator, r, x, addr_word=None):
+    """Executes CPA r, addr, x (Compare Arithmetic)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    gr = simulator.gr
+    operand = simulator.memory[addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK]
+    difference = (gr[r] ^ SIGN_BIT) - (operand ^ SIGN_BIT)
+    simulator.of = 0
+    simulator.sf = (difference >> 16) & 1
+    simulator.zf = 0 if difference else 1
+
+def cpl_reg(simulator, r1, r2):
+    """Executes CPL r1, r2 (Compare Logical)"""
+    gr = simulator.gr
+    difference = gr[r1] - gr[r2]
+    simulator.of = 0
+    simulator.sf = (difference >> 16) & 1
+    simulator.zf = 0 if difference else 1
+
+def cpl_mem(simulator, r, x, addr_word=None):
+    """Executes CPL r, addr, x (Compare Logical)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    gr = simulator.gr
+    difference = gr[r] - simulator.memory[addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK]
+    simulator.of = 0
+    simulator.sf = (difference >> 16) & 1
+    simulator.zf = 0 if difference else 1
+
+# --- Shifts (the shift count is the effective address) ---
+
+def sla(simulator, r, x, addr_word=None):
+    """Executes SLA r, addr, x (Shift Left Arithmetic; the sign bit is kept)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    gr = simulator.gr
+    count = addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK
+    if count > SHIFT_LIMIT:
+        count = SHIFT_LIMIT
+    a = gr[r]
+    value = (a & SIGN_BIT) | ((a << count) & 0x7FFF)
+    gr[r] = value
+    simulator.of = 1 if a & SLA_OUT_BIT[count] else 0
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+def sra(simulator, r, x, addr_word=None):
+    """Executes SRA r, addr, x (Shift Right Arithmetic; the sign bit is copied)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    gr = simulator.gr
+    count = addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK
+    if count > SHIFT_LIMIT:
+        count = SHIFT_LIMIT
+    a = gr[r]
+    value = ((a - ((a & SIGN_BIT) << 1)) >> count) & WORD_MASK
+    gr[r] = value
+    simulator.of = 1 if a & SRA_OUT_BIT[count] else 0
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+def sll(simulator, r, x, addr_word=None):
+    """Executes SLL r, addr, x (Shift Left Logical)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    gr = simulator.gr
+    count = addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK
+    if count > SHIFT_LIMIT:
+        count = SHIFT_LIMIT
+    a = gr[r]
+    value = (a << count) & WORD_MASK
+    gr[r] = value
+    simulator.of = 1 if a & SLL_OUT_BIT[count] else 0
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+def srl(simulator, r, x, addr_word=None):
+    """Executes SRL r, addr, x (Shift Right Logical)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    gr = simulator.gr
+    count = addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK
+    if count > SHIFT_LIMIT:
+        count = SHIFT_LIMIT
+    a = gr[r]
+    value = a >> count
+    gr[r] = value
+    simulator.of = 1 if a & SRL_OUT_BIT[count] else 0
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+# --- Branches ---
+
+def jump(simulator, r, x, addr_word=None):
+    """Executes JUMP adr, x (Unconditional Jump)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    simulator.pr = addr_word if x == 0 else (addr_word + simulator.gr[x]) & WORD_MASK
+
+def jpl(simulator, r, x, addr_word=None):
+    """Executes JPL adr, x (Jump on Plus: SF = 0 and ZF = 0)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    if not (simulator.sf or simulator.zf):
+        simulator.pr = addr_word if x == 0 else (addr_word + simulator.gr[x]) & WORD_MASK
+
+def jmi(simulator, r, x, addr_word=None):
+    """Executes JMI adr, x (Jump on Minus: SF = 1)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    if simulator.sf:
+        simulator.pr = addr_word if x == 0 else (addr_word + simulator.gr[x]) & WORD_MASK
+
+def jnz(simulator, r, x, addr_word=None):
+    """Executes JNZ adr, x (Jump on Non-Zero: ZF = 0)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    if not simulator.zf:
+        simulator.pr = addr_word if x == 0 else (addr_word + simulator.gr[x]) & WORD_MASK
+
+def jze(simulator, r, x, addr_word=None):
+    """Executes JZE adr, x (Jump on Zero: ZF = 1)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    if simulator.zf:
+        simulator.pr = addr_word if x == 0 else (addr_word + simulator.gr[x]) & WORD_MASK
+
+def jov(simulator, r, x, addr_word=None):
+    """Executes JOV adr, x (Jump on Overflow: OF = 1)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    if simulator.of:
+        simulator.pr = addr_word if x == 0 else (addr_word + simulator.gr[x]) & WORD_MASK
+
+# --- Stack and subroutines ---
+
+def push(simulator, r, x, addr_word=None):
+    """Executes PUSH adr, x (pushes the effective address onto the stack)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    sp = simulator.sp = (simulator.sp - 1) & WORD_MASK
+    simulator._store(sp, addr_word if x == 0 else (addr_word + simulator.gr[x]) & WORD_MASK)
+
+def pop(simulator, r, r2_or_x):
+    """Executes POP r"""
+    sp = simulator.sp
+    simulator.gr[r] = simulator.memory[sp]
+    simulator.sp = (sp + 1) & WORD_MASK
+
+def call(simulator, r, x, addr_word=None):
+    """Executes CALL adr, x (pushes the return address and jumps)"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    target = addr_word if x == 0 else (addr_word + simulator.gr[x]) & WORD_MASK
+    sp = simulator.sp = (simulator.sp - 1) & WORD_MASK
+    simulator._store(sp, simulator.pr)
+    simulator.pr = target
+
+def ret(simulator, r1, r2_or_x):
+    """
+    Executes RET (pops the return address). With an empty stack (SP = 0,
+    as at power-on) there is nothing to return to, and the program halts.
+    """
+    sp = simulator.sp
+    if sp == 0:
+        halt(simulator, r1, r2_or_x)
+        return
+    simulator.pr = simulator.memory[sp]
+    simulator.sp = (sp + 1) & WORD_MASK
+
+# --- Other ---
+
+def svc(simulator, r, x, addr_word=None):
+    """Executes SVC adr, x (Supervisor Call): the I/O backend services call `adr`"""
+    if addr_word is None:
+        addr_word = simulator._fetch()
+    number = addr_word if x == 0 else (addr_word + simulator.gr[x]) & WORD_MASK
+    if simulator.io is None:
+        simulator._fault(f"SVC {number} with no I/O backend attached")
     else:
-        print(f"Error: Memory read out of bounds at address {effective_address:04X}")
-        simulator.is_running = False
+        simulator.io.svc(simulator, number)
 
 def halt(simulator, r1, r2_or_x):
     """Halts the simulation."""
-    print("\n--- Simulation Halted (HALT instruction) ---")
+    if simulator.verbose:
+        print("\n--- Simulation Halted (HALT instruction) ---")
     simulator.is_running = False
 
 def unknown(simulator, r1, r2_or_x):
@@ -76,6 +424,154 @@ def unknown(simulator, r1, r2_or_x):
     # We need the original PC for the error message. It's `simulator.pr - 1`.
     start_pr = simulator.pr - 1 
     instruction_word = simulator.memory[start_pr]
-    print(f"Error: Unknown instruction {instruction_word:04X} at address {start_pr:04X}")
-    simulator.is_running = False
+    simulator._fault(f"Unknown instruction {instruction_word:04X} at address {start_pr:04X}")
 
+
+# --- Fused handlers (superinstructions) ---
+# Each executes a common sequence of instructions in one dispatch and takes the
+# decoded arguments of every instruction in the sequence, in order: (r, x,
+# addr_word) for memory format and (r1, r2) for register format. The effect,
+# including the final flags and Program Counter, is exactly that of running
+# the instructions one after another. A store or jump may only be the last
+# instruction of a sequence, so it cannot modify or skip an instruction the
+# handler still executes.
+
+def ld_adda(simulator, r1, x1, adr1, r2, x2, adr2):
+    """Executes LD r, adr ; ADDA r, adr"""
+    gr = simulator.gr
+    memory = simulator.memory
+    gr[r1] = memory[adr1 if x1 == 0 else (adr1 + gr[x1]) & WORD_MASK]
+    a = gr[r2]
+    b = memory[adr2 if x2 == 0 else (adr2 + gr[x2]) & WORD_MASK]
+    value = (a + b) & WORD_MASK
+    gr[r2] = value
+    simulator.of = ((a ^ value) & (b ^ value)) >> 15
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+
+def ld_adda_st(simulator, r1, x1, adr1, r2, x2, adr2, r3, x3, adr3):
+    """Executes LD r, adr ; ADDA r, adr ; ST r, adr"""
+    ld_adda(simulator, r1, x1, adr1, r2, x2, adr2)
+    gr = simulator.gr
+    simulator._store(adr3 if x3 == 0 else (adr3 + gr[x3]) & WORD_MASK, gr[r3])
+
+def adda_st(simulator, r1, x1, adr1, r2, x2, adr2):
+    """Executes ADDA r, adr ; ST r, adr"""
+    gr = simulator.gr
+    memory = simulator.memory
+    a = gr[r1]
+    b = memory[adr1 if x1 == 0 else (adr1 + gr[x1]) & WORD_MASK]
+    value = (a + b) & WORD_MASK
+    gr[r1] = value
+    simulator.of = ((a ^ value) & (b ^ value)) >> 15
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+    simulator._store(adr2 if x2 == 0 else (adr2 + gr[x2]) & WORD_MASK, gr[r2])
+
+def ld_st(simulator, r1, x1, adr1, r2, x2, adr2):
+    """Executes LD r, adr ; ST r, adr (memory-to-memory copy)"""
+    gr = simulator.gr
+    value = simulator.memory[adr1 if x1 == 0 else (adr1 + gr[x1]) & WORD_MASK]
+    gr[r1] = value
+    simulator.of = 0
+    simulator.sf = value >> 15
+    simulator.zf = 0 if value else 1
+    simulator._store(adr2 if x2 == 0 else (adr2 + gr[x2]) & WORD_MASK, gr[r2])
+
+def lad_jump(simulator, r1, x1, adr1, r2, x2, adr2):
+    """Executes LAD r, adr ; JUMP adr (a loop counter step and the jump back)"""
+    gr = simulator.gr
+    gr[r1] = adr1 if x1 == 0 else (adr1 + gr[x1]) & WORD_MASK
+    simulator.pr = adr2 if x2 == 0 else (adr2 + gr[x2]) & WORD_MASK
+
+# A compare leaves OF = 0 and at most one of SF (less) and ZF (equal) set, so
+# each conditional jump after it is taken for a fixed set of outcomes. Indexed
+# by SF << 1 | ZF: greater, equal, less (SF = ZF = 1 cannot happen).
+COMPARE_JUMP_TAKEN = {
+    jpl: (True, False, False, False),
+    jmi: (False, False, True, True),
+    jnz: (True, False, True, False),
+    jze: (False, True, False, True),
+    jov: (False, False, False, False),
+}
+
+def _compare_jump(compare, jump):
+    """
+    Returns a fused handler for `compare` (CPA or CPL, either form) followed
+    by the conditional `jump`. It sets the flags the compare leaves and the
+    Program Counter the jump leaves, taken or not.
+    """
+    bias = SIGN_BIT if compare in (cpa_reg, cpa_mem) else 0
+    taken = COMPARE_JUMP_TAKEN[jump]
+    if compare in (cpa_reg, cpl_reg):
+        def compare_jump(simulator, r1, r2, r, x, addr_word):
+            gr = simulator.gr
+            difference = (gr[r1] ^ bias) - (gr[r2] ^ bias)
+            sf = simulator.sf = (difference >> 16) & 1
+            zf = simulator.zf = 0 if difference else 1
+            simulator.of = 0
+            if taken[sf << 1 | zf]:
+                simulator.pr = addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK
+    else:
+        def compare_jump(simulator, r1, x1, adr1, r, x, addr_word):
+            gr = simulator.gr
+            operand = simulator.memory[adr1 if x1 == 0 else (adr1 + gr[x1]) & WORD_MASK]
+            difference = (gr[r1] ^ bias) - (operand ^ bias)
+            sf = simulator.sf = (difference >> 16) & 1
+            zf = simulator.zf = 0 if difference else 1
+            simulator.of = 0
+            if taken[sf << 1 | zf]:
+                simulator.pr = addr_word if x == 0 else (addr_word + gr[x]) & WORD_MASK
+    operands = 'r1, r2' if compare in (cpa_reg, cpl_reg) else 'r, adr'
+    compare_jump.__name__ = f"{compare.__name__}_{jump.__name__}"
+    compare_jump.__doc__ = f"Executes {compare.__name__[:3].upper()} {operands} ; {jump.__name__.upper()} adr"
+    return compare_jump
+
+# Sequences of handlers recognized when a program is loaded, longest first.
+FUSED_SEQUENCES = [
+    ((ld_mem, adda_mem, st), ld_adda_st),
+    ((ld_mem, adda_mem), ld_adda),
+    ((adda_mem, st), adda_st),
+    ((ld_mem, st), ld_st),
+    ((lad, jump), lad_jump),
+] + [
+    ((compare, jump), _compare_jump(compare, jump))
+    for compare in (cpa_reg, cpa_mem, cpl_reg, cpl_mem)
+    for jump in (jpl, jmi, jnz, jze, jov)
+]
+
+# Handlers that read or write the memory word at their operand's effective
+# address; all take (r, x, addr_word). Breakpoint and watchpoint support uses
+# these to decide which instructions need the slow path. They do not cover
+# stack accesses at SP: POP and RET read the stack, and PUSH and CALL write it
+# through `_store`, where write watchpoints see them anyway.
+READS_MEMORY = {ld_mem, adda_mem, suba_mem, addl_mem, subl_mem, and_mem, or_mem, xor_mem, cpa_mem, cpl_mem}
+WRITES_MEMORY = {st}
+
+# --- Trap handlers (debugging slow path) ---
+# The simulator decodes an instruction that needs checking into a trap entry
+# whose arguments are (address, handler, args) of the real instruction. When
+# they run, the Program Counter already points past the instruction.
+
+def breakpoint_trap(simulator, address, exec_func, args):
+    """Stops before the instruction at `address` if its breakpoint condition holds."""
+    condition = simulator._breakpoints[address]
+    if simulator._resume_address == address:
+        # Resuming from this breakpoint: execute the instruction once.
+        simulator._resume_address = None
+    elif condition is None or condition(simulator):
+        simulator.pr = address
+        simulator.stop_reason = 'breakpoint'
+        simulator.is_running = False
+        return
+    exec_func(simulator, *args)
+
+def watch_trap(simulator, address, exec_func, args):
+    """Executes a memory-reading instruction and stops if it read a watched word."""
+    r, x, addr_word = args
+    effective_address = simulator._get_effective_address(r, x, addr_word)
+    exec_func(simulator, *args)
+    if effective_address in simulator._read_watches and simulator.is_running:
+        simulator.watch_hit = {'access': 'read', 'address': effective_address, 'pc': address}
+        simulator.stop_reason = 'watchpoint'
+        simulator.is_running = False
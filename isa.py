@@ -0,0 +1,268 @@
+"""
+The COMET II instruction set, described once.
+
+`INSTRUCTION_SET` lists every machine instruction form as (mnemonic,
+opcode, operand format, handler name in instructions.py). The tables used
+by the simulator, the assembler and the disassembler are all generated
+from it when this module is imported:
+
+    DECODE          256-entry list indexed by opcode: the Instruction, or
+                    None for an undefined opcode.
+    DISPATCH        256-entry list of (handler, length) for the simulator's
+                    decoder. Undefined opcodes map to instructions.unknown.
+    ENCODE          mnemonic -> the Instruction the mnemonic assembles to
+                    (its memory form, where it has two).
+    REGISTER_FORMS  mnemonic -> the register-to-register form (r1,r2), for
+                    the mnemonics that have one.
+
+Every instruction word has the fields [opcode:8][r:4][x:4]. Register
+fields above 7 make the word invalid. The word 0000 is HALT, and opcode 00
+is otherwise undefined. The register-to-register form of a
+mnemonic is its memory-form opcode plus 4.
+
+`disassemble` renders memory images and `disassemble_instruction` single
+(trace) entries back to CASL II text, which reassembles to the same words.
+"""
+
+from collections import namedtuple
+
+import instructions
+
+# Operand formats.
+FORMAT_R_ADR = 0   # OPCODE r,adr[,x]     two words
+FORMAT_ADR = 1     # OPCODE adr[,x]       two words (r field 0)
+FORMAT_NONE = 2    # OPCODE               one word
+FORMAT_R_R = 3     # OPCODE r1,r2         one word (r2 in the x field)
+FORMAT_R = 4       # OPCODE r             one word
+
+FORMAT_LENGTHS = {FORMAT_R_ADR: 2, FORMAT_ADR: 2, FORMAT_NONE: 1, FORMAT_R_R: 1, FORMAT_R: 1}
+
+INSTRUCTION_SET = [
+    # Data transfer
+    ('LD',   0x10, FORMAT_R_ADR, 'ld_mem'),
+    ('ST',   0x11, FORMAT_R_ADR, 'st'),
+    ('LAD',  0x12, FORMAT_R_ADR, 'lad'),
+    ('LD',   0x14, FORMAT_R_R,   'ld_reg'),
+    # Arithmetic
+    ('ADDA', 0x20, FORMAT_R_ADR, 'adda_mem'),
+    ('SUBA', 0x21, FORMAT_R_ADR, 'suba_mem'),
+    ('ADDL', 0x22, FORMAT_R_ADR, 'addl_mem'),
+    ('SUBL', 0x23, FORMAT_R_ADR, 'subl_mem'),
+    ('ADDA', 0x24, FORMAT_R_R,   'adda_reg'),
+    ('SUBA', 0x25, FORMAT_R_R,   'suba_reg'),
+    ('ADDL', 0x26, FORMAT_R_R,   'addl_reg'),
+    ('SUBL', 0x27, FORMAT_R_R,   'subl_reg'),
+    # Logical
+    ('AND',  0x30, FORMAT_R_ADR, 'and_mem'),
+    ('OR',   0x31, FORMAT_R_ADR, 'or_mem'),
+    ('XOR',  0x32, FORMAT_R_ADR, 'xor_mem'),
+    ('AND',  0x34, FORMAT_R_R,   'and_reg'),
+    ('OR',   0x35, FORMAT_R_R,   'or_reg'),
+    ('XOR',  0x36, FORMAT_R_R,   'xor_reg'),
+    # Comparison
+    ('CPA',  0x40, FORMAT_R_ADR, 'cpa_mem'),
+    ('CPL',  0x41, FORMAT_R_ADR, 'cpl_mem'),
+    ('CPA',  0x44, FORMAT_R_R,   'cpa_reg'),
+    ('CPL',  0x45, FORMAT_R_R,   'cpl_reg'),
+    # Shifts (the shift count is the effective address)
+    ('SLA',  0x50, FORMAT_R_ADR, 'sla'),
+    ('SRA',  0x51, FORMAT_R_ADR, 'sra'),
+    ('SLL',  0x52, FORMAT_R_ADR, 'sll'),
+    ('SRL',  0x53, FORMAT_R_ADR, 'srl'),
+    # Branches
+    ('JUMP', 0x60, FORMAT_ADR,   'jump'),
+    ('JPL',  0x61, FORMAT_ADR,   'jpl'),
+    ('JMI',  0x62, FORMAT_ADR,   'jmi'),
+    ('JNZ',  0x63, FORMAT_ADR,   'jnz'),
+    ('JZE',  0x64, FORMAT_ADR,   'jze'),
+    ('JOV',  0x65, FORMAT_ADR,   'jov'),
+    # Stack
+    ('PUSH', 0x70, FORMAT_ADR,   'push'),
+    ('POP',  0x71, FORMAT_R,     'pop'),
+    # Subroutines
+    ('CALL', 0x80, FORMAT_ADR,   'call'),
+    ('RET',  0x81, FORMAT_NONE,  'ret'),
+    # Other
+    ('SVC',  0x90, FORMAT_ADR,   'svc'),
+    # There is no NOP: its opcode, 00, would make it the word 0000, which
+    # this machine executes as HALT (as zero-filled memory, a program falls
+    # off its end into a halt).
+]
+
+Instruction = namedtuple('Instruction', 'mnemonic opcode format handler length')
+
+DECODE = [None] * 256
+ENCODE = {}
+REGISTER_FORMS = {}
+for _mnemonic, _opcode, _format, _handler in INSTRUCTION_SET:
+    _instruction = Instruction(_mnemonic, _opcode, _format, _handler, FORMAT_LENGTHS[_format])
+    DECODE[_opcode] = _instruction
+    if _format == FORMAT_R_R:
+        REGISTER_FORMS[_mnemonic] = _instruction
+    else:
+        ENCODE[_mnemonic] = _instruction
+
+# Every handler named above must exist, so a misspelt name fails on import.
+DISPATCH = [(getattr(instructions, entry.handler), entry.length) if entry is not None else (instructions.unknown, 1)
+            for entry in DECODE]
+
+
+# --- Disassembly ---
+
+def _render_word(word):
+    """
+    Returns (text before the address, text after it, length) for an
+    instruction word, or None if the word is not a valid instruction.
+    Two-word instructions are completed by inserting the address.
+    """
+    entry = DECODE[word >> 8]
+    if entry is None or word & 0x88:
+        return None
+    r, x = (word >> 4) & 0xF, word & 0xF
+    mnemonic = f"{entry.mnemonic:<5} "
+    if entry.format == FORMAT_R_ADR:
+        return f"{mnemonic}GR{r},", f",GR{x}" if x else "", 2
+    if entry.format == FORMAT_ADR:
+        return (mnemonic, f",GR{x}" if x else "", 2) if r == 0 else None
+    if entry.format == FORMAT_R_R:
+        return f"{mnemonic}GR{r},GR{x}", "", 1
+    if entry.format == FORMAT_R:
+        return (f"{mnemonic}GR{r}", "", 1) if x == 0 else None
+    return (entry.mnemonic, "", 1) if r == 0 and x == 0 else None
+
+
+# Rendered instruction words, filled on first use.
+_rendered = {}
+
+
+def _lookup(word):
+    rendered = _rendered.get(word)
+    if rendered is None and word not in _rendered:
+        rendered = _rendered[word] = _render_word(word)
+    return rendered
+
+
+def disassemble_instruction(word, operand=0):
+    """
+    Returns the CASL II text of the instruction `word` (followed by
+    `operand` for two-word instructions), such as 'LD    GR1,#000B,GR2',
+    or a DC statement if it is not a valid instruction.
+    """
+    rendered = _lookup(word)
+    if rendered is None:
+        return f"DC    #{word:04X}"
+    before, after, length = rendered
+    return f"{before}#{operand:04X}{after}" if length == 2 else before
+
+
+def disassemble(words, start=0, symbols=None, listing=False, zero_run=4):
+    """
+    Disassembles a memory image in a linear sweep.
+
+    Args:
+        words: A sequence of 16-bit words (list, array('H'), memoryview).
+        start (int): Address of words[0].
+        symbols (dict): Optional label -> address mapping. Labels are put on
+            the lines at their addresses, and address operands that equal a
+            label's address are shown as the label.
+        listing (bool): Append '; address: words' comments.
+        zero_run (int): Runs of at least this many zero words are shown as
+            one DS statement (0 to disable).
+
+    Returns:
+        A list of source lines (without START and END). Words that are not
+        valid instructions, and two-word instructions whose second word is
+        labeled, are shown as DC constants, so the lines reassemble to
+        the same words.
+    """
+    labels = {}
+    if symbols:
+        # Prefer plain labels to the 'MODULE.LABEL' names of linked images.
+        for name, address in sorted(symbols.items(), key=lambda item: '.' in item[0]):
+            labels.setdefault(address, name)
+    lines = []
+    append = lines.append
+    lookup = _lookup
+    count = len(words)
+    end = start + count
+    i = 0
+    while i < count:
+        address = start + i
+        word = words[i]
+        label = labels.get(address, "")
+        if word == 0 and zero_run:
+            run = i + 1
+            while run < count and words[run] == 0 and start + run not in labels:
+                run += 1
+            if run - i >= zero_run:
+                text = f"DS    {run - i}"
+                append(f"{label:<8} {text:<24} ; {address:04X}" if listing else f"{label:<8} {text}")
+                i = run
+                continue
+        rendered = lookup(word)
+        if rendered is not None and rendered[2] == 2 and (address + 1 >= end or address + 1 in labels):
+            rendered = None
+        if rendered is None:
+            text, length = f"DC    #{word:04X}", 1
+        else:
+            before, after, length = rendered
+            if length == 2:
+                operand = words[i + 1]
+                target = labels.get(operand)
+                text = f"{before}{target if target else f'#{operand:04X}'}{after}"
+            else:
+                text = before
+        if listing:
+            code = " ".join(f"{w:04X}" for w in words[i:i + length])
+            append(f"{label:<8} {text:<24} ; {address:04X}: {code}")
+        else:
+            append(f"{label:<8} {text}")
+        i += length
+    return lines
+
+
+def disassemble_source(words, start=0, symbols=None, name='PGM'):
+    """Returns `disassemble` output wrapped in START and END as one source string."""
+    # `name` labels the START line, so it must not label another line too.
+    symbols = {label: address for label, address in (symbols or {}).items() if label != name}
+    return "\n".join([f"{name:<8} START"] + disassemble(words, start, symbols) + [f"{'':<8} END"])
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    from array import array
+
+    import object_file
+
+    if len(sys.argv) > 1:
+        # Disassemble an object file.
+        with object_file.read_object(sys.argv[1]) as image:
+            print("\n".join(disassemble(image.words, image.load_address, image.symbols, listing=True)))
+        raise SystemExit
+
+    from compilor import Compiler
+    program = """
+    PGM      START
+             LD    GR1,A
+             LD    GR2,GR1
+             ADDA  GR1,GR2
+             LAD   GR3,4,GR1
+             ST    GR1,C,GR3
+             PUSH  0,GR1
+             POP   GR4
+             RET
+    A        DC    3,0,0,0,0,0,#1234
+    C        DS    1
+             END
+    """
+    compiler = Compiler(verbose=False)
+    words = compiler.compile_single_pass(program)
+    print("\n".join(disassemble(words, symbols=compiler.symbol_table, listing=True)))
+    roundtrip = Compiler(verbose=False).compile_single_pass(disassemble_source(words, symbols=compiler.symbol_table))
+    print(f"Reassembles to the same words: {roundtrip == words}")
+
+    image = array('H', (i * 40503 & 0xFFFF for i in range(65536)))
+    start = time.perf_counter()
+    lines = disassemble(image)
+    print(f"Disassembled 65536 words into {len(lines)} lines in {time.perf_counter() - start:.3f} s")
@@ -0,0 +1,289 @@
+"""
+Separate assembly and linking of CASL II program units.
+
+A source may hold several START/END units. Each is assembled on its own
+into a relocatable module (`Compiler.compile_module`), so a shared
+subroutine library is assembled once rather than into every program, and
+`link` then places the modules one after another, adds each module's load
+address to its relocation entries and patches every import with the address
+exported by the module that defines it.
+
+    split_units       Splits a source into its START/END units.
+    ObjectCache       Modules on disk, keyed by the SHA-256 of the unit
+                      source and of the assembler itself, so an unchanged
+                      unit is never assembled again.
+    assemble_modules  Assembles units, taking what it can from a cache and
+                      assembling the rest in parallel across processes.
+    link              Combines modules (plus whatever library modules they
+                      need) into one ObjectImage for `load_image`.
+
+Usage:
+    python linker.py SOURCE... [--cache DIR] [--jobs N] [--entry NAME] [--output FILE]
+"""
+
+import argparse
+import hashlib
+import os
+import tempfile
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import compilor
+import isa
+import object_file
+import operands
+from compilor import Compiler
+
+# Starting a process pool costs as much as assembling tens of thousands of
+# lines, so units are only assembled in parallel when there is at least this
+# much source (in characters) to assemble.
+PARALLEL_MIN_SOURCE = 1_000_000
+
+MEMORY_SIZE = 65536
+
+
+def split_units(source_code):
+    """
+    Splits a source into its program units, each running from a START line
+    to the matching END line. Lines outside any unit (comments, blank lines)
+    are dropped.
+
+    Returns:
+        A list of unit source strings.
+    """
+    parser = Compiler(verbose=False)
+    units, current = [], None
+    for line in source_code.split('\n'):
+        parsed = parser._parse_line(line)
+        opcode = parsed['opcode'] if parsed else None
+        if opcode == 'START':
+            if current is not None:
+                raise ValueError(f"START inside an unfinished unit: '{line.strip()}'")
+            current = []
+        if current is not None:
+            current.append(line)
+        elif parsed:
+            raise ValueError(f"Statement outside a START/END unit: '{line.strip()}'")
+        if opcode == 'END':
+            if current is None:
+                raise ValueError("END without START")
+            units.append('\n'.join(current))
+            current = None
+    if current is not None:
+        raise ValueError("Unit is missing its END")
+    return units
+
+
+def _assembler_fingerprint():
+    """Hash of the assembler's own sources, so that cached modules go stale when it changes."""
+    digest = hashlib.sha256(str(object_file.MODULE_FORMAT_VERSION).encode())
+    for module in (compilor, operands, isa, object_file):
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.digest()
+
+
+class ObjectCache:
+    """
+    Relocatable modules stored in a directory, one file per unit, named by
+    the SHA-256 of the unit source and the assembler fingerprint.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._fingerprint = _assembler_fingerprint()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source):
+        return hashlib.sha256(self._fingerprint + source.encode()).hexdigest()
+
+    def _path(self, source):
+        return os.path.join(self.directory, self.key(source) + '.cobj')
+
+    def get(self, source):
+        """Returns the cached ObjectModule for `source`, or None."""
+        try:
+            with open(self._path(source), 'rb') as f:
+                module = object_file.decode_module(f.read())
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return module
+
+    def put(self, source, data):
+        """Stores an encoded module; the file appears atomically, so concurrent readers never see part of one."""
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, self._path(source))
+        except OSError:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+
+def _assemble_unit(source):
+    """
+    Assembles one unit (in a worker process).
+
+    Returns:
+        (encoded module, None), or (None, error message).
+    """
+    compiler = Compiler(verbose=False)
+    module = compiler.compile_module(source)
+    if module is None:
+        return None, compiler.error
+    return object_file.encode_module(module), None
+
+
+def assemble_modules(sources, cache=None, workers=None):
+    """
+    Assembles program units into relocatable modules.
+
+    Args:
+        sources (list): Unit source strings (see `split_units`).
+        cache (ObjectCache): Optional cache to take modules from and store
+            newly assembled ones in.
+        workers (int): Worker processes for the units not in the cache
+            (default: CPU count; 1 assembles on this thread, as does any
+            amount of source below PARALLEL_MIN_SOURCE).
+
+    Returns:
+        A list of ObjectModule, in the order of `sources`.
+
+    Raises:
+        ValueError: A unit failed to assemble (the message names the unit).
+    """
+    modules = [cache.get(source) if cache is not None else None for source in sources]
+    missing = [i for i, module in enumerate(modules) if module is None]
+    if workers != 1 and len(missing) > 1 and sum(len(sources[i]) for i in missing) >= PARALLEL_MIN_SOURCE:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_assemble_unit, [sources[i] for i in missing]))
+    else:
+        results = [_assemble_unit(sources[i]) for i in missing]
+
+    for i, (data, error) in zip(missing, results):
+        if data is None:
+            first_line = sources[i].strip().split('\n', 1)[0].strip()
+            raise ValueError(f"Unit '{first_line}': {error}")
+        if cache is not None:
+            cache.put(sources[i], data)
+        modules[i] = object_file.decode_module(data)
+    return modules
+
+
+def _exported_symbols(modules):
+    exports = {}
+    for module in modules:
+        for name in module.exports:
+            if name in exports:
+                raise ValueError(f"Duplicate external symbol '{name}'")
+            exports[name] = module
+    return exports
+
+
+def link(modules, libraries=(), load_address=0, entry=None):
+    """
+    Links relocatable modules into one loadable image.
+
+    Args:
+        modules (list): ObjectModules that are always included, in order.
+        libraries (list): ObjectModules included only if an included module
+            imports a symbol they export.
+        load_address (int): Address at which the image will be loaded.
+        entry (str): Exported name where execution begins (default: the
+            entry point of the first module).
+
+    Returns:
+        An object_file.ObjectImage whose `symbols` hold every exported name
+        and every local label as 'MODULE.LABEL'.
+
+    Raises:
+        ValueError: A symbol is undefined or defined twice, or the image does
+            not fit in memory.
+    """
+    available = _exported_symbols(list(modules) + list(libraries))
+    included = list(modules)
+    chosen = {id(module) for module in included}
+    pending = list(included)
+    while pending:
+        for name in pending.pop().imports:
+            module = available.get(name)
+            if module is None:
+                raise ValueError(f"Undefined external symbol '{name}'")
+            if id(module) not in chosen:
+                chosen.add(id(module))
+                included.append(module)
+                pending.append(module)
+    if not included:
+        raise ValueError("Nothing to link")
+
+    bases, address = [], load_address
+    for module in included:
+        bases.append(address)
+        address += len(module.words)
+    if address > MEMORY_SIZE:
+        raise ValueError(f"Linked image of {address - load_address} words does not fit at address {load_address}")
+
+    exports = {}
+    for module, base in zip(included, bases):
+        for name, offset in module.exports.items():
+            exports[name] = base + offset
+
+    image = array('H')
+    symbols = dict(exports)
+    for module, base in zip(included, bases):
+        words = array('H', module.words)
+        for index in module.relocations:
+            words[index] = (words[index] + base) & 0xFFFF
+        for name, indexes in module.imports.items():
+            for index in indexes:
+                words[index] = exports[name]
+        image.extend(words)
+        prefix = f"{module.name}." if module.name else ""
+        for label, offset in module.symbols.items():
+            symbols.setdefault(prefix + label, base + offset)
+
+    if entry is None:
+        entry_point = bases[0] + included[0].entry_point
+    elif entry in exports:
+        entry_point = exports[entry]
+    else:
+        raise ValueError(f"Undefined entry symbol '{entry}'")
+    return object_file.ObjectImage(memoryview(image), load_address, entry_point, symbols)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Assemble CASL II sources separately and link them.")
+    parser.add_argument('sources', nargs='+', help="source files; every unit in them is linked")
+    parser.add_argument('--library', action='append', default=[],
+                        help="library source file; its units are linked only when referenced")
+    parser.add_argument('--cache', help="directory for the object cache")
+    parser.add_argument('--jobs', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--entry', help="exported name where execution begins")
+    parser.add_argument('--output', default='a.obj', help="object file to write")
+    args = parser.parse_args(argv)
+
+    def read_units(paths):
+        units = []
+        for path in paths:
+            with open(path) as f:
+                units.extend(split_units(f.read()))
+        return units
+
+    cache = ObjectCache(args.cache) if args.cache else None
+    program_units, library_units = read_units(args.sources), read_units(args.library)
+    modules = assemble_modules(program_units + library_units, cache, args.jobs)
+    with link(modules[:len(program_units)], modules[len(program_units):], entry=args.entry) as image:
+        object_file.write_object(args.output, image.words, image.load_address, image.entry_point, image.symbols)
+        print(f"Linked {len(image.words)} words to {args.output}, entry point {image.entry_point}")
+    if cache is not None:
+        print(f"Object cache: {cache.hits} hits, {cache.misses} misses")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""
+This file defines the binary object format shared by the compiler and the
+simulator, so that assembled programs can be stored and loaded without
+converting every word to and from a hexadecimal string.
+
+Layout (all fields little-endian):
+
+    Header (24 bytes)
+        magic          4s   b'CASL'
+        version        H    FORMAT_VERSION
+        flags          H    FLAG_SYMBOLS | FLAG_LINE_MAP
+        load_address   H    Address of the first word (from START)
+        entry_point    H    Address where execution begins
+        word_count     I    Number of 16-bit words in the image
+        symbol_count   I    Number of symbol table entries
+        line_count     I    Number of line map entries
+    Image              word_count * H
+    Symbol table       symbol_count * (address H, name length B, name bytes)
+    Line map           line_count * (address H, source line I)
+
+The image starts at an even offset, so it can be used directly as a
+memoryview of 16-bit words over a memory-mapped file.
+
+Relocatable modules (from `Compiler.compile_module`, combined by linker.py)
+use a second layout, assembled as if loaded at address 0:
+
+    Header (28 bytes)
+        magic          4s   b'CASM'
+        version        H    MODULE_FORMAT_VERSION
+        name length    H    Length of the module name (its START label)
+        entry_point    H    Offset where execution begins
+        word_count     I    Number of 16-bit words in the image
+        export_count   I    Number of export table entries
+        symbol_count   I    Number of local symbol table entries
+        reloc_count    I    Number of relocation entries
+    Name           name length bytes
+    Image          word_count * H
+    Exports        export_count * (offset H, name length B, name bytes)
+    Symbols        symbol_count * (offset H, name length B, name bytes)
+    Relocations    reloc_count * I   Indexes of words holding a module-relative
+                                     address, to which the load address is added
+    Imports        import count I, then per import: name length B, name bytes,
+                   reference count I, reference count * I (indexes of the words
+                   that receive the symbol's address)
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+
+MAGIC = b'CASL'
+FORMAT_VERSION = 1
+
+FLAG_SYMBOLS = 0x0001
+FLAG_LINE_MAP = 0x0002
+
+HEADER = struct.Struct('<4sHHHHIII')
+SYMBOL_ENTRY = struct.Struct('<HB')
+LINE_ENTRY = struct.Struct('<HI')
+
+MODULE_MAGIC = b'CASM'
+MODULE_FORMAT_VERSION = 1
+
+MODULE_HEADER = struct.Struct('<4sHHHIIII')
+COUNT = struct.Struct('<I')
+NAME_LENGTH = struct.Struct('<B')
+
+
+class ObjectImage:
+    """
+    A loaded object file. `words` is a memoryview of the image words; when the
+    image was read from a file it points straight into the memory map, so
+    call `close()` (or use the image as a context manager) when done.
+    """
+    def __init__(self, words, load_address=0, entry_point=0, symbols=None, line_map=None, buffer=None):
+        self.words = words
+        self.load_address = load_address
+        self.entry_point = entry_point
+        self.symbols = symbols or {}
+        self.line_map = line_map or []
+        self._buffer = buffer
+
+    def close(self):
+        """Releases the image view and the underlying memory map, if any."""
+        self.words.release()
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def encode_object(words, load_address=0, entry_point=None, symbols=None, line_map=None):
+    """
+    Serializes a program image into the binary object format.
+
+    Args:
+        words: An iterable of 16-bit integers (e.g. a list or array('H')).
+        load_address (int): Address at which the image is loaded.
+        entry_point (int): Address where execution begins (defaults to load_address).
+        symbols (dict): Optional mapping of label -> address.
+        line_map (list): Optional list of (address, source line) pairs.
+
+    Returns:
+        The object file contents as bytes.
+    """
+    image = array('H', words)
+    if sys.byteorder != 'little':
+        image.byteswap()
+    if entry_point is None:
+        entry_point = load_address
+
+    flags = 0
+    symbol_bytes = b''
+    if symbols:
+        flags |= FLAG_SYMBOLS
+        parts = []
+        for name, address in symbols.items():
+            encoded = name.encode('ascii')
+            parts.append(SYMBOL_ENTRY.pack(address, len(encoded)) + encoded)
+        symbol_bytes = b''.join(parts)
+    line_bytes = b''
+    if line_map:
+        flags |= FLAG_LINE_MAP
+        line_bytes = b''.join(LINE_ENTRY.pack(address, line) for address, line in line_map)
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, flags, load_address, entry_point,
+                         len(image), len(symbols or ()), len(line_map or ()))
+    return header + image.tobytes() + symbol_bytes + line_bytes
+
+
+def write_object(path, words, load_address=0, entry_point=None, symbols=None, line_map=None):
+    """Writes a program image to `path` in the binary object format."""
+    with open(path, 'wb') as f:
+        f.write(encode_object(words, load_address, entry_point, symbols, line_map))
+
+
+def decode_object(buffer):
+    """
+    Parses an object file held in any bytes-like buffer (including an mmap)
+    without copying the image words.
+
+    Returns:
+        An ObjectImage whose `words` view refers into `buffer`.
+
+    Raises:
+        ValueError: The buffer is not a complete object file of this version.
+    """
+    if len(buffer) < HEADER.size:
+        raise ValueError("Object file is truncated.")
+    magic, version, flags, load_address, entry_point, word_count, symbol_count, line_count = \
+        HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a CASL II object file.")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported object format version {version}.")
+
+    # The sections after the image are parsed first: once the image view
+    # exists, an mmap'ed buffer cannot be closed on an error.
+    size = len(buffer)
+    start = HEADER.size
+    end = start + 2 * word_count
+    if end > size:
+        raise ValueError("Object file is truncated.")
+    offset = end
+
+    symbols = {}
+    if flags & FLAG_SYMBOLS:
+        for _ in range(symbol_count):
+            if offset + SYMBOL_ENTRY.size > size:
+                raise ValueError("Object file is truncated.")
+            address, length = SYMBOL_ENTRY.unpack_from(buffer, offset)
+            offset += SYMBOL_ENTRY.size
+            if offset + length > size:
+                raise ValueError("Object file is truncated.")
+            symbols[bytes(buffer[offset:offset + length]).decode('ascii')] = address
+            offset += length
+    line_map = []
+    if flags & FLAG_LINE_MAP:
+        if offset + LINE_ENTRY.size * line_count > size:
+            raise ValueError("Object file is truncated.")
+        for _ in range(line_count):
+            line_map.append(LINE_ENTRY.unpack_from(buffer, offset))
+            offset += LINE_ENTRY.size
+
+    words = memoryview(buffer)[start:end].cast('H')
+    if sys.byteorder != 'little':
+        swapped = array('H', words)
+        swapped.byteswap()
+        words.release()
+        words = memoryview(swapped)
+    return ObjectImage(words, load_address, entry_point, symbols, line_map)
+
+
+def read_object(path):
+    """
+    Memory-maps the object file at `path` and parses it.
+    The returned ObjectImage keeps the map open until it is closed.
+    """
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        image = decode_object(buffer)
+    except Exception:
+        buffer.close()
+        raise
+    image._buffer = buffer
+    return image
+
+
+class ObjectModule:
+    """
+    A relocatable module: an image assembled at address 0, the words in it
+    that hold module-relative addresses (`relocations`), the external
+    symbols it references (`imports`: name -> word indexes) and the symbols
+    it defines for other modules (`exports`: name -> offset).
+    """
+    def __init__(self, name, words, entry_point=0, exports=None, symbols=None, relocations=None, imports=None):
+        self.name = name
+        self.words = array('H', words)
+        self.entry_point = entry_point
+        self.exports = exports or {}
+        self.symbols = symbols or {}
+        self.relocations = relocations or []
+        self.imports = imports or {}
+
+
+def _pack_names(table):
+    return b''.join(SYMBOL_ENTRY.pack(offset, len(name.encode('ascii'))) + name.encode('ascii')
+                    for name, offset in table.items())
+
+
+def _unpack_names(buffer, offset, count):
+    table = {}
+    for _ in range(count):
+        address, length = SYMBOL_ENTRY.unpack_from(buffer, offset)
+        offset += SYMBOL_ENTRY.size
+        if offset + length > len(buffer):
+            raise ValueError("Module is truncated.")
+        table[bytes(buffer[offset:offset + length]).decode('ascii')] = address
+        offset += length
+    return table, offset
+
+
+def encode_module(module):
+    """Serializes an ObjectModule into the relocatable module format."""
+    name = (module.name or '').encode('ascii')
+    image = array('H', module.words)
+    relocations = array('I', module.relocations)
+    if sys.byteorder != 'little':
+        image.byteswap()
+        relocations.byteswap()
+    parts = [MODULE_HEADER.pack(MODULE_MAGIC, MODULE_FORMAT_VERSION, len(name), module.entry_point,
+                                len(image), len(module.exports), len(module.symbols), len(relocations)),
+             name, image.tobytes(), _pack_names(module.exports), _pack_names(module.symbols),
+             relocations.tobytes(), COUNT.pack(len(module.imports))]
+    for symbol, references in module.imports.items():
+        encoded = symbol.encode('ascii')
+        parts.append(NAME_LENGTH.pack(len(encoded)) + encoded + COUNT.pack(len(references)))
+        parts.append(struct.pack(f'<{len(references)}I', *references))
+    return b''.join(parts)
+
+
+def decode_module(buffer):
+    """
+    Parses a relocatable module held in any bytes-like buffer into an ObjectModule.
+    Raises ValueError if the buffer is not a complete module.
+    """
+    if len(buffer) < MODULE_HEADER.size:
+        raise ValueError("Module is truncated.")
+    magic, version, name_length, entry_point, word_count, export_count, symbol_count, reloc_count = \
+        MODULE_HEADER.unpack_from(buffer, 0)
+    if magic != MODULE_MAGIC:
+        raise ValueError("Not a CASL II relocatable module.")
+    if version != MODULE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported module format version {version}.")
+    try:
+        offset = MODULE_HEADER.size
+        end = offset + name_length + 2 * word_count
+        if end > len(buffer):
+            raise ValueError("Module is truncated.")
+        name = bytes(buffer[offset:offset + name_length]).decode('ascii') or None
+        offset += name_length
+        words = array('H', bytes(buffer[offset:end]))
+        exports, offset = _unpack_names(buffer, end, export_count)
+        symbols, offset = _unpack_names(buffer, offset, symbol_count)
+        if offset + 4 * reloc_count > len(buffer):
+            raise ValueError("Module is truncated.")
+        relocations = array('I', bytes(buffer[offset:offset + 4 * reloc_count]))
+        offset += 4 * reloc_count
+        if sys.byteorder != 'little':
+            words.byteswap()
+            relocations.byteswap()
+        imports = {}
+        (import_count,) = COUNT.unpack_from(buffer, offset)
+        offset += COUNT.size
+        for _ in range(import_count):
+            (length,) = NAME_LENGTH.unpack_from(buffer, offset)
+            offset += NAME_LENGTH.size
+            symbol = bytes(buffer[offset:offset + length]).decode('ascii')
+            offset += length
+            (count,) = COUNT.unpack_from(buffer, offset)
+            offset += COUNT.size
+            imports[symbol] = list(struct.unpack_from(f'<{count}I', buffer, offset))
+            offset += 4 * count
+    except struct.error:
+        raise ValueError("Module is truncated.")
+    return ObjectModule(name, words, entry_point, exports, symbols, relocations.tolist(), imports)
@@ -0,0 +1,340 @@
+"""
+A peephole optimizer for the compiler's intermediate representation.
+
+The optimizer runs between the compiler's first and second passes. It
+rewrites the list of parsed statements in place, then recomputes every
+statement address and the symbol table, so labels follow the code they
+were attached to. Rewrites:
+
+    jump_threading     Jxx L1 ... L1 JUMP L2        ->  Jxx L2
+    jump_to_next       JUMP L / Jxx L, L: next       ->  (removed)
+    dead_code          unlabeled instructions after JUMP or RET  ->  (removed)
+    store_reload       ST r,X / LD r,X               ->  ST r,X
+    constant_load      LD r,C where C DC n is never written  ->  LAD r,n
+
+LD sets the flags and ST and LAD do not, so the last two rewrites are only
+made when the flags they would change are overwritten before being read
+on the fall-through path. Programs that jump to numeric or indexed
+addresses are not checked for dead code, since any instruction could be a
+target.
+
+Cycle counts are static estimates: one cycle per instruction word fetched
+plus one per memory data or stack access. The simulator has no cycle model.
+"""
+
+from isa import REGISTER_FORMS
+from operands import OPCODE_MAP, REGISTER_MAP
+from svc_io import MAX_RECORD
+
+# Instructions that overwrite OF, SF and ZF.
+FLAG_SETTERS = {'LD', 'ADDA', 'SUBA', 'ADDL', 'SUBL', 'AND', 'OR', 'XOR',
+                'CPA', 'CPL', 'SLA', 'SRA', 'SLL', 'SRL'}
+# Instructions that read the flags.
+FLAG_READERS = {'JPL', 'JMI', 'JNZ', 'JZE', 'JOV'}
+# Instructions that neither read nor change the flags and always fall through.
+FLAG_NEUTRAL = {'LAD', 'ST', 'PUSH', 'POP', 'RPUSH', 'RPOP'}
+
+JUMPS = {'JUMP'} | FLAG_READERS
+BRANCHES = JUMPS | {'CALL'}
+# Register-memory instructions that read their memory operand.
+MEMORY_READERS = {'LD', 'ADDA', 'SUBA', 'ADDL', 'SUBL', 'AND', 'OR', 'XOR', 'CPA', 'CPL'}
+DIRECTIVES = {'START', 'END', 'DC', 'DS'}
+
+MAX_ROUNDS = 10
+
+
+def estimated_cycles(statement):
+    """Static cycle estimate for one statement (zero for directives)."""
+    opcode, operands = statement['opcode'], statement['operands']
+    if opcode in DIRECTIVES:
+        return 0
+    if opcode in REGISTER_FORMS and len(operands) == 2 and operands[1] in REGISTER_MAP:
+        return 1
+    cycles = OPCODE_MAP[opcode][1]
+    if opcode in MEMORY_READERS:
+        cycles += 1
+    elif opcode in ('ST', 'PUSH', 'POP', 'CALL', 'RET'):
+        cycles += 1
+    return cycles
+
+
+class PeepholeOptimizer:
+    """Applies the rewrite catalogue to a compiler's intermediate representation."""
+    def __init__(self, compiler):
+        """
+        :param compiler: A Compiler whose first pass has completed.
+        """
+        self.compiler = compiler
+        self.ir = compiler.intermediate_representation
+        self.rewrites = {name: 0 for name in (
+            'jump_threading', 'jump_to_next', 'dead_code', 'store_reload', 'constant_load')}
+
+    def optimize(self):
+        """
+        Rewrites the intermediate representation until no rule applies, then
+        relocates addresses and labels.
+
+        Returns:
+            A dict with 'words_saved', 'cycles_saved' (static estimate) and
+            'rewrites' (number of times each rule applied).
+        """
+        words_before = self._words()
+        cycles_before = sum(estimated_cycles(s) for s in self.ir)
+
+        for _ in range(MAX_ROUNDS):
+            self._labels = self._label_index()
+            changed = self._thread_jumps()
+            changed |= self._remove_jumps_to_next()
+            changed |= self._remove_dead_code()
+            changed |= self._remove_reloads()
+            changed |= self._load_constants()
+            if not changed:
+                break
+
+        self._relocate()
+        return {
+            'words_saved': words_before - self._words(),
+            'cycles_saved': cycles_before - sum(estimated_cycles(s) for s in self.ir),
+            'rewrites': self.rewrites,
+        }
+
+    # --- Helpers ---
+
+    def _words(self):
+        return sum(self.compiler._statement_length(s['opcode'], s['operands']) for s in self.ir)
+
+    def _names(self, statement):
+        """All labels attached to a statement."""
+        names = list(statement.get('aliases', ()))
+        if statement['label']:
+            names.insert(0, statement['label'])
+        return names
+
+    def _label_index(self):
+        """Maps every label to the index of its statement."""
+        return {name: i for i, s in enumerate(self.ir) for name in self._names(s)}
+
+    def _label_addresses(self):
+        """Maps every label to its address in the current statement list."""
+        addresses = {}
+        location = 0
+        for statement in self.ir:
+            for name in self._names(statement):
+                addresses[name] = location
+            location += self.compiler._statement_length(statement['opcode'], statement['operands'])
+        return addresses
+
+    def _is_label_target(self, statement):
+        """True for a branch whose only operand is a label (no index register)."""
+        operands = statement['operands']
+        return len(operands) == 1 and operands[0] in self._labels
+
+    def _remove(self, i):
+        """
+        Deletes statement i. Its labels move to the next statement, which
+        must exist; END is a valid holder for them.
+        """
+        statement = self.ir.pop(i)
+        names = self._names(statement)
+        if names:
+            successor = self.ir[i]
+            if successor['label'] is None:
+                successor['label'] = names.pop(0)
+            if names:
+                successor.setdefault('aliases', []).extend(names)
+        self._labels = self._label_index()
+
+    def _flags_dead(self, i):
+        """True if the flags are overwritten, before any read, from statement i on."""
+        for statement in self.ir[i:]:
+            opcode = statement['opcode']
+            if opcode in FLAG_SETTERS:
+                return True
+            if opcode not in FLAG_NEUTRAL:
+                # A reader, a transfer of control, data or the end of the program.
+                return False
+        return False
+
+    # --- Rules ---
+
+    def _thread_jumps(self):
+        """Retargets branches whose target is an unconditional JUMP to a label."""
+        changed = False
+        for statement in self.ir:
+            if statement['opcode'] not in BRANCHES or not self._is_label_target(statement):
+                continue
+            target = statement['operands'][0]
+            seen = {target}
+            while True:
+                hop = self.ir[self._labels[target]]
+                if hop['opcode'] != 'JUMP' or not self._is_label_target(hop):
+                    break
+                target = hop['operands'][0]
+                if target in seen:
+                    break  # A loop of jumps; leave it alone.
+                seen.add(target)
+            if target != statement['operands'][0]:
+                statement['operands'] = [target]
+                self.rewrites['jump_threading'] += 1
+                changed = True
+        return changed
+
+    def _remove_jumps_to_next(self):
+        """Removes branches (which do not touch the flags) to the next statement."""
+        changed = False
+        i = 0
+        while i < len(self.ir) - 1:
+            statement = self.ir[i]
+            if (statement['opcode'] in JUMPS and self._is_label_target(statement)
+                    and self._labels[statement['operands'][0]] == i + 1):
+                self._remove(i)
+                self.rewrites['jump_to_next'] += 1
+                changed = True
+            else:
+                i += 1
+        return changed
+
+    def _has_computed_branches(self):
+        """True if any branch targets a numeric or indexed address."""
+        return any(s['opcode'] in BRANCHES and not self._is_label_target(s) for s in self.ir)
+
+    def _remove_dead_code(self):
+        """Removes unlabeled instructions that follow an unconditional JUMP or RET."""
+        if self._has_computed_branches():
+            return False
+        changed = False
+        for i, statement in enumerate(self.ir):
+            if statement['opcode'] not in ('JUMP', 'RET'):
+                continue
+            while (i + 1 < len(self.ir) and not self._names(self.ir[i + 1])
+                   and self.ir[i + 1]['opcode'] not in DIRECTIVES):
+                self._remove(i + 1)
+                self.rewrites['dead_code'] += 1
+                changed = True
+        return changed
+
+    def _remove_reloads(self):
+        """Removes `LD r,X` directly after `ST r,X` when its flags are unused."""
+        changed = False
+        i = 0
+        while i < len(self.ir) - 2:
+            store, load = self.ir[i], self.ir[i + 1]
+            if (store['opcode'] == 'ST' and load['opcode'] == 'LD'
+                    and len(store['operands']) == 2 and store['operands'] == load['operands']
+                    and load['operands'][1] not in REGISTER_MAP
+                    and not self._names(load) and self._flags_dead(i + 2)):
+                self._remove(i + 1)
+                self.rewrites['store_reload'] += 1
+                changed = True
+            i += 1
+        return changed
+
+    def _read_only_constants(self):
+        """
+        Returns {label: value} for single-word DC constants that no instruction
+        can write. Operands are compared by address, so a label that shares
+        the constant's word (`C DS 0` before `D DC 5`) is caught: the word
+        must not be written by ST or IN, must not be address-taken (LAD,
+        PUSH, branches, START, OUT) and must carry no other label. Nothing
+        qualifies if any ST uses an index register or a numeric address, or
+        if the program issues SVC itself.
+        """
+        addresses = self._label_addresses()
+        written, taken = set(), set()
+        for s in self.ir:
+            opcode, operands = s['opcode'], s['operands']
+            if opcode == 'ST':
+                if len(operands) > 2 or self.compiler._is_constant(operands[1]):
+                    return {}
+                if operands[1] in addresses:
+                    written.add(addresses[operands[1]])
+            elif opcode == 'IN':
+                if any(self.compiler._is_constant(op) for op in operands):
+                    return {}
+                if operands[0] in addresses:
+                    buffer = addresses[operands[0]]
+                    written.update(range(buffer, buffer + MAX_RECORD))
+                if operands[1] in addresses:
+                    written.add(addresses[operands[1]])
+            elif opcode == 'SVC':
+                return {}
+            elif opcode in ('LAD', 'PUSH', 'START', 'OUT') or opcode in BRANCHES:
+                operands = operands[1:] if opcode == 'LAD' else operands
+                taken.update(addresses[op] for op in operands if op in addresses)
+        labels_at = {}
+        for name, address in addresses.items():
+            labels_at[address] = labels_at.get(address, 0) + 1
+        constants = {}
+        for s in self.ir:
+            names = self._names(s)
+            if s['opcode'] != 'DC' or len(s['operands']) != 1 or len(names) != 1:
+                continue
+            address = addresses[names[0]]
+            if address in written or address in taken or labels_at[address] != 1:
+                continue
+            try:
+                constants[names[0]] = self.compiler._parse_constant(s['operands'][0])
+            except ValueError:
+                continue
+        return constants
+
+    def _load_constants(self):
+        """Turns `LD r,C` of a read-only constant into `LAD r,value` when its flags are unused."""
+        constants = self._read_only_constants()
+        changed = False
+        for i, statement in enumerate(self.ir):
+            operands = statement['operands']
+            if (statement['opcode'] == 'LD' and len(operands) == 2
+                    and operands[1] in constants and self._flags_dead(i + 1)):
+                statement['opcode'] = 'LAD'
+                statement['operands'] = [operands[0], str(constants[operands[1]])]
+                self.rewrites['constant_load'] += 1
+                changed = True
+        return changed
+
+    # --- Relocation ---
+
+    def _relocate(self):
+        """Recomputes statement addresses and rebuilds the symbol table."""
+        symbol_table = {}
+        location = 0
+        for statement in self.ir:
+            statement['address'] = location
+            for name in self._names(statement):
+                symbol_table[name] = location
+            location += self.compiler._statement_length(statement['opcode'], statement['operands'])
+        self.compiler.symbol_table = symbol_table
+
+
+if __name__ == '__main__':
+    from compilor import Compiler
+    from simulator import COMET2Simulator
+
+    # C and D name the same word, so ST GR1,C overwrites the constant D
+    # and LD GR2,D must not become LAD GR2,5.
+    aliased = """
+    PGM      START
+             LAD   GR1,9
+             ST    GR1,C
+             LD    GR2,D
+             LD    GR3,E
+             LD    GR4,GR2
+             RET
+    C        DS    0
+    D        DC    5
+    E        DC    7
+             END
+    """
+    results = []
+    for optimize in (False, True):
+        compiler = Compiler(verbose=False, optimize=optimize)
+        compiler.compile(aliased)
+        simulator = COMET2Simulator(verbose=False)
+        simulator.load_program(compiler.machine_code)
+        simulator.run_turbo()
+        results.append(simulator.gr[2])
+        if optimize:
+            print(f"Rewrites: {compiler.optimization_report['rewrites']}")
+    print(f"GR2 without/with optimization: {results}")
+    assert results == [9, 9]
+    assert compiler.optimization_report['rewrites']['constant_load'] == 1   # only E
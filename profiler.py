@@ -0,0 +1,199 @@
+"""
+An opt-in execution profiler for the COMET II simulator.
+
+While attached, the profiler counts executions per address and per opcode
+(plain array increments) and the number of instructions executed in each
+CALL/RET call stack. The counts are attributed to CASL II labels and source
+lines afterwards, using the compiler's symbol table and intermediate
+representation, and can be written as a collapsed-stack file for flame graph
+tools (one "frame;frame;frame count" line per stack).
+
+Counts are instruction executions; the simulator has no cycle model.
+
+Usage:
+    python profiler.py SOURCE [--max-instructions N] [--collapsed FILE]
+"""
+
+import argparse
+import bisect
+from array import array
+
+from isa import DECODE, ENCODE
+
+CALL_OPCODE = ENCODE['CALL'].opcode
+RET_OPCODE = ENCODE['RET'].opcode
+
+# Reverse lookup for reports: opcode -> mnemonic
+OPCODE_NAMES = {entry.opcode: entry.mnemonic for entry in DECODE if entry is not None}
+
+
+class Profiler:
+    """Collects execution counts from a simulator through its step hooks."""
+
+    def __init__(self):
+        self.address_counts = array('Q', bytes(8 * 65536))
+        self.opcode_counts = array('Q', bytes(8 * 256))
+        self.stack_counts = {}   # tuple of frame entry addresses -> instructions
+        self.total = 0
+        self.simulator = None
+        self._stack = ()
+        self._mark = 0           # value of `total` when the current stack was entered
+
+    def attach(self, simulator):
+        """Starts profiling; the current Program Counter is the root frame."""
+        self.simulator = simulator
+        self._stack = (simulator.pr,)
+        self._mark = self.total
+        simulator._step_hooks.append(self.record)
+
+    def detach(self):
+        """Stops profiling."""
+        self._flush()
+        self.simulator._step_hooks.remove(self.record)
+        self.simulator = None
+
+    def _flush(self):
+        """Credits the instructions since the last stack change to the current stack."""
+        if self.total != self._mark:
+            self.stack_counts[self._stack] = self.stack_counts.get(self._stack, 0) + self.total - self._mark
+            self._mark = self.total
+
+    def record(self, pc):
+        """Counts the instruction just executed at `pc`. Called after every step."""
+        self.address_counts[pc] += 1
+        opcode = self.simulator.memory[pc] >> 8
+        self.opcode_counts[opcode] += 1
+        self.total += 1
+        if opcode == CALL_OPCODE:
+            self._flush()
+            self._stack = self._stack + (self.simulator.pr,)
+        elif opcode == RET_OPCODE and len(self._stack) > 1:
+            self._flush()
+            self._stack = self._stack[:-1]
+
+    # --- Attribution ---
+
+    def _label_lookup(self, symbol_table):
+        """Returns a function mapping an address to the nearest label at or before it."""
+        labels = sorted((address, name) for name, address in symbol_table.items())
+        addresses = [address for address, _ in labels]
+
+        def lookup(address):
+            i = bisect.bisect_right(addresses, address) - 1
+            if i < 0:
+                return f"{address:04X}"
+            return labels[i][1]
+        return lookup
+
+    def by_label(self, symbol_table):
+        """Returns [(label, count)] sorted by descending count."""
+        lookup = self._label_lookup(symbol_table)
+        totals = {}
+        for address, count in enumerate(self.address_counts):
+            if count:
+                label = lookup(address)
+                totals[label] = totals.get(label, 0) + count
+        return sorted(totals.items(), key=lambda item: -item[1])
+
+    def by_line(self, intermediate_representation):
+        """
+        Returns [(line, statement text, count)] sorted by descending count,
+        using the 'address' and 'line' fields of the compiler's intermediate
+        representation.
+        """
+        statements = [s for s in intermediate_representation if s['opcode'] not in ('START', 'END')]
+        statements.sort(key=lambda s: s['address'])
+        starts = [s['address'] for s in statements]
+        totals = {}
+        for address, count in enumerate(self.address_counts):
+            if not count:
+                continue
+            i = bisect.bisect_right(starts, address) - 1
+            if i < 0:
+                continue
+            statement = statements[i]
+            key = statement.get('line', statement['address'])
+            if key not in totals:
+                text = f"{statement['opcode']} {','.join(statement['operands'])}".strip()
+                if statement['label']:
+                    text = f"{statement['label']} {text}"
+                totals[key] = [text, 0]
+            totals[key][1] += count
+        return sorted(((line, text, count) for line, (text, count) in totals.items()),
+                      key=lambda item: -item[2])
+
+    def by_opcode(self):
+        """Returns [(mnemonic or hex opcode, count)] sorted by descending count."""
+        rows = [(OPCODE_NAMES.get(opcode, f"{opcode:02X}"), count)
+                for opcode, count in enumerate(self.opcode_counts) if count]
+        return sorted(rows, key=lambda item: -item[1])
+
+    def report(self, compiler, top=20):
+        """
+        Formats a text report of the hottest labels, source lines and opcodes.
+        :param compiler: The Compiler that produced the profiled program.
+        :param top: Number of rows per section.
+        """
+        total = self.total or 1
+        lines = [f"--- Profile: {self.total} instructions executed ---", "", "By label:"]
+        for label, count in self.by_label(compiler.symbol_table)[:top]:
+            lines.append(f"  {count:>12} {100 * count / total:6.2f}%  {label}")
+        lines += ["", "By source line:"]
+        for line, text, count in self.by_line(compiler.intermediate_representation)[:top]:
+            lines.append(f"  {count:>12} {100 * count / total:6.2f}%  line {line}: {text}")
+        lines += ["", "By opcode:"]
+        for name, count in self.by_opcode()[:top]:
+            lines.append(f"  {count:>12} {100 * count / total:6.2f}%  {name}")
+        return "\n".join(lines)
+
+    def write_collapsed(self, path, symbol_table):
+        """
+        Writes the CALL/RET stacks in collapsed-stack format, naming each frame
+        after the label of its entry address.
+        """
+        self._flush()
+        lookup = self._label_lookup(symbol_table)
+        merged = {}
+        for stack, count in self.stack_counts.items():
+            key = ";".join(lookup(address) for address in stack)
+            merged[key] = merged.get(key, 0) + count
+        with open(path, 'w') as f:
+            for key, count in sorted(merged.items()):
+                f.write(f"{key} {count}\n")
+
+
+def main(argv=None):
+    from compilor import Compiler
+    from simulator import COMET2Simulator
+
+    parser = argparse.ArgumentParser(description="Profile a CASL II program.")
+    parser.add_argument('source', help="CASL II source file")
+    parser.add_argument('--max-instructions', type=int, default=10_000_000)
+    parser.add_argument('--collapsed', help="write collapsed stacks for flame graphs to this file")
+    args = parser.parse_args(argv)
+
+    with open(args.source) as f:
+        source = f.read()
+    compiler = Compiler(verbose=False)
+    machine_code = compiler.compile(source)
+    if machine_code is None:
+        print(f"Compilation Error: {compiler.error}")
+        return 1
+
+    simulator = COMET2Simulator(verbose=False)
+    simulator.load_program(machine_code, compiler.start_address)
+    simulator.pr = compiler.entry_point
+    profiler = Profiler()
+    profiler.attach(simulator)
+    stats = simulator.run_turbo(max_instructions=args.max_instructions)
+    profiler.detach()
+
+    print(f"Run finished: {stats['status']}" + (f" ({simulator.fault})" if simulator.fault else ""))
+    print(profiler.report(compiler))
+    if args.collapsed:
+        profiler.write_collapsed(args.collapsed, compiler.symbol_table)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,382 @@
+"""
+Reverse execution ("time travel") for the COMET II simulator.
+
+While attached, the debugger records an undo delta for every instruction the
+simulator executes: the Program Counter, flags and Stack Pointer before the
+instruction, the previous values of the registers it changed, and the
+previous values of the memory words it overwrote. Deltas are kept in typed
+arrays. Every `checkpoint_interval` instructions a full snapshot is taken as
+well; snapshots share unchanged memory pages, so they are cheap.
+
+When the recorded history exceeds `memory_limit` bytes, the oldest deltas are
+discarded, and then the oldest checkpoints are thinned out. Going back past
+the oldest retained delta restores the nearest earlier checkpoint and
+re-executes forward from it, which is exact because execution is
+deterministic.
+
+The machine must only be changed by executing instructions while the
+debugger is attached; registers or memory written directly are not recorded.
+"""
+
+from array import array
+
+DEFAULT_CHECKPOINT_INTERVAL = 100_000
+DEFAULT_MEMORY_LIMIT = 64 * 1024 * 1024
+# Estimated bytes per checkpoint, excluding the memory pages it does not share.
+CHECKPOINT_OVERHEAD = 2 * 256 * 8 + 200
+PAGE_BYTES = 512
+
+
+class ReverseDebugger:
+    """Records undo history for a simulator and moves it backward in time."""
+    def __init__(self, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL, memory_limit=DEFAULT_MEMORY_LIMIT):
+        """
+        :param checkpoint_interval: Instructions between full snapshots.
+        :param memory_limit: Approximate cap, in bytes, on the recorded history.
+        """
+        self.checkpoint_interval = checkpoint_interval
+        self.memory_limit = memory_limit
+        self.simulator = None
+        self.step = 0            # Instructions executed since attaching
+        self.first_delta = 0     # Step undone by the oldest retained delta
+
+        # One entry per retained step.
+        self._pcs = array('H')
+        self._flags = array('B')        # OF << 2 | SF << 1 | ZF
+        self._sps = array('H')
+        self._register_starts = array('I')
+        self._memory_starts = array('I')
+        # Variable-length parts: (register index, old value) and (address, old value) pairs.
+        self._register_log = array('H')
+        self._memory_log = array('H')
+
+        self.checkpoints = []    # [(step, Snapshot, estimated bytes)], oldest first
+        self._checkpoint_bytes = 0
+        self._pending_writes = array('H')
+        self._registers = array('H', bytes(16))
+        self._previous_flags = 0
+        self._previous_sp = 0
+        self._original_store = None
+        self._store_wrapper = None   # (wrapper, simulator had its own _store)
+        self._pruning = True     # Off while run_back regenerates a segment
+
+    # --- Recording ---
+
+    def attach(self, simulator):
+        """Starts recording; the current state becomes step 0."""
+        self.simulator = simulator
+        had_own_store = '_store' in simulator.__dict__
+        original_store = self._original_store = simulator._store
+        pending = self._pending_writes
+        memory = simulator.memory
+
+        def store(address, value):
+            # After detaching, a wrapper that could not be unlinked only passes writes on.
+            if self.simulator is not None:
+                pending.append(address)
+                pending.append(memory[address])
+            original_store(address, value)
+
+        simulator._store = store
+        self._store_wrapper = (store, had_own_store)
+        simulator._step_hooks.append(self.record)
+        self.step = 0
+        self._discard_from(0)
+        self.checkpoints = []
+        self._checkpoint_bytes = 0
+        self._add_checkpoint()
+        self._sync()
+
+    def detach(self):
+        """Stops recording and discards the history."""
+        simulator = self.simulator
+        simulator._step_hooks.remove(self.record)
+        store, had_own_store = self._store_wrapper
+        # Unwrap only if nothing (a write watchpoint, a tracer) has wrapped
+        # `_store` since; otherwise the wrapper stays in the chain, doing nothing.
+        if simulator.__dict__.get('_store') is store:
+            if had_own_store:
+                simulator._store = self._original_store
+            else:
+                del simulator._store
+        self._store_wrapper = None
+        self.simulator = None
+        self.checkpoints = []
+        self._discard_from(self.first_delta)
+
+    def _sync(self):
+        """Takes the current machine state as the 'before' state of the next step."""
+        simulator = self.simulator
+        self._registers[:] = simulator.gr
+        self._previous_flags = simulator.of << 2 | simulator.sf << 1 | simulator.zf
+        self._previous_sp = simulator.sp
+        del self._pending_writes[:]
+
+    def record(self, pc):
+        """Records the undo delta of the instruction just executed at `pc`."""
+        simulator = self.simulator
+        self._pcs.append(pc)
+        self._flags.append(self._previous_flags)
+        self._sps.append(self._previous_sp)
+        self._register_starts.append(len(self._register_log))
+        self._memory_starts.append(len(self._memory_log))
+
+        gr = simulator.gr
+        registers = self._registers
+        if gr != registers:
+            for i in range(8):
+                if gr[i] != registers[i]:
+                    self._register_log.append(i)
+                    self._register_log.append(registers[i])
+                    registers[i] = gr[i]
+        if self._pending_writes:
+            self._memory_log.extend(self._pending_writes)
+            del self._pending_writes[:]
+        self._previous_flags = simulator.of << 2 | simulator.sf << 1 | simulator.zf
+        self._previous_sp = simulator.sp
+
+        self.step += 1
+        if self.step % self.checkpoint_interval == 0:
+            self._add_checkpoint()
+            if self._pruning and self.history_bytes() > self.memory_limit:
+                self._prune()
+
+    def _add_checkpoint(self):
+        """Snapshots the machine as the checkpoint for the current step."""
+        snapshot = self.simulator.snapshot()
+        cost = CHECKPOINT_OVERHEAD
+        if self.checkpoints:
+            previous = self.checkpoints[-1][1].pages
+            cost += PAGE_BYTES * sum(1 for a, b in zip(previous, snapshot.pages) if a is not b)
+        else:
+            cost += PAGE_BYTES * len(set(map(id, snapshot.pages)))
+        self.checkpoints.append((self.step, snapshot, cost))
+        self._checkpoint_bytes += cost
+
+    def history_bytes(self):
+        """Approximate size of the recorded history in bytes."""
+        deltas = sum(column.itemsize * len(column) for column in (
+            self._pcs, self._flags, self._sps, self._register_starts, self._memory_starts,
+            self._register_log, self._memory_log))
+        return deltas + self._checkpoint_bytes
+
+    def _prune(self):
+        """Discards the oldest history until it fits in `memory_limit`."""
+        # Deltas since the latest checkpoint are always kept, so replaying
+        # from a checkpoint never loses the deltas it has just recorded.
+        latest = self.checkpoints[-1][0]
+        while self.history_bytes() > self.memory_limit and self.first_delta < latest:
+            retained = self.step - self.first_delta
+            self._discard_oldest(min(latest - self.first_delta, max(1, retained // 4)))
+        # Then thin out checkpoints older than the oldest delta, keeping the
+        # newest of them so that every retained step stays reachable.
+        while self.history_bytes() > self.memory_limit:
+            old = [i for i, (step, _, _) in enumerate(self.checkpoints) if step < self.first_delta]
+            if len(old) < 2:
+                break
+            for i in reversed(old[-2::-2]):
+                self._checkpoint_bytes -= self.checkpoints[i][2]
+                del self.checkpoints[i]
+
+    def _discard_oldest(self, count):
+        """Drops the `count` oldest deltas."""
+        register_shift = self._register_starts[count] if count < len(self._register_starts) else len(self._register_log)
+        memory_shift = self._memory_starts[count] if count < len(self._memory_starts) else len(self._memory_log)
+        del self._pcs[:count]
+        del self._flags[:count]
+        del self._sps[:count]
+        self._register_starts = array('I', (start - register_shift for start in self._register_starts[count:]))
+        self._memory_starts = array('I', (start - memory_shift for start in self._memory_starts[count:]))
+        del self._register_log[:register_shift]
+        del self._memory_log[:memory_shift]
+        self.first_delta += count
+
+    def _discard_from(self, step):
+        """Drops the deltas of `step` and later, and sets first_delta if nothing remains."""
+        index = max(0, step - self.first_delta)
+        if index < len(self._pcs):
+            del self._register_log[self._register_starts[index]:]
+            del self._memory_log[self._memory_starts[index]:]
+        for column in (self._pcs, self._flags, self._sps, self._register_starts, self._memory_starts):
+            del column[index:]
+        if not self._pcs:
+            self.first_delta = step
+
+    # --- Moving backward ---
+
+    def _undo(self):
+        """Undoes the most recent retained step."""
+        simulator = self.simulator
+        index = len(self._pcs) - 1
+        register_start = self._register_starts[index]
+        memory_start = self._memory_starts[index]
+
+        log = self._register_log
+        for i in range(register_start, len(log), 2):
+            simulator.gr[log[i]] = log[i + 1]
+        log = self._memory_log
+        for i in range(len(log) - 2, memory_start - 1, -2):
+            self._original_store(log[i], log[i + 1])
+        flags = self._flags[index]
+        simulator.of, simulator.sf, simulator.zf = flags >> 2 & 1, flags >> 1 & 1, flags & 1
+        simulator.sp = self._sps[index]
+        simulator.pr = self._pcs[index]
+
+        del self._register_log[register_start:]
+        del self._memory_log[memory_start:]
+        for column in (self._pcs, self._flags, self._sps, self._register_starts, self._memory_starts):
+            column.pop()
+        self.step -= 1
+        # Checkpoints in the undone future are re-created when it is re-executed.
+        while self.checkpoints and self.checkpoints[-1][0] > self.step:
+            self._checkpoint_bytes -= self.checkpoints.pop()[2]
+
+    def _writes(self, index):
+        """Addresses written by the retained step at delta `index`."""
+        end = self._memory_starts[index + 1] if index + 1 < len(self._memory_starts) else len(self._memory_log)
+        return self._memory_log[self._memory_starts[index]:end:2]
+
+    def _replay_from_checkpoint(self, target):
+        """
+        Restores the latest checkpoint at or before `target` and executes
+        forward to `target`, recording deltas again.
+        """
+        checkpoint = None
+        while self.checkpoints and self.checkpoints[-1][0] > target:
+            self._checkpoint_bytes -= self.checkpoints.pop()[2]
+        if self.checkpoints:
+            checkpoint = self.checkpoints[-1]
+        if checkpoint is None:
+            raise ValueError(f"History before step {self.first_delta} has been discarded.")
+        step, snapshot, _ = checkpoint
+        self.simulator.restore(snapshot)
+        self.step = step
+        self._discard_from(step)
+        self.first_delta = step
+        self._sync()
+        self._run_forward(target - step)
+        self.simulator.is_running = False
+
+    def _run_forward(self, count):
+        """Executes `count` instructions, passing over breakpoints and watchpoints."""
+        target = self.step + count
+        while self.step < target:
+            status = self.simulator.run_turbo(max_instructions=target - self.step)['status']
+            if status not in ('breakpoint', 'watchpoint'):
+                break
+
+    def earliest_step(self):
+        """The earliest step that can still be reached."""
+        if self.checkpoints:
+            return min(self.first_delta, self.checkpoints[0][0])
+        return self.first_delta
+
+    def goto(self, target):
+        """
+        Moves the machine to the state after `target` instructions (counted
+        from attaching), backward through the undo history or a checkpoint,
+        or forward by executing. Raises ValueError if `target` is earlier than
+        `earliest_step()`.
+        """
+        if target < self.earliest_step():
+            raise ValueError(f"History before step {self.earliest_step()} has been discarded.")
+        if target > self.step:
+            self._run_forward(target - self.step)
+        elif target < self.first_delta:
+            self._replay_from_checkpoint(target)
+        else:
+            while self.step > target:
+                self._undo()
+        self.simulator.is_running = False
+        self.simulator.fault = None
+        self._sync()
+
+    def step_back(self, count=1):
+        """Undoes the last `count` instructions (fewer if the history runs out)."""
+        self.goto(max(self.earliest_step(), self.step - count))
+
+    def run_back(self, pc=None, address=None):
+        """
+        Runs backward until the machine is about to execute the instruction at
+        `pc`, or is just before the most recent instruction that wrote
+        `address` (whichever comes first).
+
+        :return: True if such a point was found; otherwise the machine is left
+                 at `earliest_step()`.
+        """
+        if pc is None and address is None:
+            raise ValueError("Give a Program Counter or a memory address to stop at.")
+        try:
+            return self._search_back(pc, address)
+        finally:
+            if self.history_bytes() > self.memory_limit and self.checkpoints:
+                self._prune()
+
+    def _search_back(self, pc, address):
+        """Undoes steps, replaying earlier segments as needed, for run_back."""
+        while True:
+            while self.step > self.first_delta:
+                index = len(self._pcs) - 1
+                found = (pc is not None and self._pcs[index] == pc) or \
+                        (address is not None and address in self._writes(index))
+                self._undo()
+                if found:
+                    self._sync()
+                    return True
+            if not any(step < self.step for step, _, _ in self.checkpoints):
+                self._sync()
+                return False
+            # The older deltas were discarded: regenerate them from the
+            # previous checkpoint and keep searching. The segment is kept
+            # whole even if it exceeds the memory limit for a while.
+            end = self.step
+            self._pruning = False
+            try:
+                self._replay_from_checkpoint(end - 1)
+                self._run_forward(1)
+            finally:
+                self._pruning = True
+            self.simulator.is_running = False
+            if self.first_delta >= end:
+                self._sync()
+                return False
+
+
+if __name__ == '__main__':
+    from simulator import COMET2Simulator
+
+    program = [
+        '1010', '0009',  # LD    GR1, A
+        '2010', '000A',  # ADDA  GR1, B
+        '1110', '000B',  # ST    GR1, C
+        '1110', '000A',  # ST    GR1, B
+        '0000',          # HALT
+        '0003',          # A     DC    3
+        '0005',          # B     DC    5
+        '0000',          # C     DS    1
+    ]
+    simulator = COMET2Simulator(verbose=False)
+    simulator.load_program(program)
+    debugger = ReverseDebugger(checkpoint_interval=2)
+    debugger.attach(simulator)
+    simulator.run_turbo()
+    print(f"Ran {debugger.step} instructions; PC={simulator.pr:04X}, B={simulator.memory[0x0A]}")
+
+    debugger.step_back(2)
+    print(f"Two steps back: step {debugger.step}, PC={simulator.pr:04X}, B={simulator.memory[0x0A]}")
+    debugger.goto(debugger.step + 2)
+    debugger.run_back(address=0x0B)
+    print(f"Before C was written: step {debugger.step}, PC={simulator.pr:04X}, C={simulator.memory[0x0B]}")
+    debugger.run_back(pc=0x0000)
+    print(f"Back at the start: step {debugger.step}, registers {list(simulator.gr)}")
+
+    # A write watchpoint set while recording keeps working after detaching.
+    watched = COMET2Simulator(verbose=False)
+    watched.load_program(program)
+    debugger = ReverseDebugger()
+    debugger.attach(watched)
+    watched.set_watchpoint(0x0B)
+    debugger.detach()
+    stats = watched.run_turbo()
+    assert stats['status'] == 'watchpoint' and watched.watch_hit['address'] == 0x0B, stats
+    print(f"Watchpoint after detach: {stats['status']} at {watched.watch_hit['address']:04X}")
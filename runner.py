@@ -0,0 +1,176 @@
+"""
+Time-sliced execution of COMET II simulators.
+
+`round_robin` interleaves many simulators on the calling thread, one slice
+of each in turn. `SimulationRunner` runs one simulator on a background
+thread, in slices, so that a front end can pause, resume or cancel it and
+receive progress callbacks between slices. Both are built on
+`COMET2Simulator.step`, which always returns after a bounded number of
+instructions.
+"""
+
+import threading
+import time
+
+DEFAULT_SLICE = 4096   # instructions per slice
+
+
+def round_robin(simulators, slice_instructions=DEFAULT_SLICE, max_instructions=None):
+    """
+    Runs simulators one slice at a time in turn, so that no program can
+    starve the others, until all of them have stopped.
+
+    :param simulators: The simulators to run.
+    :param max_instructions: Optional budget for each simulator.
+    :return: A list of (instructions executed, final status), in the order
+             of `simulators`.
+    """
+    slices = [simulator.run_slices(slice_instructions, max_instructions) for simulator in simulators]
+    results = [None] * len(slices)
+    active = list(range(len(slices)))
+    while active:
+        still_running = []
+        for i in active:
+            executed, status = next(slices[i])
+            if status is None:
+                still_running.append(i)
+            else:
+                results[i] = (executed, status)
+        active = still_running
+    return results
+
+
+class SimulationRunner:
+    """
+    Runs a simulator on a background thread in slices.
+
+    Between slices the worker thread checks for pause and cancel requests
+    and calls the progress callback. The simulator may be inspected while
+    the runner is paused or finished; it must not be touched while it runs.
+    """
+
+    def __init__(self, simulator, slice_instructions=DEFAULT_SLICE, max_instructions=None,
+                 on_progress=None):
+        """
+        :param simulator: The COMET2Simulator to run, with its program loaded.
+        :param slice_instructions: Instructions executed between checks.
+        :param max_instructions: Optional instruction budget for the run.
+        :param on_progress: Optional callable, called on the worker thread
+                            as on_progress(runner) after every slice.
+        """
+        self.simulator = simulator
+        self.slice_instructions = slice_instructions
+        self.max_instructions = max_instructions
+        self.on_progress = on_progress
+
+        self.state = 'ready'     # 'running', 'paused' or 'finished'
+        self.status = None       # final status of the run, or 'cancelled'
+        self.instructions = 0
+        self.elapsed = 0.0
+        self._thread = None
+        self._condition = threading.Condition()
+        self._pause_requested = False
+        self._cancelled = False
+
+    def start(self):
+        """Starts the worker thread."""
+        if self._thread is not None:
+            raise RuntimeError("Runner already started")
+        self.state = 'running'
+        self._thread = threading.Thread(target=self._work, name="COMET2SimulationRunner", daemon=True)
+        self._thread.start()
+        return self
+
+    def pause(self):
+        """Pauses after the current slice and waits until the worker has stopped."""
+        with self._condition:
+            self._pause_requested = True
+            while self.state == 'running':
+                self._condition.wait()
+
+    def resume(self):
+        """Resumes a paused run."""
+        with self._condition:
+            self._pause_requested = False
+            self._condition.notify_all()
+
+    def cancel(self):
+        """Stops the run after the current slice, even if it is paused."""
+        with self._condition:
+            self._cancelled = True
+            self._condition.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the run to finish.
+        :return: True if it finished, False on timeout.
+        """
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def result(self):
+        """Returns statistics in the form returned by `run_turbo` (once finished)."""
+        return {
+            'status': self.status,
+            'instructions': self.instructions,
+            'elapsed': self.elapsed,
+            'mips': self.instructions / self.elapsed / 1e6 if self.elapsed > 0 else 0.0,
+        }
+
+    def _work(self):
+        started = time.perf_counter()
+        try:
+            for executed, status in self.simulator.run_slices(self.slice_instructions, self.max_instructions):
+                self.instructions = executed
+                if status is not None:
+                    self.status = status
+                    break
+                if self.on_progress is not None:
+                    self.on_progress(self)
+                with self._condition:
+                    if self._pause_requested and not self._cancelled:
+                        self.elapsed += time.perf_counter() - started
+                        self.state = 'paused'
+                        self._condition.notify_all()
+                        while self._pause_requested and not self._cancelled:
+                            self._condition.wait()
+                        self.state = 'running'
+                        started = time.perf_counter()
+                    if self._cancelled:
+                        self.status = 'cancelled'
+                        break
+        finally:
+            with self._condition:
+                self.elapsed += time.perf_counter() - started
+                self.state = 'finished'
+                self._condition.notify_all()
+
+
+if __name__ == '__main__':
+    from simulator import COMET2Simulator
+
+    # 30,000 instructions of LAD GR1,1,GR1 (GR1 += 1), then HALT.
+    counting_program = ['1211', '0001'] * 30000 + ['0000']
+
+    def new_simulator():
+        simulator = COMET2Simulator(verbose=False)
+        simulator.load_program(counting_program)
+        return simulator
+
+    simulator = new_simulator()
+    runner = SimulationRunner(simulator, slice_instructions=1000).start()
+    runner.pause()
+    print(f"Paused after {runner.instructions} instructions, GR1={simulator.gr[1]}")
+    runner.resume()
+    runner.wait()
+    print(f"Finished: {runner.result()}")
+
+    # Cancel from the progress callback once 10,000 instructions have run.
+    runner = SimulationRunner(new_simulator(), slice_instructions=1000,
+                              on_progress=lambda r: r.instructions >= 10000 and r.cancel()).start()
+    runner.wait()
+    print(f"Cancelled: {runner.status} after {runner.instructions} instructions")
+
+    # Three programs sharing this thread, one slice each in turn.
+    machines = [new_simulator() for _ in range(3)]
+    print(f"Round robin: {round_robin(machines, slice_instructions=1000)}")
@@ -0,0 +1,293 @@
+"""
+A long-lived local server that compiles and runs CASL II jobs over HTTP.
+
+Starting a process, importing the modules and building a Compiler and a
+COMET2Simulator cost far more than assembling and running a typical job.
+The server pays for them once: it keeps a pool of ready compiler/simulator
+pairs, resets each simulator between jobs (clearing only the pages the last
+job wrote), and caches assembled images by the SHA-256 of their source, so a
+repeated program is loaded straight from its cached image.
+
+Endpoints (JSON, localhost only by default):
+    POST /run       Body: a job object as in batch.py (source, memory,
+                    registers, dump, max_instructions, time_limit), plus an
+                    optional "input" string for the IN macro. Returns the
+                    batch.py result plus "output" (OUT records) and "cached".
+                    The job's limits are capped at the server's; a job that
+                    fails validation is answered with status 'invalid_job'
+                    without touching the pool.
+    GET  /metrics   Job counts, cache hit rate, latency percentiles and
+                    throughput.
+    GET  /health    {"status": "ok"}
+
+Usage:
+    python server.py [--host HOST] [--port PORT] [--pool N] [--cache N]
+"""
+
+import argparse
+import hashlib
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batch import (DEFAULT_MAX_INSTRUCTIONS, DEFAULT_TIME_LIMIT, apply_initial_state, final_state,
+                   job_limits, validate_job)
+from compilor import Compiler
+from simulator import COMET2Simulator
+from svc_io import BufferedBackend
+
+DEFAULT_PORT = 8642
+DEFAULT_POOL_SIZE = 4
+DEFAULT_CACHE_SIZE = 1024      # assembled images kept
+LATENCY_WINDOW = 1000          # recent jobs used for latency percentiles
+
+
+class WarmPool:
+    """A fixed set of pre-initialized (Compiler, COMET2Simulator) pairs."""
+
+    def __init__(self, size):
+        self.size = size
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put((Compiler(verbose=False), COMET2Simulator(verbose=False)))
+
+    def acquire(self):
+        """Waits for an idle pair and returns it."""
+        return self._idle.get()
+
+    def release(self, pair):
+        """Resets the simulator and returns the pair to the pool."""
+        pair[1].reset()
+        self._idle.put(pair)
+
+    def idle(self):
+        return self._idle.qsize()
+
+
+class ImageCache:
+    """Assembled images keyed by the SHA-256 of their source, least recently used first out."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()   # digest -> (words, start address, entry point)
+        self._lock = threading.Lock()
+
+    def get(self, source, compiler):
+        """
+        Returns (image, cached) for `source`, where image is a (words,
+        start address, entry point) tuple, assembling it with `compiler` on a
+        miss. Raises ValueError with the compiler's message on an error.
+        """
+        digest = hashlib.sha256(source.encode()).digest()
+        with self._lock:
+            image = self._images.get(digest)
+            if image is not None:
+                self._images.move_to_end(digest)
+                self.hits += 1
+                return image, True
+            self.misses += 1
+        words = compiler.compile_single_pass(source)
+        if words is None:
+            raise ValueError(compiler.error)
+        image = (words, compiler.start_address, compiler.entry_point)
+        with self._lock:
+            self._images[digest] = image
+            if len(self._images) > self.capacity:
+                self._images.popitem(last=False)
+        return image, False
+
+    def __len__(self):
+        return len(self._images)
+
+
+class Metrics:
+    """Counters and recent latencies, safe to update from handler threads."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.jobs = 0
+        self.statuses = {}
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def record(self, status, latency):
+        with self._lock:
+            self.jobs += 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self._latencies.append(latency)
+
+    def report(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            jobs, statuses = self.jobs, dict(self.statuses)
+        uptime = time.time() - self.started
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else None
+
+        return {
+            'uptime': uptime,
+            'jobs': jobs,
+            'statuses': statuses,
+            'throughput': jobs / uptime if uptime > 0 else 0.0,
+            'latency_ms': {
+                'mean': sum(latencies) / len(latencies) * 1000 if latencies else None,
+                'p50': percentile(0.50),
+                'p95': percentile(0.95),
+                'p99': percentile(0.99),
+                'max': latencies[-1] * 1000 if latencies else None,
+            },
+        }
+
+
+class JobServer:
+    """Runs jobs on pooled compilers and simulators."""
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, cache_size=DEFAULT_CACHE_SIZE,
+                 max_instructions=DEFAULT_MAX_INSTRUCTIONS, time_limit=DEFAULT_TIME_LIMIT):
+        self.pool = WarmPool(pool_size)
+        self.cache = ImageCache(cache_size)
+        self.metrics = Metrics()
+        # Defaults for jobs that set no limits, and caps for those that do.
+        self.max_instructions = max_instructions
+        self.time_limit = time_limit
+
+    def run_job(self, job):
+        """
+        Compiles (or fetches from the cache) and runs one job.
+        :return: A JSON-serializable result dict, as `batch.run_job` returns
+                 plus 'output' and 'cached'.
+        """
+        start = time.perf_counter()
+        result = {'id': job.get('id')}
+        try:
+            validate_job(job)
+            if job.get('input') is not None and not isinstance(job['input'], str):
+                raise ValueError("'input' must be a string")
+        except (ValueError, TypeError) as e:
+            result.update(status='invalid_job', error=str(e), timings={'total': time.perf_counter() - start})
+            self.metrics.record(result['status'], result['timings']['total'])
+            return result
+        max_instructions, time_limit = job_limits(job, self.max_instructions, self.time_limit)
+        max_instructions = min(max_instructions, self.max_instructions)
+        time_limit = min(time_limit, self.time_limit)
+
+        pair = self.pool.acquire()
+        compiler, simulator = pair
+        try:
+            compile_start = time.perf_counter()
+            try:
+                (words, start_address, entry_point), cached = self.cache.get(job['source'], compiler)
+            except ValueError as e:
+                result.update(status='compile_error', error=str(e),
+                              timings={'compile': time.perf_counter() - compile_start})
+                return result
+            compile_time = time.perf_counter() - compile_start
+
+            simulator.load_image(words, start_address)
+            simulator.pr = entry_point
+            apply_initial_state(simulator, job)
+            backend = BufferedBackend(job.get('input'))
+            backend.attach(simulator)
+            stats = simulator.run_turbo(max_instructions, time_limit)
+            backend.detach()
+
+            result.update(final_state(simulator, stats, job))
+            result.update(output=backend.records, cached=cached,
+                          timings={'compile': compile_time, 'run': stats['elapsed']})
+            return result
+        except Exception as e:
+            result.update(status='crash', error=f"{type(e).__name__}: {e}")
+            return result
+        finally:
+            simulator.io = None
+            self.pool.release(pair)
+            latency = time.perf_counter() - start
+            result.setdefault('timings', {})['total'] = latency
+            self.metrics.record(result['status'], latency)
+
+    def metrics_report(self):
+        report = self.metrics.report()
+        report['cache'] = {
+            'images': len(self.cache),
+            'hits': self.cache.hits,
+            'misses': self.cache.misses,
+            'hit_rate': self.cache.hits / max(1, self.cache.hits + self.cache.misses),
+        }
+        report['pool'] = {'size': self.pool.size, 'idle': self.pool.idle()}
+        return report
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end for a JobServer (set as the class attribute `job_server`)."""
+    job_server = None
+
+    def _send_json(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send_json(200, self.job_server.metrics_report())
+        elif self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/run':
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = json.loads(self.rfile.read(length))
+            if not isinstance(job, dict) or not isinstance(job.get('source'), str):
+                raise ValueError("The job needs a 'source' string")
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        self._send_json(200, self.job_server.run_job(job))
+
+    def log_message(self, format, *args):
+        # Per-request logging would dominate the cost of small jobs.
+        pass
+
+
+def make_server(host='127.0.0.1', port=DEFAULT_PORT, **options):
+    """Returns a ThreadingHTTPServer (not yet serving) backed by a new JobServer."""
+    handler = type('BoundRequestHandler', (RequestHandler,), {'job_server': JobServer(**options)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve CASL II compile-and-run requests from a warm pool.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--pool', type=int, default=DEFAULT_POOL_SIZE, help="pooled compiler/simulator pairs")
+    parser.add_argument('--cache', type=int, default=DEFAULT_CACHE_SIZE, help="assembled images to keep")
+    parser.add_argument('--max-instructions', type=int, default=DEFAULT_MAX_INSTRUCTIONS)
+    parser.add_argument('--time-limit', type=float, default=DEFAULT_TIME_LIMIT)
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, pool_size=args.pool, cache_size=args.cache,
+                         max_instructions=args.max_instructions, time_limit=args.time_limit)
+    print(f"Serving on http://{args.host}:{server.server_address[1]} (pool {args.pool})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
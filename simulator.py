@@ -1,5 +1,11 @@
 import time
+from array import array
 import instructions
+import isa
+import object_file
+from snapshot import (Snapshot, PAGE_SHIFT, PAGE_SIZE, PAGE_COUNT, ZERO_PAGE, EMPTY_PAGES,
+                      page_words, diff_words)
+from tracer import ExecutionTracer
 
 class COMET2Simulator:
     """
@@ -10,14 +16,33 @@ class COMET2Simulator:
     MEMORY_SIZE = 65536  # 2^16 words of memory
     WORD_MAX = 65535     # Maximum value for a 16-bit unsigned word
     WORD_MIN = -32768    # Minimum value for a 16-bit signed word
+    WORD_MASK = 0xFFFF   # Results wrap around to 16 bits
 
-    def __init__(self, debug=False):
-        """Initializes the virtual machine's state."""
+    # How often (in instructions) the turbo loop checks its wall-clock deadline
+    DEADLINE_CHECK_INTERVAL = 4096
+
+    # The state `reset` returns to
+    POWER_ON = Snapshot(EMPTY_PAGES, bytes(16), 0, 0, 0, 0, 0)
+
+    # Largest number of memory words covered by one fused instruction group
+    MAX_FUSED_WORDS = 2 * max(len(sequence) for sequence, _ in instructions.FUSED_SEQUENCES)
+
+    def __init__(self, debug=False, verbose=True, fusion=True):
+        """
+        Initializes the virtual machine's state.
+        :param debug: Trace execution and print each instruction executed by `run`.
+        :param verbose: Print status messages (loading, halting, errors).
+        :param fusion: Look for instruction sequences to execute as fused
+                       handlers when a program is loaded (used by `run_turbo`).
+        """
         self.debug = debug
-        self.memory = [0] * self.MEMORY_SIZE
+        self.verbose = verbose
+        self.fusion = fusion
+        # Memory and registers are unsigned 16-bit typed buffers (2 bytes per word).
+        self.memory = array('H', bytes(2 * self.MEMORY_SIZE))
         
         # General Purpose Registers (GR0-GR7)
-        self.gr = [0] * 8
+        self.gr = array('H', bytes(2 * 8))
         
         # Special Purpose Registers
         self.pr = 0  # Program Counter
@@ -28,19 +53,69 @@ class COMET2Simulator:
         self.sf = 0  # Sign Flag
         self.zf = 0  # Zero Flag
         
-        # This dictionary maps an opcode to the function that handles it.
-        self.instruction_map = {
-            0x10: instructions.ld_mem,
-            0x11: instructions.st,
-            0x12: instructions.lad,
-            0x14: instructions.ld_reg,
-            0x20: instructions.adda_mem,
-            0x24: instructions.adda_reg,
-            # You can add more opcodes here later
-        }
+        self.is_running = False
+        self.fault = None  # Message of the error that stopped the last run, if any
+        self.io = None     # SVC I/O backend (see svc_io), set by its `attach`
+
+        # Predecoded instruction cache: address -> (handler, args, next_pr, opcode).
+        # `_code_words` maps every memory word covered by a cached instruction
+        # to the address of that instruction, so writes can invalidate it.
+        self._decoded = {}
+        self._code_words = {}
+        # 256-entry (handler, length) list indexed by opcode, shared by all
+        # simulators (see isa.py).
+        self._dispatch = isa.DISPATCH
+        # Fused groups found at load time: first address -> (fused handler,
+        # args, next_pr, number of instructions). Each instruction keeps its
+        # own entry in `_decoded`, so a jump into the middle of a group simply
+        # executes the plain instructions from there.
+        self._fused = {}
+
+        # Copy-on-write snapshot support: pages written since the last
+        # snapshot or restore, and the pages of that snapshot (all zero pages
+        # until the first one). Every other page of memory equals its base page.
+        self._dirty_pages = bytearray(PAGE_COUNT)
+        self._base_pages = EMPTY_PAGES
 
+        # Breakpoints (address -> condition or None) and watched addresses.
+        # Instructions that need checking are decoded into trap entries and
+        # write watchpoints wrap `_store`, so the execution loops are the same
+        # whether or not anything is armed.
+        self._breakpoints = {}
+        self._read_watches = set()
+        self._write_watches = set()
+        self._resume_address = None
+        self._watch_store = None
+        self._fusion_range = None   # (start, end) analyzed at load time
+        self.stop_reason = None     # 'breakpoint', 'watchpoint' or 'svc' after such a stop
+        self.watch_hit = None       # details of the last watchpoint stop
+        self.symbols = {}           # label -> address, for breakpoints by label
+        # Callables notified with the address of an overwritten code word,
+        # or None when the whole cache is cleared (e.g. by a block compiler).
+        self._invalidation_hooks = []
+        # Callables invoked with the address of each instruction after it
+        # executes (tracers, profilers). Empty lists keep the fast loop.
+        self._step_hooks = []
+        self.tracer = None
+        if debug:
+            ExecutionTracer().attach(self)
+        self._log("COMET II Simulator initialized.")
+
+    def _log(self, message):
+        """Prints a status message unless the simulator is quiet."""
+        if self.verbose:
+            print(message)
+
+    def _fault(self, message):
+        """
+        Records an execution error and stops the machine. If a tracer is
+        attached, the instructions leading up to the error are printed.
+        """
+        self.fault = message
+        self._log(f"Error: {message}")
+        if self.tracer is not None and len(self.tracer):
+            self._log("Most recent instructions:\n" + self.tracer.render(last=16))
         self.is_running = False
-        print("COMET II Simulator initialized.")
 
     def _reset_flags(self):
         """Resets all flags to zero."""
@@ -48,16 +123,11 @@ class COMET2Simulator:
         self.sf = 0
         self.zf = 0
 
-    def _update_flags(self, value):
-        """Updates SF and ZF based on a value."""
-        # Check for signed overflow (not fully implemented for all instructions)
-        # self.of = 1 if value > 32767 or value < -32768 else 0
-        
-        # Update Sign Flag
-        self.sf = 1 if value < 0 else 0
-        
-        # Update Zero Flag
-        self.zf = 1 if value == 0 else 0
+    def _update_flags(self, value, overflow=0):
+        """Sets OF to `overflow` and SF and ZF from a 16-bit result word."""
+        self.of = overflow
+        self.sf = value >> 15
+        self.zf = 0 if value else 1
 
     def load_program(self, machine_code, start_address=0):
         """
@@ -65,19 +135,65 @@ class COMET2Simulator:
         :param machine_code: A list of hexadecimal strings.
         :param start_address: The memory address to start loading the code.
         """
-        print(f"\n--- Loading Program into Memory at address {start_address} ---")
-        for i, code in enumerate(machine_code):
-            address = start_address + i
-            if address < self.MEMORY_SIZE:
-                # Convert hex string to integer and store it
-                self.memory[address] = int(code, 16)
-            else:
-                print(f"Error: Memory address {address} out of bounds.")
-                return False
-        
+        self._log(f"\n--- Loading Program into Memory at address {start_address} ---")
+        end_address = start_address + len(machine_code)
+        if end_address > self.MEMORY_SIZE:
+            self._log(f"Error: Memory address {self.MEMORY_SIZE} out of bounds.")
+            return False
+        # Convert hex strings to integers and store them in one slice assignment
+        self.memory[start_address:end_address] = array('H', [int(code, 16) for code in machine_code])
+        self.mark_dirty(start_address, end_address)
+        self._clear_decoded()
+        self._fusion_range = (start_address, end_address)
+        self._analyze_fusion(start_address, end_address)
+
         # Set the Program Counter to the start of the program
         self.pr = start_address
-        print(f"Program loaded successfully. PC set to {self.pr}.")
+        self._log(f"Program loaded successfully. PC set to {self.pr}.")
+        return True
+
+    def load_image(self, image, start_address=0):
+        """
+        Loads a binary memory image with a single slice assignment.
+        :param image: A bytes-like object (bytes, bytearray, memoryview or
+                      array('H')) holding 16-bit words in native byte order.
+        :param start_address: The memory address to start loading the image.
+        """
+        self._log(f"\n--- Loading Image into Memory at address {start_address} ---")
+        with memoryview(image) as view:
+            if view.format != 'H':
+                if view.nbytes % 2:
+                    self._log("Error: Image size is not a whole number of words.")
+                    return False
+                view = view.cast('B').cast('H')
+            end_address = start_address + len(view)
+            if end_address > self.MEMORY_SIZE:
+                self._log(f"Error: Memory address {self.MEMORY_SIZE} out of bounds.")
+                return False
+            with memoryview(self.memory) as target:
+                target[start_address:end_address] = view
+        self.mark_dirty(start_address, end_address)
+        self._clear_decoded()
+        self._fusion_range = (start_address, end_address)
+        self._analyze_fusion(start_address, end_address)
+
+        self.pr = start_address
+        self._log(f"Image of {end_address - start_address} words loaded. PC set to {self.pr}.")
+        return True
+
+    def load_object(self, path):
+        """
+        Memory-maps a binary object file written by `Compiler.write_object`
+        and copies its image into memory without per-word conversion.
+        The Program Counter is set to the object's entry point.
+        :param path: Path of the object file.
+        """
+        with object_file.read_object(path) as image:
+            if not self.load_image(image.words, image.load_address):
+                return False
+            self.pr = image.entry_point
+            self.symbols = dict(image.symbols)
+        self._log(f"Entry point set to {self.pr}.")
         return True
 
     def _fetch(self):
@@ -86,69 +202,625 @@ class COMET2Simulator:
         self.pr += 1
         return instruction_word
 
+    def _store(self, address, value):
+        """
+        Writes a word to memory. Every instruction that modifies memory must go
+        through here so that cached decodings of the word are invalidated.
+        """
+        self.memory[address] = value
+        self._dirty_pages[address >> PAGE_SHIFT] = 1
+        if address in self._code_words:
+            self._invalidate_decoded(address)
+
+    def store_words(self, address, words):
+        """
+        Writes consecutive words starting at `address`, with the same effect
+        as a `_store` of each. Used for SVC input records.
+        :param words: An array('H') or list of words.
+        """
+        end = address + len(words)
+        if '_store' in self.__dict__ or end > self.MEMORY_SIZE:
+            # `_store` is wrapped (watchpoints, reverse debugging) or the
+            # record wraps around the address space: store word by word.
+            for offset, value in enumerate(words):
+                self._store((address + offset) & self.WORD_MASK, value)
+            return
+        self.memory[address:end] = array('H', words)
+        self.mark_dirty(address, end)
+        code_words = self._code_words
+        for word_address in range(address, end):
+            if word_address in code_words:
+                self._invalidate_decoded(word_address)
+
+    def mark_dirty(self, start, end):
+        """
+        Records that memory[start:end] was written. Loaders and `_store` do
+        this themselves; call it after writing to `memory` directly, so that
+        snapshots, `diff` and `dump_state` see the change.
+        """
+        if end > start:
+            first, last = start >> PAGE_SHIFT, (end - 1) >> PAGE_SHIFT
+            self._dirty_pages[first:last + 1] = b'\x01' * (last - first + 1)
+
+    def _invalidate_decoded(self, address):
+        """Drops the cached decoding of the instruction covering `address`."""
+        start = self._code_words.pop(address)
+        _, _, next_pr, _ = self._decoded.pop(start)
+        for word_address in range(start, next_pr):
+            self._code_words.pop(word_address, None)
+        if self._fused:
+            # Drop every fused group that covers the overwritten word.
+            for group_start in range(max(0, address - self.MAX_FUSED_WORDS + 1), address + 1):
+                group = self._fused.get(group_start)
+                if group is not None and group[2] > address:
+                    del self._fused[group_start]
+        for hook in self._invalidation_hooks:
+            hook(address)
+
+    def _clear_decoded(self):
+        """Empties the predecoded instruction cache."""
+        self._decoded.clear()
+        self._code_words.clear()
+        self._fused.clear()
+        for hook in self._invalidation_hooks:
+            hook(None)
+
+    def _decode_at(self, address):
+        """
+        Decodes the instruction at `address` and caches the result.
+
+        :return: A (handler, args, next_pr, opcode) tuple, or None if the
+                 instruction does not fit in memory.
+        """
+        if address >= self.MEMORY_SIZE:
+            return None
+
+        instruction_word = self.memory[address]
+        opcode = instruction_word >> 8
+        if instruction_word == 0:
+            entry = (instructions.halt, (0, 0), address + 1, opcode)
+        elif instruction_word & 0x88:
+            # The r or x field names a register above GR7.
+            entry = (instructions.unknown, (0, 0), address + 1, opcode)
+        else:
+            exec_func, length = self._dispatch[opcode]
+            r1 = (instruction_word >> 4) & 0xF
+            r2_or_x = instruction_word & 0xF
+            if length == 2:
+                if address + 1 >= self.MEMORY_SIZE:
+                    return None
+                args = (r1, r2_or_x, self.memory[address + 1])
+            else:
+                args = (r1, r2_or_x)
+            entry = (exec_func, args, address + length, opcode)
+
+        if self._breakpoints or self._read_watches:
+            entry = self._trap_entry(address, entry)
+
+        self._decoded[address] = entry
+        for word_address in range(address, entry[2]):
+            self._code_words[word_address] = address
+        return entry
+
+    # --- Snapshots ---
+
+    def _changed_pages(self, pages):
+        """Yields the numbers of pages of memory that may differ from `pages`."""
+        dirty = self._dirty_pages
+        base = self._base_pages
+        for page in range(PAGE_COUNT):
+            if dirty[page] or base[page] is not pages[page]:
+                yield page
+
+    def snapshot(self):
+        """
+        Captures the machine state. Only pages written since the previous
+        snapshot or restore are copied; the rest are shared with it.
+        :return: A Snapshot.
+        """
+        pages = list(self._base_pages)
+        memory = self.memory
+        for page, dirty in enumerate(self._dirty_pages):
+            if dirty:
+                start = page << PAGE_SHIFT
+                words = memory[start:start + PAGE_SIZE].tobytes()
+                if words != pages[page]:
+                    pages[page] = ZERO_PAGE if words == ZERO_PAGE else words
+        pages = tuple(pages)
+        self._base_pages = pages
+        self._dirty_pages[:] = bytes(PAGE_COUNT)
+        return Snapshot(pages, self.gr, self.pr, self.sp, self.of, self.sf, self.zf, self.fault)
+
+    def restore(self, snapshot):
+        """
+        Returns the machine to a snapshot. Only pages that differ from it are
+        rewritten, and cached decodings on those pages are invalidated.
+        """
+        with memoryview(self.memory) as target:
+            for page in self._changed_pages(snapshot.pages):
+                words = snapshot.pages[page]
+                start = page << PAGE_SHIFT
+                if not self._dirty_pages[page] and self._base_pages[page] == words:
+                    continue
+                target[start:start + PAGE_SIZE] = memoryview(words).cast('H')
+                if self._code_words:
+                    for address in range(start, start + PAGE_SIZE):
+                        if address in self._code_words:
+                            self._invalidate_decoded(address)
+        self._base_pages = snapshot.pages
+        self._dirty_pages[:] = bytes(PAGE_COUNT)
+
+        self.gr[:] = page_words(snapshot.gr)
+        self.pr = snapshot.pr
+        self.sp = snapshot.sp
+        self.of = snapshot.of
+        self.sf = snapshot.sf
+        self.zf = snapshot.zf
+        self.fault = snapshot.fault
+        self.is_running = False
+
+    def reset(self):
+        """
+        Returns the machine to its power-on state (zeroed memory, registers
+        and flags) so that it can run another program. Only pages that were
+        written are cleared. Breakpoints, watchpoints and cached decodings
+        are dropped; step hooks and the I/O backend stay attached.
+        """
+        self._breakpoints.clear()
+        self._read_watches.clear()
+        self._write_watches.clear()
+        self._fusion_range = None
+        self._refresh_traps()
+        self.restore(self.POWER_ON)
+        self.stop_reason = None
+        self.watch_hit = None
+        self._resume_address = None
+        self.symbols = {}
+
+    def fork(self, snapshot=None):
+        """
+        Creates an independent simulator in the state of `snapshot`, or of
+        this simulator now. The child keeps `symbols` and the load-time
+        fusion range. A fork of the current state also starts with a copy of
+        the predecoded and fused instruction caches, with the trap entries
+        of breakpoints and watchpoints unwrapped.
+        :return: A new COMET2Simulator (without tracer, step hooks,
+                 breakpoints or watchpoints).
+        """
+        warm = snapshot is None
+        if snapshot is None:
+            snapshot = self.snapshot()
+        child = COMET2Simulator(verbose=self.verbose, fusion=self.fusion)
+        child.restore(snapshot)
+        child.symbols = dict(self.symbols)
+        child._fusion_range = self._fusion_range
+        armed = self._breakpoints or self._read_watches or self._write_watches
+        if warm:
+            traps = (instructions.breakpoint_trap, instructions.watch_trap)
+            for address, (exec_func, args, next_pr, opcode) in self._decoded.items():
+                while exec_func in traps:
+                    _, exec_func, args = args
+                child._decoded[address] = (exec_func, args, next_pr, opcode)
+            child._code_words = dict(self._code_words)
+            child._fused = dict(self._fused)
+        if child._fusion_range is not None and (armed or not warm):
+            # Groups left out for the parent's traps, or a cold cache.
+            child._analyze_fusion(*child._fusion_range)
+        return child
+
+    def diff(self, snapshot):
+        """
+        Compares `snapshot` (old) with the current state (new), reading only
+        the pages that were written or differ from it.
+        :return: A list of (location, old, new) tuples, as `Snapshot.diff`.
+        """
+        current = Snapshot(None, self.gr, self.pr, self.sp, self.of, self.sf, self.zf)
+        changes = [(name, old, new) for (name, old), (_, new)
+                   in zip(snapshot.scalar_state(), current.scalar_state()) if old != new]
+        for page in self._changed_pages(snapshot.pages):
+            start = page << PAGE_SHIFT
+            changes.extend(diff_words(page, page_words(snapshot.pages[page]),
+                                      self.memory[start:start + PAGE_SIZE]))
+        return changes
+
+    def _analyze_fusion(self, start, end):
+        """
+        Load-time analysis: decodes memory[start:end] in a linear sweep and,
+        at every instruction start, caches a fused entry for the longest
+        sequence in `instructions.FUSED_SEQUENCES` that begins there.
+        Groups may overlap, so a jump into the middle of one still finds
+        any group that starts at its target.
+        """
+        if not self.fusion:
+            return
+        decoded = self._decoded
+        decode = self._decode_at
+        address = start
+        while address < end:
+            entry = decoded.get(address) or decode(address)
+            if entry is None:
+                break
+            for sequence, fused_func in instructions.FUSED_SEQUENCES:
+                parts = []
+                next_pr = address
+                for handler in sequence:
+                    part = (decoded.get(next_pr) or decode(next_pr)) if next_pr < end else None
+                    if part is None or part[0] is not handler:
+                        break
+                    parts.append((next_pr, handler, part[1]))
+                    next_pr = part[2]
+                else:
+                    if self._group_needs_checks(parts):
+                        continue
+                    args = tuple(arg for _, _, part_args in parts for arg in part_args)
+                    self._fused[address] = (fused_func, args, next_pr, len(sequence))
+                    break
+            address = entry[2]
+
+    # --- Breakpoints and watchpoints ---
+
+    def _resolve_location(self, location):
+        """Returns the address of a label from `symbols`, or of a numeric address."""
+        if isinstance(location, str):
+            if location not in self.symbols:
+                raise ValueError(f"Unknown label '{location}'")
+            return self.symbols[location]
+        return location & self.WORD_MASK
+
+    def set_breakpoint(self, location, condition=None):
+        """
+        Stops execution before the instruction at `location` (an address, or
+        a label from `symbols`). If `condition` is given, it is called with
+        the simulator and the breakpoint only fires when it returns true.
+        Running again from a breakpoint executes its instruction first.
+        """
+        self._breakpoints[self._resolve_location(location)] = condition
+        self._refresh_traps()
+
+    def clear_breakpoint(self, location):
+        """Removes the breakpoint at `location`, if any."""
+        self._breakpoints.pop(self._resolve_location(location), None)
+        self._refresh_traps()
+
+    def set_watchpoint(self, location, read=False, write=True):
+        """
+        Stops execution after an instruction reads and/or writes the memory
+        word at `location` (an address or a label). The access is described
+        in `watch_hit`.
+        """
+        address = self._resolve_location(location)
+        if read:
+            self._read_watches.add(address)
+        if write:
+            self._write_watches.add(address)
+        self._refresh_traps()
+
+    def clear_watchpoint(self, location):
+        """Stops watching the memory word at `location`."""
+        address = self._resolve_location(location)
+        self._read_watches.discard(address)
+        self._write_watches.discard(address)
+        self._refresh_traps()
+
+    def _trap_entry(self, address, entry):
+        """Wraps a decoded entry in the trap handlers it needs, if any."""
+        exec_func, args, next_pr, opcode = entry
+        if self._read_watches and exec_func in instructions.READS_MEMORY \
+                and (args[1] != 0 or args[2] in self._read_watches):
+            exec_func, args = instructions.watch_trap, (address, exec_func, args)
+        if address in self._breakpoints:
+            exec_func, args = instructions.breakpoint_trap, (address, exec_func, args)
+        return (exec_func, args, next_pr, opcode)
+
+    def _group_needs_checks(self, parts):
+        """
+        True if an instruction of a fused group has a breakpoint or may touch
+        a watched word.
+        :param parts: (address, handler, args) of each instruction in the group.
+        """
+        if not (self._breakpoints or self._read_watches or self._write_watches):
+            return False
+        for address, handler, args in parts:
+            if address in self._breakpoints:
+                return True
+            if handler in instructions.READS_MEMORY and self._read_watches \
+                    and (args[1] != 0 or args[2] in self._read_watches):
+                return True
+            if handler in instructions.WRITES_MEMORY and self._write_watches \
+                    and (args[1] != 0 or args[2] in self._write_watches):
+                return True
+        return False
+
+    def _refresh_traps(self):
+        """
+        Re-decodes the program after breakpoints or watchpoints change, and
+        installs or removes the `_store` wrapper for write watchpoints.
+        """
+        self._clear_decoded()
+        if self._fusion_range is not None:
+            self._analyze_fusion(*self._fusion_range)
+
+        if self._write_watches and self._watch_store is None:
+            had_own_store = '_store' in self.__dict__
+            inner = self._store
+            memory = self.memory
+            watches = self._write_watches
+
+            def store(address, value):
+                old = memory[address]
+                inner(address, value)
+                if address in watches:
+                    self.watch_hit = {'access': 'write', 'address': address, 'old': old, 'new': value}
+                    self.stop_reason = 'watchpoint'
+                    self.is_running = False
+
+            self._store = store
+            self._watch_store = (store, inner, had_own_store)
+        elif not self._write_watches and self._watch_store is not None:
+            store, inner, had_own_store = self._watch_store
+            # Unwrap only if nothing has wrapped `_store` since; otherwise the
+            # wrapper stays in the chain, doing nothing.
+            if self.__dict__.get('_store') is store:
+                if had_own_store:
+                    self._store = inner
+                else:
+                    del self._store
+            self._watch_store = None
+
+    def _begin_run(self):
+        """Resets the stop state at the start of a run."""
+        # Running again from a breakpoint executes its instruction first.
+        self._resume_address = self.pr if self.stop_reason == 'breakpoint' else None
+        self.stop_reason = None
+        self.watch_hit = None
+        self.fault = None
+        self.is_running = True
+
+    def _stop_result(self, executed):
+        """
+        Returns (instructions executed, status) for a run loop that saw the
+        machine stop while dispatching the instruction after `executed`
+        others. A breakpoint stops before its instruction executes.
+        """
+        if self.stop_reason == 'breakpoint':
+            return executed, 'breakpoint'
+        if self.stop_reason is not None:
+            # 'watchpoint', or 'svc' from an I/O backend that services calls
+            # outside the run loop.
+            return executed + 1, self.stop_reason
+        return executed + 1, 'error' if self.fault is not None else 'halted'
+
+    def _step(self):
+        """
+        Executes a single instruction through the predecoded cache.
+
+        :return: The handler that was executed, or None if the Program Counter
+                 was out of bounds.
+        """
+        entry = self._decoded.get(self.pr)
+        if entry is None:
+            entry = self._decode_at(self.pr)
+            if entry is None:
+                self._fault("Program Counter out of bounds.")
+                return None
+        exec_func, args, next_pr, _ = entry
+        self.pr = next_pr
+        exec_func(self, *args)
+        return exec_func
+
     def _get_effective_address(self, r, x, addr):
         """Calculates the effective address from the instruction."""
         # For now, we only handle direct addressing (x=0)
         if x == 0:
             return addr
-        # If an index register is used, add its content to the address
+        # If an index register is used, add its content to the address (mod 2^16)
         else:
-            return addr + self.gr[x]
+            return (addr + self.gr[x]) & self.WORD_MASK
 
     # THIS IS THE NEW CODE TO USE
     def run(self):
-        """Starts the execution cycle using the dispatch table."""
-        self.is_running = True
-        print("\n--- Starting Simulation ---")
+        """
+        Starts the paced execution cycle (one instruction every 0.1 s).
+        In debug mode each executed instruction is rendered from the tracer.
+        """
+        self._begin_run()
+        self._log("\n--- Starting Simulation ---")
         
         while self.is_running:
-            if self.pr >= self.MEMORY_SIZE:
-                print("Error: Program Counter out of bounds.")
+            start_pr = self.pr
+            if self._step() is None:
+                break
+            if self.stop_reason == 'breakpoint':
+                self._log(f"Breakpoint at {self.pr:04X}.")
                 break
+            for hook in self._step_hooks:
+                hook(start_pr)
 
-            start_pr = self.pr
-            instruction_word = self._fetch()
-
-            # Handle HALT as a special case before decoding
-            if instruction_word == 0:
-                instructions.halt(self, 0, 0)
-                continue # Skips the rest of the loop and re-checks self.is_running
-
-            # Decode the instruction
-            full_opcode = (instruction_word >> 8) & 0xFF
-            r1 = (instruction_word >> 8) & 0xF
-            r2_or_x = (instruction_word >> 4) & 0xF
-            
-            if self.debug:
-                print(f"\nPC: {start_pr:04X} | Instruction: {instruction_word:04X} | Opcode: {full_opcode:02X}")
-
-            # --- New Execution Logic ---
-            # 1. Look up the function in our map. If not found, use the 'unknown' function.
-            exec_func = self.instruction_map.get(full_opcode, instructions.unknown)
-            
-            # 2. Call the function we found.
-            # This single line replaces the entire if/elif/else block.
-            # We pass 'self' so the function can access memory/registers.
-            # We pass the operands for the function to use.
-            # (A more advanced version would decode operands differently based on format,
-            # but this works for now).
-            if full_opcode in [0x14, 0x24]: # Register-to-register format
-                r2 = r2_or_x
-                exec_func(self, r1, r2)
-            elif full_opcode in [0x10, 0x11, 0x12, 0x20]: # Memory format
-                r = r1
-                # For ST and LAD, the compiler encodes the register with an offset of 8
-                if full_opcode in [0x11, 0x12]: 
-                    r = r1 - 8
-                x = r2_or_x
-                exec_func(self, r, x)
-            else: # Unknown instruction
-                instructions.unknown(self, r1, r2_or_x)
+            if self.debug and self.tracer is not None:
+                print(self.tracer.render(last=1))
 
             time.sleep(0.1)
 
+        if self.io is not None:
+            self.io.flush()
         self.dump_state()
 
+    def _execute_fast(self, count):
+        """
+        Executes up to `count` instructions through the predecoded cache.
+        :return: (instructions executed, status) where status is None if the
+                 machine is still running.
+        """
+        decoded = self._decoded
+        decode = self._decode_at
+        for executed in range(count):
+            entry = decoded.get(self.pr)
+            if entry is None:
+                entry = decode(self.pr)
+                if entry is None:
+                    self._fault("Program Counter out of bounds.")
+                    return executed, 'error'
+            exec_func, args, self.pr, _ = entry
+            exec_func(self, *args)
+            if not self.is_running:
+                return self._stop_result(executed)
+        return count, None
+
+    def _execute_fused(self, count):
+        """
+        Same as `_execute_fast`, but executes fused groups in one dispatch.
+        A group is only used when it fits in the remaining `count`, so
+        instruction budgets stay exact.
+        """
+        decoded = self._decoded
+        fused = self._fused
+        decode = self._decode_at
+        executed = 0
+        while executed < count:
+            entry = fused.get(self.pr)
+            if entry is not None and executed + entry[3] <= count:
+                # Fused handlers never stop the machine.
+                exec_func, args, self.pr, steps = entry
+                exec_func(self, *args)
+                executed += steps
+                continue
+            entry = decoded.get(self.pr)
+            if entry is None:
+                entry = decode(self.pr)
+                if entry is None:
+                    self._fault("Program Counter out of bounds.")
+                    return executed, 'error'
+            exec_func, args, self.pr, _ = entry
+            exec_func(self, *args)
+            if not self.is_running:
+                return self._stop_result(executed)
+            executed += 1
+        return executed, None
+
+    def _execute_instrumented(self, count):
+        """Same as `_execute_fast`, but calls the step hooks after every instruction."""
+        decoded = self._decoded
+        decode = self._decode_at
+        hooks = self._step_hooks
+        for executed in range(count):
+            pc = self.pr
+            entry = decoded.get(pc)
+            if entry is None:
+                entry = decode(pc)
+                if entry is None:
+                    self._fault("Program Counter out of bounds.")
+                    return executed, 'error'
+            exec_func, args, self.pr, _ = entry
+            exec_func(self, *args)
+            if not self.is_running and self.stop_reason == 'breakpoint':
+                # Nothing was executed, so the hooks are not called.
+                return executed, 'breakpoint'
+            for hook in hooks:
+                hook(pc)
+            if not self.is_running:
+                return self._stop_result(executed)
+        return count, None
+
+    def _select_loop(self):
+        """Returns the execution loop for the attached hooks and fused groups."""
+        if self._step_hooks:
+            return self._execute_instrumented
+        if self._fused:
+            return self._execute_fused
+        return self._execute_fast
+
+    def step(self, count=1):
+        """
+        Executes up to `count` instructions and returns control, so that a
+        caller can interleave bounded slices of many simulations.
+
+        :return: (instructions executed, status), where status is None if
+                 the program can continue and otherwise one of the final
+                 statuses of `run_turbo` ('halted', 'error', 'breakpoint',
+                 'watchpoint' or 'svc').
+        """
+        self._begin_run()
+        executed, status = self._select_loop()(count)
+        self.is_running = False
+        if self.io is not None:
+            self.io.flush()
+        return executed, status
+
+    def run_slices(self, slice_instructions=DEADLINE_CHECK_INTERVAL, max_instructions=None):
+        """
+        Generator that executes the program `slice_instructions` at a time.
+
+        Yields (total instructions executed, status) after every slice, with
+        status None while the program can continue. The last item carries
+        the final status, or 'budget' once `max_instructions` have run.
+        """
+        executed = 0
+        while True:
+            count = slice_instructions
+            if max_instructions is not None:
+                count = min(count, max_instructions - executed)
+                if count <= 0:
+                    yield executed, 'budget'
+                    return
+            done, status = self.step(count)
+            executed += done
+            yield executed, status
+            if status is not None:
+                return
+
+    def run_turbo(self, max_instructions=None, time_limit=None):
+        """
+        Executes the program at full speed, without the pacing delay of `run`.
+
+        Execution stops on HALT, on an error, at a breakpoint or watchpoint,
+        after `max_instructions` instructions, or once `time_limit` seconds of
+        wall-clock time have elapsed, so runaway programs always terminate
+        deterministically.
+        When step hooks (such as a tracer) are attached, an instrumented loop
+        is used; otherwise the loop does no per-instruction bookkeeping and
+        runs the fused groups found when the program was loaded.
+
+        :param max_instructions: Maximum number of instructions to execute (None for no limit).
+        :param time_limit: Wall-clock limit in seconds (None for no limit).
+        :return: A dict with 'status' ('halted', 'error', 'breakpoint',
+                 'watchpoint', 'svc', 'budget' or 'deadline'),
+                 'instructions', 'elapsed' (seconds) and 'mips'.
+                 Buffered SVC output is flushed before returning.
+        """
+        execute = self._select_loop()
+        check_interval = self.DEADLINE_CHECK_INTERVAL
+
+        self._begin_run()
+        status = None
+        executed = 0
+        start_time = time.perf_counter()
+        deadline = None if time_limit is None else start_time + time_limit
+
+        while status is None:
+            chunk = check_interval
+            if max_instructions is not None:
+                chunk = min(chunk, max_instructions - executed)
+                if chunk <= 0:
+                    status = 'budget'
+                    break
+            if deadline is not None and time.perf_counter() >= deadline:
+                status = 'deadline'
+                break
+            count, status = execute(chunk)
+            executed += count
+
+        if status in ('budget', 'deadline'):
+            self.is_running = False
+        if self.io is not None:
+            self.io.flush()
+        elapsed = time.perf_counter() - start_time
+        return {
+            'status': status,
+            'instructions': executed,
+            'elapsed': elapsed,
+            'mips': executed / elapsed / 1e6 if elapsed > 0 else 0.0,
+        }
+
     def dump_state(self):
         """Prints the final state of the registers and relevant memory."""
         print("\n--- Final Machine State ---")
@@ -159,9 +831,12 @@ class COMET2Simulator:
         print(f"FR: OF={self.of} SF={self.sf} ZF={self.zf}")
         print("-" * 20)
         print("Memory Contents (non-zero):")
-        for i, val in enumerate(self.memory):
-            if val != 0:
-                print(f"  mem[{i:04X}]: {val:<6} ({val:04X})")
+        # Memory starts zeroed, so only written pages can hold non-zero words.
+        for page in self._changed_pages(EMPTY_PAGES):
+            start = page << PAGE_SHIFT
+            for i, val in enumerate(self.memory[start:start + PAGE_SIZE], start):
+                if val != 0:
+                    print(f"  mem[{i:04X}]: {val:<6} ({val:04X})")
 
 
 if __name__ == '__main__':
@@ -189,3 +864,29 @@ if __name__ == '__main__':
     if simulator.load_program(generated_machine_code):
         # 4. Run the simulation.
         simulator.run()
+
+    # 5. The same program in turbo mode, without the per-instruction delay.
+    turbo_simulator = COMET2Simulator()
+    if turbo_simulator.load_program(generated_machine_code):
+        stats = turbo_simulator.run_turbo(max_instructions=1_000_000, time_limit=5.0)
+        print(f"Turbo run: {stats['status']}, {stats['instructions']} instructions, "
+              f"{stats['mips']:.3f} MIPS")
+        turbo_simulator.dump_state()
+
+        # 6. Snapshot the finished machine, fork a variant and compare them.
+        checkpoint = turbo_simulator.snapshot()
+        variant = turbo_simulator.fork()
+        variant._store(0x0100, 1234)
+        print(f"Fork differs from the snapshot at: {variant.diff(checkpoint)}")
+
+        # 7. Stop before the instruction at 0003, then continue from it.
+        debug_simulator = COMET2Simulator(verbose=False)
+        debug_simulator.load_program(generated_machine_code)
+        debug_simulator.set_breakpoint(0x0003)
+        stats = debug_simulator.run_turbo(max_instructions=1000)
+        print(f"Stopped: {stats['status']} at PR={debug_simulator.pr:04X}")
+        # A fork has no breakpoints, so it runs straight through.
+        stats = debug_simulator.fork().run_turbo(max_instructions=1000)
+        print(f"Fork of the stopped machine: {stats['status']}")
+        stats = debug_simulator.run_turbo(max_instructions=1000)
+        print(f"Continued: {stats['status']}")
@@ -0,0 +1,84 @@
+"""
+Immutable snapshots of COMET II machine state.
+
+Memory is captured as a tuple of 256-word pages (bytes objects holding
+native-order words). A simulator tracks which pages were written since its
+last snapshot or restore, and a new snapshot copies only those pages; every
+other page is shared, by reference, with the previous snapshot. Snapshots taken from one run therefore cost
+memory in proportion to what changed between them, and comparing two of them
+only has to look at pages that are not the same object.
+"""
+
+import sys
+from array import array
+
+PAGE_SHIFT = 8
+PAGE_SIZE = 1 << PAGE_SHIFT   # words per page
+PAGE_COUNT = 65536 >> PAGE_SHIFT
+ZERO_PAGE = bytes(2 * PAGE_SIZE)
+EMPTY_PAGES = (ZERO_PAGE,) * PAGE_COUNT
+
+REGISTER_NAMES = [f"GR{i}" for i in range(8)]
+
+
+def page_words(page):
+    """Returns the words of a page as an array('H')."""
+    words = array('H')
+    words.frombytes(page)
+    return words
+
+
+def diff_words(page, old_words, new_words):
+    """Yields (address, old, new) for the words of `page` that differ."""
+    base = page << PAGE_SHIFT
+    for offset, (old, new) in enumerate(zip(old_words, new_words)):
+        if old != new:
+            yield base + offset, old, new
+
+
+class Snapshot:
+    """
+    The registers, flags, Program Counter, Stack Pointer and memory of a
+    simulator at one point in time. Create with `COMET2Simulator.snapshot()`.
+    """
+    def __init__(self, pages, gr, pr, sp, of, sf, zf, fault=None):
+        self.pages = pages          # tuple of PAGE_COUNT bytes objects
+        self.gr = bytes(gr)         # GR0-GR7 as native 16-bit words
+        self.pr = pr
+        self.sp = sp
+        self.of = of
+        self.sf = sf
+        self.zf = zf
+        self.fault = fault
+
+    def registers(self):
+        """Returns GR0-GR7 as a list of ints."""
+        return page_words(self.gr).tolist()
+
+    def word(self, address):
+        """Returns the memory word at `address`."""
+        page = self.pages[address >> PAGE_SHIFT]
+        offset = 2 * (address & (PAGE_SIZE - 1))
+        return int.from_bytes(page[offset:offset + 2], sys.byteorder)
+
+    def scalar_state(self):
+        """Returns [(name, value)] for the registers, PR, SP and flags."""
+        state = list(zip(REGISTER_NAMES, self.registers()))
+        state += [('PR', self.pr), ('SP', self.sp), ('OF', self.of), ('SF', self.sf), ('ZF', self.zf)]
+        return state
+
+    def diff(self, other):
+        """
+        Compares this snapshot (old) with `other` (new).
+
+        Returns:
+            A list of (location, old, new) tuples, where location is a
+            register or flag name ('GR0'-'GR7', 'PR', 'SP', 'OF', 'SF', 'ZF')
+            or a memory address. Only pages that are not shared are compared.
+        """
+        changes = [(name, old, new) for (name, old), (_, new)
+                   in zip(self.scalar_state(), other.scalar_state()) if old != new]
+        for page, (old_page, new_page) in enumerate(zip(self.pages, other.pages)):
+            if old_page is not new_page and old_page != new_page:
+                changes.extend(diff_words(page, page_words(old_page), page_words(new_page)))
+        return changes
@@ -0,0 +1,273 @@
+"""
+I/O backends for the SVC instruction, which the IN and OUT macros use.
+
+The macros expand to
+
+    PUSH 0,GR1 / PUSH 0,GR2 / LAD GR1,buf / LAD GR2,len / SVC n / POP GR2 / POP GR1
+
+with n = 1 for IN and 2 for OUT, so a backend finds the record buffer
+address in GR1 and the address of its length word in GR2. IN reads one
+record (line) of at most MAX_RECORD characters into buf, one character per
+word, and stores its length in len, or -1 (FFFF) at the end of input. OUT
+writes the len characters at buf as one record.
+
+Both backends move whole records: input is taken a line at a time and
+stored with a single slice assignment, and output is collected as strings.
+
+    BufferedBackend   synchronous; services each SVC as it executes and
+                      writes output to its stream in batches.
+    AsyncBackend      for asyncio; the simulator stops at each SVC and the
+                      backend's `run` coroutine awaits the I/O, so many
+                      simulators can share one event loop.
+"""
+
+import abc
+import asyncio
+import time
+from array import array
+
+SVC_IN = 1
+SVC_OUT = 2
+
+MAX_RECORD = 256        # characters per record
+EOF_LENGTH = 0xFFFF     # -1, the length IN stores at the end of input
+
+
+class SVCBackend(abc.ABC):
+    """
+    Record handling shared by the backends. Subclasses decide how an SVC
+    is serviced (`svc`) and where records come from and go to.
+    """
+
+    def __init__(self):
+        self.simulator = None
+        self.records = []   # output records, when there is no output stream
+
+    def attach(self, simulator):
+        """Services the simulator's SVC instructions from now on."""
+        self.simulator = simulator
+        simulator.io = self
+
+    def detach(self):
+        """Stops servicing SVC instructions; SVC faults again."""
+        self.flush()
+        self.simulator.io = None
+        self.simulator = None
+
+    @abc.abstractmethod
+    def svc(self, simulator, number):
+        """Called by the SVC handler with the service number."""
+
+    def flush(self):
+        """Writes out any buffered output. The simulator calls this when a run ends."""
+
+    # --- Records ---
+
+    def store_record(self, simulator, record):
+        """Stores an input record (or None at the end of input) as IN does."""
+        length_address = simulator.gr[2]
+        if record is None:
+            simulator._store(length_address, EOF_LENGTH)
+            return
+        data = record.encode('latin-1', 'replace')[:MAX_RECORD]
+        words = array('H')
+        words.extend(data)
+        simulator.store_words(simulator.gr[1], words)
+        simulator._store(length_address, len(words))
+
+    def load_record(self, simulator):
+        """Returns the record that OUT writes, as a string."""
+        buffer, length = simulator.gr[1], min(simulator.memory[simulator.gr[2]], MAX_RECORD)
+        memory = simulator.memory
+        words = memory[buffer:buffer + length]
+        if len(words) < length:
+            # The buffer wraps around the end of memory.
+            words += memory[:length - len(words)]
+        return bytes(word & 0xFF for word in words).decode('latin-1')
+
+    @abc.abstractmethod
+    def next_record(self):
+        """Returns the next input line without its line ending, or None at the end."""
+
+    @abc.abstractmethod
+    def write_record(self, record):
+        """Outputs one record."""
+
+
+class BufferedBackend(SVCBackend):
+    """Services SVC synchronously from an input source and to an output stream."""
+
+    def __init__(self, input=None, output=None, batch_records=256):
+        """
+        :param input: The input as a string, or any iterable of lines (such as
+                      an open text file). None for no input.
+        :param output: A text stream to write records to, one per line. If
+                       None, records are only kept in `records`.
+        :param batch_records: Output records collected before a write.
+        """
+        super().__init__()
+        if isinstance(input, str):
+            input = input.splitlines()
+        self._input = iter(input if input is not None else ())
+        self.output = output
+        self.batch_records = batch_records
+        self._pending = []
+
+    def svc(self, simulator, number):
+        if number == SVC_IN:
+            self.store_record(simulator, self.next_record())
+        elif number == SVC_OUT:
+            self.write_record(self.load_record(simulator))
+        else:
+            simulator._fault(f"Unsupported SVC {number}")
+
+    def next_record(self):
+        line = next(self._input, None)
+        return None if line is None else line.rstrip('\r\n')
+
+    def write_record(self, record):
+        self.records.append(record)
+        if self.output is not None:
+            self._pending.append(record)
+            if len(self._pending) >= self.batch_records:
+                self.flush()
+
+    def flush(self):
+        if self._pending:
+            self.output.write('\n'.join(self._pending) + '\n')
+            self._pending = []
+
+
+class AsyncBackend(SVCBackend):
+    """
+    Services SVC with asyncio streams. Drive the simulator with `run`
+    instead of `run_turbo`.
+    """
+    SLICE_INSTRUCTIONS = 4096   # instructions run between yields to the event loop
+
+    def __init__(self, reader=None, writer=None):
+        """
+        :param reader: An asyncio.StreamReader (or any object with a
+                       `readline` coroutine returning bytes or str). None for
+                       no input.
+        :param writer: An asyncio.StreamWriter (or any object with `write`
+                       and a `drain` coroutine). If None, records are only
+                       kept in `records`.
+        """
+        super().__init__()
+        self.reader = reader
+        self.writer = writer
+        self._pending = None   # service number of the SVC being waited on
+
+    def svc(self, simulator, number):
+        # Stop the run loop; `run` services the call and resumes.
+        self._pending = number
+        simulator.stop_reason = 'svc'
+        simulator.is_running = False
+
+    async def next_record(self):
+        if self.reader is None:
+            return None
+        line = await self.reader.readline()
+        if not line:
+            return None
+        if isinstance(line, bytes):
+            line = line.decode('latin-1')
+        return line.rstrip('\r\n')
+
+    async def write_record(self, record):
+        self.records.append(record)
+        if self.writer is not None:
+            self.writer.write((record + '\n').encode('latin-1', 'replace'))
+            await self.writer.drain()
+
+    async def run(self, max_instructions=None, time_limit=None):
+        """
+        Runs the attached simulator until it stops for a reason other than
+        SVC, awaiting I/O at each SVC and yielding to the event loop every
+        SLICE_INSTRUCTIONS instructions.
+
+        :return: Run statistics in the form returned by `run_turbo`.
+        """
+        simulator = self.simulator
+        executed = 0
+        start_time = time.perf_counter()
+        deadline = None if time_limit is None else start_time + time_limit
+        while True:
+            budget = self.SLICE_INSTRUCTIONS
+            if max_instructions is not None:
+                budget = min(budget, max_instructions - executed)
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            stats = simulator.run_turbo(max_instructions=budget, time_limit=remaining)
+            executed += stats['instructions']
+            status = stats['status']
+            if status == 'svc':
+                number, self._pending = self._pending, None
+                if number == SVC_IN:
+                    self.store_record(simulator, await self.next_record())
+                elif number == SVC_OUT:
+                    await self.write_record(self.load_record(simulator))
+                else:
+                    simulator._fault(f"Unsupported SVC {number}")
+                    status = 'error'
+                    break
+            elif status != 'budget' or (max_instructions is not None and executed >= max_instructions):
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                status = 'deadline'
+                break
+            await asyncio.sleep(0)
+
+        elapsed = time.perf_counter() - start_time
+        return {
+            'status': status,
+            'instructions': executed,
+            'elapsed': elapsed,
+            'mips': executed / elapsed / 1e6 if elapsed > 0 else 0.0,
+        }
+
+
+if __name__ == '__main__':
+    import sys
+
+    from compilor import Compiler
+    from simulator import COMET2Simulator
+
+    echo_program = """
+    ECHO     START
+             IN    BUF,LEN
+             OUT   BUF,LEN
+             OUT   MSG,MLEN
+             DC    0            ; HALT
+    MSG      DC    'Done.'
+    MLEN     DC    5
+    BUF      DS    256
+    LEN      DS    1
+             END
+    """
+    compiler = Compiler(verbose=False)
+    machine_code = compiler.compile(echo_program)
+
+    # Synchronous: input from a string, output to stdout.
+    simulator = COMET2Simulator(verbose=False)
+    simulator.load_program(machine_code)
+    BufferedBackend("Hello, COMET II\n", sys.stdout).attach(simulator)
+    simulator.run_turbo()
+
+    # Asynchronous: several machines share one event loop.
+    async def run_machines(count):
+        backends = []
+        for i in range(count):
+            machine = COMET2Simulator(verbose=False)
+            machine.load_program(machine_code)
+            reader = asyncio.StreamReader()
+            reader.feed_data(f"machine {i}\n".encode())
+            reader.feed_eof()
+            backend = AsyncBackend(reader)
+            backend.attach(machine)
+            backends.append(backend)
+        await asyncio.gather(*(backend.run() for backend in backends))
+        return [backend.records for backend in backends]
+
+    for records in asyncio.run(run_machines(3)):
+        print(records)
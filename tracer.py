@@ -0,0 +1,216 @@
+"""
+A structured execution tracer for the COMET II simulator.
+
+Executed instructions are recorded into fixed-size, preallocated ring buffers
+(typed arrays), so recording does no formatting and no allocation. Entries
+are rendered to text only on demand, or when the simulator stops on an error,
+and can be exported to JSONL or to a compact binary file.
+"""
+
+import json
+import struct
+import sys
+from array import array
+
+from isa import disassemble_instruction
+
+# Binary export: header followed by the entry arrays in chronological order.
+TRACE_MAGIC = b'CTRC'
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct('<4sHHIQ')  # magic, version, reserved, entries, first sequence number
+
+
+class ExecutionTracer:
+    """
+    Records (PC, instruction words, registers, flags, memory write) for the
+    most recent `capacity` instructions executed by a simulator.
+
+    Registers are stored in full after each instruction; the register deltas
+    shown when rendering are computed from consecutive entries.
+    """
+    def __init__(self, capacity=4096):
+        """
+        Preallocates the ring buffers.
+        :param capacity: Number of most recent instructions to keep.
+        """
+        self.capacity = capacity
+        self.count = 0  # Total number of instructions recorded
+        self.pcs = array('H', bytes(2 * capacity))
+        self.words = array('H', bytes(2 * capacity))
+        self.operands = array('H', bytes(2 * capacity))
+        self.registers = array('H', bytes(2 * 8 * capacity))
+        self.flags = array('B', bytes(capacity))  # OF << 2 | SF << 1 | ZF
+        self.wrote = array('B', bytes(capacity))
+        self.write_addresses = array('H', bytes(2 * capacity))
+        self.write_values = array('H', bytes(2 * capacity))
+
+        # Registers and flags before the oldest retained entry.
+        self.base_registers = array('H', bytes(2 * 8))
+        self.base_flags = 0
+
+        self.simulator = None
+        self._pending_write = False
+        self._write_address = 0
+        self._write_value = 0
+        self._store_wrapper = None   # (wrapper, wrapped _store, simulator had its own _store)
+
+    def attach(self, simulator):
+        """
+        Starts recording every instruction the simulator executes.
+        Memory writes are captured by wrapping the simulator's `_store`.
+        """
+        self.simulator = simulator
+        self.base_registers[:] = simulator.gr
+        self.base_flags = simulator.of << 2 | simulator.sf << 1 | simulator.zf
+        had_own_store = '_store' in simulator.__dict__
+        original_store = simulator._store
+
+        def store(address, value):
+            # After detaching, a wrapper that could not be unlinked only passes writes on.
+            if self.simulator is not None:
+                self._pending_write = True
+                self._write_address = address
+                self._write_value = value
+            original_store(address, value)
+
+        simulator._store = store
+        self._store_wrapper = (store, original_store, had_own_store)
+        simulator._step_hooks.append(self.record)
+        simulator.tracer = self
+
+    def detach(self):
+        """Stops recording and restores the simulator's `_store`."""
+        simulator = self.simulator
+        simulator._step_hooks.remove(self.record)
+        store, original_store, had_own_store = self._store_wrapper
+        # Unwrap only if nothing (such as a write watchpoint) has wrapped
+        # `_store` since; otherwise the wrapper stays in the chain, doing nothing.
+        if simulator.__dict__.get('_store') is store:
+            if had_own_store:
+                simulator._store = original_store
+            else:
+                del simulator._store
+        self._store_wrapper = None
+        simulator.tracer = None
+        self.simulator = None
+
+    def record(self, pc):
+        """Records the instruction just executed at `pc`. Called after every step."""
+        simulator = self.simulator
+        memory = simulator.memory
+        i = self.count % self.capacity
+        if self.count >= self.capacity:
+            # The entry being overwritten becomes the state before the oldest one.
+            self.base_registers[:] = self.registers[i * 8:i * 8 + 8]
+            self.base_flags = self.flags[i]
+        self.pcs[i] = pc
+        self.words[i] = memory[pc]
+        self.operands[i] = memory[(pc + 1) & 0xFFFF]
+        self.registers[i * 8:i * 8 + 8] = simulator.gr
+        self.flags[i] = simulator.of << 2 | simulator.sf << 1 | simulator.zf
+        if self._pending_write:
+            self.wrote[i] = 1
+            self.write_addresses[i] = self._write_address
+            self.write_values[i] = self._write_value
+            self._pending_write = False
+        else:
+            self.wrote[i] = 0
+        self.count += 1
+
+    def clear(self):
+        """Discards all recorded entries."""
+        self.count = 0
+        if self.simulator is not None:
+            self.base_registers[:] = self.simulator.gr
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def _slots(self, last=None):
+        """Yields (sequence number, slot index) for retained entries, oldest first."""
+        retained = len(self)
+        if last is not None:
+            retained = min(retained, last)
+        for seq in range(self.count - retained, self.count):
+            yield seq, seq % self.capacity
+
+    def _previous_state(self, seq):
+        """Registers and flags in effect before entry `seq`."""
+        if seq == max(0, self.count - self.capacity):
+            return self.base_registers, self.base_flags
+        i = (seq - 1) % self.capacity
+        return self.registers[i * 8:i * 8 + 8], self.flags[i]
+
+    def entries(self, last=None):
+        """
+        Yields retained entries as dicts, oldest first.
+        :param last: Only the most recent `last` entries.
+        """
+        for seq, i in self._slots(last):
+            flags = self.flags[i]
+            yield {
+                'seq': seq,
+                'pc': self.pcs[i],
+                'word': self.words[i],
+                'operand': self.operands[i],
+                'text': disassemble_instruction(self.words[i], self.operands[i]),
+                'registers': self.registers[i * 8:i * 8 + 8].tolist(),
+                'flags': {'of': flags >> 2 & 1, 'sf': flags >> 1 & 1, 'zf': flags & 1},
+                'write': [self.write_addresses[i], self.write_values[i]] if self.wrote[i] else None,
+            }
+
+    def render(self, last=None):
+        """
+        Formats retained entries as text, one line per instruction, showing
+        the instruction as CASL II text and only the registers, flags and
+        memory word that changed.
+        :param last: Only the most recent `last` entries.
+        """
+        lines = []
+        for seq, i in self._slots(last):
+            before_registers, before_flags = self._previous_state(seq)
+            line = (f"#{seq:<8} PC: {self.pcs[i]:04X} | {self.words[i]:04X} {self.operands[i]:04X} "
+                    f"{disassemble_instruction(self.words[i], self.operands[i]):<20}")
+            for r in range(8):
+                old, new = before_registers[r], self.registers[i * 8 + r]
+                if old != new:
+                    line += f" | GR{r}: {old:04X} -> {new:04X}"
+            flags = self.flags[i]
+            for name, bit in (('OF', 2), ('SF', 1), ('ZF', 0)):
+                old, new = before_flags >> bit & 1, flags >> bit & 1
+                if old != new:
+                    line += f" | {name}: {old} -> {new}"
+            if self.wrote[i]:
+                line += f" | mem[{self.write_addresses[i]:04X}] <- {self.write_values[i]:04X}"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def export_jsonl(self, path):
+        """Writes retained entries to `path`, one JSON object per line."""
+        with open(path, 'w') as f:
+            for entry in self.entries():
+                f.write(json.dumps(entry) + '\n')
+
+    def export_binary(self, path):
+        """
+        Writes retained entries to `path` in a compact binary form: a header
+        (magic, version, entry count, first sequence number) followed by the
+        pc, word, operand, flags, wrote, write address, write value and
+        register arrays, each in chronological order. Everything is
+        little-endian, whatever the host's byte order.
+        """
+        slots = [i for _, i in self._slots()]
+        first = self.count - len(slots)
+        columns = [array(column.typecode, (column[i] for i in slots))
+                   for column in (self.pcs, self.words, self.operands, self.flags,
+                                  self.wrote, self.write_addresses, self.write_values)]
+        registers = array('H')
+        for i in slots:
+            registers.extend(self.registers[i * 8:i * 8 + 8])
+        columns.append(registers)
+        with open(path, 'wb') as f:
+            f.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, 0, len(slots), first))
+            for column in columns:
+                if sys.byteorder != 'little':
+                    column.byteswap()
+                f.write(column.tobytes())
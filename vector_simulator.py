@@ -0,0 +1,507 @@
+"""
+A lock-step, NumPy-based variant of the COMET II simulator that runs one
+program against many initial states ("lanes") at once.
+
+Each lane has its own GR0-GR7, flags, Program Counter, Stack Pointer and
+copy of a data window of memory; the program image outside the window is shared by all lanes
+and read-only. Instructions are decoded once, through a COMET2Simulator that
+holds the program, and executed for every lane at the same address in a
+single vectorized operation. Lanes whose Program Counters diverge are
+regrouped by address on every cycle.
+
+Requires NumPy.
+"""
+
+from functools import partial
+
+import numpy as np
+
+import instructions
+from simulator import COMET2Simulator
+
+# Lane states
+RUNNING = 0
+HALTED = 1
+FAULTED = 2
+
+WORD_MASK = COMET2Simulator.WORD_MASK
+
+# Bit shifted out last, by clamped shift count (see instructions.py).
+SHIFT_OUT_BITS = {name: np.array(getattr(instructions, f"{name.upper()}_OUT_BIT"), dtype=np.int64)
+                  for name in ('sla', 'sra', 'sll', 'srl')}
+
+
+# Vectorized ALU operations: each takes the old register values and the
+# operands as int64 arrays and returns (result, OF).
+
+def _adda(a, b):
+    values = (a + b) & WORD_MASK
+    return values, ((a ^ values) & (b ^ values)) >> 15
+
+def _suba(a, b):
+    values = (a - b) & WORD_MASK
+    return values, ((a ^ b) & (a ^ values)) >> 15
+
+def _addl(a, b):
+    return (a + b) & WORD_MASK, (a + b) >> 16
+
+def _subl(a, b):
+    return (a - b) & WORD_MASK, a < b
+
+def _and(a, b):
+    return a & b, 0
+
+def _or(a, b):
+    return a | b, 0
+
+def _xor(a, b):
+    return a ^ b, 0
+
+ALU_OPERATIONS = {'adda': _adda, 'suba': _suba, 'addl': _addl, 'subl': _subl,
+                  'and': _and, 'or': _or, 'xor': _xor}
+
+
+def _shift_values(name, a, count):
+    """Returns (result, OF) of shift `name` of int64 values `a` by a clamped count."""
+    if name == 'sla':
+        values = (a & 0x8000) | ((a << count) & 0x7FFF)
+    elif name == 'sra':
+        values = ((a - ((a & 0x8000) << 1)) >> count) & WORD_MASK
+    elif name == 'sll':
+        values = (a << count) & WORD_MASK
+    else:
+        values = a >> count
+    return values, (a & SHIFT_OUT_BITS[name][count]) != 0
+
+
+# Branch conditions over the (of, sf, zf) arrays of the executing lanes.
+BRANCH_CONDITIONS = {
+    'jpl': lambda of, sf, zf: (sf == 0) & (zf == 0),
+    'jmi': lambda of, sf, zf: sf == 1,
+    'jnz': lambda of, sf, zf: zf == 0,
+    'jze': lambda of, sf, zf: zf == 1,
+    'jov': lambda of, sf, zf: of == 1,
+}
+
+
+class VectorCOMET2Simulator:
+    """
+    Runs the same COMET II program across a batch of lanes.
+
+    Self-modifying code is not supported: a lane that stores into a word that
+    has been decoded as an instruction is faulted, as is a lane that stores
+    outside its data window. A lane whose copy of an instruction differs from
+    the loaded image when the instruction is decoded (it was stored to, or
+    set by `set_memory`, before it ran) is faulted too, instead of running
+    the shared original. The stack is memory like any other, so programs
+    that use PUSH, POP or CALL need a data window that covers the stack (SP
+    starts at 0, and the first push writes address FFFF). SVC is not
+    supported and faults the lane.
+    """
+    def __init__(self, lanes):
+        """
+        Initializes `lanes` zeroed machines.
+        :param lanes: Number of independent machine states to run in lock-step.
+        """
+        self.lanes = lanes
+        self.program = COMET2Simulator(verbose=False)
+        self.image = np.frombuffer(self.program.memory, dtype=np.uint16)
+        self._is_code = np.zeros(COMET2Simulator.MEMORY_SIZE, dtype=bool)
+
+        self.gr = np.zeros((lanes, 8), dtype=np.uint16)
+        self.pr = np.zeros(lanes, dtype=np.int64)
+        self.sp = np.zeros(lanes, dtype=np.int64)
+        self.of = np.zeros(lanes, dtype=np.uint8)
+        self.sf = np.zeros(lanes, dtype=np.uint8)
+        self.zf = np.zeros(lanes, dtype=np.uint8)
+        self.state = np.full(lanes, RUNNING, dtype=np.uint8)
+        self.steps = np.zeros(lanes, dtype=np.int64)
+
+        # Per-lane copy of memory[data_start:data_end]
+        self.data_start = 0
+        self.data_end = 0
+        self.memory = np.zeros((lanes, 0), dtype=np.uint16)
+        # Window words that any lane has written since loading
+        self._written = np.zeros(0, dtype=bool)
+
+        # Maps interpreter handlers to their vectorized equivalents.
+        self.operations = {
+            instructions.ld_mem: self._ld_mem,
+            instructions.ld_reg: self._ld_reg,
+            instructions.st: self._st,
+            instructions.lad: self._lad,
+            instructions.push: self._push,
+            instructions.pop: self._pop,
+            instructions.call: self._call,
+            instructions.ret: self._ret,
+            instructions.jump: self._jump,
+            instructions.halt: self._halt,
+        }
+        for name, operation in ALU_OPERATIONS.items():
+            self.operations[getattr(instructions, f"{name}_mem")] = partial(self._alu_mem, operation)
+            self.operations[getattr(instructions, f"{name}_reg")] = partial(self._alu_reg, operation)
+        for name in ('cpa', 'cpl'):
+            self.operations[getattr(instructions, f"{name}_mem")] = partial(self._compare_mem, name == 'cpa')
+            self.operations[getattr(instructions, f"{name}_reg")] = partial(self._compare_reg, name == 'cpa')
+        for name in SHIFT_OUT_BITS:
+            self.operations[getattr(instructions, name)] = partial(self._shift, name)
+        for name, condition in BRANCH_CONDITIONS.items():
+            self.operations[getattr(instructions, name)] = partial(self._branch, condition)
+
+    def load_program(self, machine_code, start_address=0, data_range=None):
+        """
+        Loads the program shared by all lanes and resets every lane.
+        :param machine_code: A list of hexadecimal strings.
+        :param start_address: The memory address to start loading the code.
+        :param data_range: (start, end) of the per-lane writable window;
+                           defaults to the extent of the loaded program.
+        """
+        if not self.program.load_program(machine_code, start_address):
+            return False
+        self._is_code[:] = False
+        if data_range is None:
+            data_range = (start_address, start_address + len(machine_code))
+        self.data_start, self.data_end = data_range
+        self.memory = np.tile(self.image[self.data_start:self.data_end], (self.lanes, 1))
+        self._written = np.zeros(self.data_end - self.data_start, dtype=bool)
+
+        self.gr[:] = 0
+        self.pr[:] = start_address
+        self.sp[:] = 0
+        self.of[:] = 0
+        self.sf[:] = 0
+        self.zf[:] = 0
+        self.state[:] = RUNNING
+        self.steps[:] = 0
+        return True
+
+    def set_memory(self, address, values):
+        """
+        Sets per-lane initial data inside the data window.
+        :param address: First address to write.
+        :param values: Array of shape (lanes,) for one word, or (lanes, n) for n words.
+        """
+        values = np.asarray(values, dtype=np.int64) & COMET2Simulator.WORD_MASK
+        if values.ndim == 1:
+            values = values[:, None]
+        start = address - self.data_start
+        if start < 0 or address + values.shape[1] > self.data_end:
+            raise ValueError("Address range lies outside the data window.")
+        self.memory[:, start:start + values.shape[1]] = values
+        self._written[start:start + values.shape[1]] = True
+
+    def set_register(self, index, values):
+        """Sets GR`index` for every lane from an array of shape (lanes,)."""
+        self.gr[:, index] = np.asarray(values, dtype=np.int64) & COMET2Simulator.WORD_MASK
+
+    # --- Memory access ---
+
+    def _read(self, lanes, ea):
+        """Reads memory at a scalar or per-lane effective address."""
+        if np.isscalar(ea):
+            if self.data_start <= ea < self.data_end:
+                return self.memory[lanes, ea - self.data_start]
+            return np.broadcast_to(self.image[ea], self.gr[lanes, 0].shape)
+        inside = (ea >= self.data_start) & (ea < self.data_end)
+        offsets = np.where(inside, ea - self.data_start, 0)
+        rows = np.arange(self.lanes)[lanes]
+        window = self.memory[rows, offsets] if self.data_end > self.data_start else 0
+        return np.where(inside, window, self.image[ea])
+
+    def _write(self, lanes, ea, values):
+        """Writes per-lane values, faulting lanes that cannot be written."""
+        rows = np.arange(self.lanes)[lanes]
+        if np.isscalar(ea):
+            if self.data_start <= ea < self.data_end and not self._is_code[ea]:
+                self.memory[rows, ea - self.data_start] = values
+                self._written[ea - self.data_start] = True
+            else:
+                self.state[rows] = FAULTED
+            return
+        allowed = (ea >= self.data_start) & (ea < self.data_end) & ~self._is_code[ea]
+        self.memory[rows[allowed], ea[allowed] - self.data_start] = values[allowed]
+        self._written[ea[allowed] - self.data_start] = True
+        self.state[rows[~allowed]] = FAULTED
+
+    def _effective_address(self, lanes, x, adr):
+        """Returns a scalar address, or a per-lane array when indexed."""
+        if x == 0:
+            return adr
+        return (adr + self.gr[lanes, x].astype(np.int64)) & COMET2Simulator.WORD_MASK
+
+    def _set_flags(self, lanes, values, overflow=0):
+        self.of[lanes] = overflow
+        self.sf[lanes] = values >> 15
+        self.zf[lanes] = values == 0
+
+    def _lane_values(self, lanes, value):
+        """Returns a scalar or per-lane value as an int64 array over `lanes`."""
+        if np.isscalar(value):
+            return np.full(self.gr[lanes, 0].shape, value, dtype=np.int64)
+        return value.astype(np.int64)
+
+    # --- Vectorized instructions ---
+    # Each takes the lanes to execute (a slice or index array) followed by
+    # the decoded operands, exactly as the scalar handlers receive them.
+
+    def _ld_mem(self, lanes, r, x, adr):
+        values = self._read(lanes, self._effective_address(lanes, x, adr))
+        self.gr[lanes, r] = values
+        self._set_flags(lanes, values)
+
+    def _ld_reg(self, lanes, r1, r2):
+        values = self.gr[lanes, r2]
+        self.gr[lanes, r1] = values
+        self._set_flags(lanes, values)
+
+    def _st(self, lanes, r, x, adr):
+        self._write(lanes, self._effective_address(lanes, x, adr), self.gr[lanes, r])
+
+    def _lad(self, lanes, r, x, adr):
+        ea = self._effective_address(lanes, x, adr)
+        self.gr[lanes, r] = np.broadcast_to(np.uint16(ea), self.gr[lanes, r].shape) if np.isscalar(ea) else ea.astype(np.uint16)
+
+    def _alu_mem(self, operation, lanes, r, x, adr):
+        operands = self._read(lanes, self._effective_address(lanes, x, adr)).astype(np.int64)
+        values, overflow = operation(self.gr[lanes, r].astype(np.int64), operands)
+        self.gr[lanes, r] = values
+        self._set_flags(lanes, values, overflow)
+
+    def _alu_reg(self, operation, lanes, r1, r2):
+        values, overflow = operation(self.gr[lanes, r1].astype(np.int64), self.gr[lanes, r2].astype(np.int64))
+        self.gr[lanes, r1] = values
+        self._set_flags(lanes, values, overflow)
+
+    def _compare(self, lanes, arithmetic, a, b):
+        if arithmetic:
+            a, b = a ^ 0x8000, b ^ 0x8000
+        self.of[lanes] = 0
+        self.sf[lanes] = a < b
+        self.zf[lanes] = a == b
+
+    def _compare_mem(self, arithmetic, lanes, r, x, adr):
+        operands = self._read(lanes, self._effective_address(lanes, x, adr)).astype(np.int64)
+        self._compare(lanes, arithmetic, self.gr[lanes, r].astype(np.int64), operands)
+
+    def _compare_reg(self, arithmetic, lanes, r1, r2):
+        self._compare(lanes, arithmetic, self.gr[lanes, r1].astype(np.int64), self.gr[lanes, r2].astype(np.int64))
+
+    def _shift(self, name, lanes, r, x, adr):
+        count = np.minimum(self._effective_address(lanes, x, adr), instructions.SHIFT_LIMIT)
+        values, overflow = _shift_values(name, self.gr[lanes, r].astype(np.int64), count)
+        self.gr[lanes, r] = values
+        self._set_flags(lanes, values, overflow)
+
+    def _jump(self, lanes, r, x, adr):
+        self.pr[lanes] = self._effective_address(lanes, x, adr)
+
+    def _branch(self, condition, lanes, r, x, adr):
+        taken = condition(self.of[lanes], self.sf[lanes], self.zf[lanes])
+        self.pr[lanes] = np.where(taken, self._effective_address(lanes, x, adr), self.pr[lanes])
+
+    def _push(self, lanes, r, x, adr):
+        sp = self.sp[lanes] = (self.sp[lanes] - 1) & WORD_MASK
+        self._write(lanes, sp, self._lane_values(lanes, self._effective_address(lanes, x, adr)))
+
+    def _pop(self, lanes, r, r2_or_x):
+        sp = self.sp[lanes]
+        self.gr[lanes, r] = self._read(lanes, sp)
+        self.sp[lanes] = (sp + 1) & WORD_MASK
+
+    def _call(self, lanes, r, x, adr):
+        target = self._effective_address(lanes, x, adr)
+        sp = self.sp[lanes] = (self.sp[lanes] - 1) & WORD_MASK
+        self._write(lanes, sp, self.pr[lanes])
+        self.pr[lanes] = target
+
+    def _ret(self, lanes, r1, r2_or_x):
+        # An empty stack (SP = 0) halts, as in the interpreter.
+        rows = np.arange(self.lanes)[lanes]
+        sp = self.sp[rows]
+        empty = sp == 0
+        self.state[rows[empty]] = HALTED
+        rows, sp = rows[~empty], sp[~empty]
+        self.pr[rows] = self._read(rows, sp)
+        self.sp[rows] = (sp + 1) & WORD_MASK
+
+    def _halt(self, lanes, r1, r2_or_x):
+        self.state[lanes] = HALTED
+
+    # --- Execution ---
+
+    def _execute(self, address, lanes):
+        """Executes the instruction at `address` for the selected lanes."""
+        entry = self.program._decoded.get(address) or self.program._decode_at(address)
+        if entry is None:
+            self.state[lanes] = FAULTED
+            return
+        exec_func, args, next_pr, _ = entry
+        self._is_code[address:next_pr] = True
+        low, high = max(address, self.data_start), min(next_pr, self.data_end)
+        if low < high and self._written[low - self.data_start:high - self.data_start].any():
+            # Some lane may have changed this instruction before it ran.
+            rows = np.arange(self.lanes)[lanes]
+            window = self.memory[rows, low - self.data_start:high - self.data_start]
+            modified = (window != self.image[low:high]).any(axis=1)
+            self.state[rows[modified]] = FAULTED
+            lanes = rows[~modified]
+            if not len(lanes):
+                return
+        operation = self.operations.get(exec_func)
+        if operation is None:
+            self.state[lanes] = FAULTED
+            return
+        self.pr[lanes] = next_pr
+        self.steps[lanes] += 1
+        operation(lanes, *args)
+
+    def run(self, max_instructions=None):
+        """
+        Runs all lanes until every lane has halted or faulted, or until
+        `max_instructions` lock-step cycles have been executed.
+        :return: A dict of lane counts by final state and the number of cycles.
+        """
+        cycles = 0
+        while max_instructions is None or cycles < max_instructions:
+            running = self.state == RUNNING
+            if not running.any():
+                break
+            cycles += 1
+            if running.all():
+                first = self.pr[0]
+                if (self.pr == first).all():
+                    # Common case: every lane is at the same instruction.
+                    self._execute(int(first), slice(None))
+                    continue
+            # Lanes have diverged (or some have stopped): regroup by address.
+            active = np.flatnonzero(running)
+            addresses = self.pr[active]
+            for address in np.unique(addresses):
+                self._execute(int(address), active[addresses == address])
+
+        return {
+            'running': int((self.state == RUNNING).sum()),
+            'halted': int((self.state == HALTED).sum()),
+            'faulted': int((self.state == FAULTED).sum()),
+            'cycles': cycles,
+        }
+
+
+if __name__ == '__main__':
+    import time
+
+    from compilor import Compiler
+
+    # The same program run for many initial values of A and B. Lanes take
+    # different branches depending on the comparison and on overflow.
+    source = """
+    PGM      START
+             LD    GR1,A
+             LD    GR2,B
+             CPA   GR1,GR2
+             JPL   ORDERED      ; GR1 = max(A, B), GR2 = min(A, B)
+             LD    GR3,GR1
+             LD    GR1,GR2
+             LD    GR2,GR3
+    ORDERED  SUBA  GR1,GR2
+             JOV   OVER
+             SRA   GR1,1
+             ST    GR1,C
+             RET
+    OVER     SLL   GR2,3
+             XOR   GR2,B
+             ST    GR2,C
+             RET
+    A        DC    0
+    B        DC    0
+    C        DS    1
+             END
+    """
+    compiler = Compiler(verbose=False)
+    program = compiler.compile(source)
+    symbols = compiler.symbol_table
+
+    lanes = 10_000
+    rng = np.random.default_rng(1)
+    a = rng.integers(0, 65536, lanes)
+    b = rng.integers(0, 65536, lanes)
+
+    vector = VectorCOMET2Simulator(lanes)
+    vector.load_program(program)
+    vector.set_memory(symbols['A'], a)
+    vector.set_memory(symbols['B'], b)
+    start = time.perf_counter()
+    summary = vector.run(max_instructions=1000)
+    vector_time = time.perf_counter() - start
+
+    # Cross-check a sample of lanes against the scalar simulator.
+    sample = range(0, lanes, lanes // 50)
+    start = time.perf_counter()
+    mismatches = 0
+    for lane in sample:
+        scalar = COMET2Simulator(verbose=False)
+        scalar.load_program(program)
+        scalar.memory[symbols['A']] = int(a[lane])
+        scalar.memory[symbols['B']] = int(b[lane])
+        scalar.run_turbo(max_instructions=1000)
+        if (list(scalar.gr) != vector.gr[lane].tolist()
+                or list(scalar.memory[0:len(program)]) != vector.memory[lane].tolist()
+                or (scalar.of, scalar.sf, scalar.zf) != (vector.of[lane], vector.sf[lane], vector.zf[lane])):
+            mismatches += 1
+    scalar_time = (time.perf_counter() - start) / len(sample) * lanes
+
+    print(f"Lanes: {summary}")
+    print(f"Scalar mismatches in sample: {mismatches}")
+    print(f"Vectorized: {lanes / vector_time:,.0f} runs/s, "
+          f"scalar (extrapolated): {lanes / scalar_time:,.0f} runs/s")
+
+    # Self-modifying code: every lane stores to PATCH in the same cycle,
+    # before any lane has run it. Lanes with a negative A store LD GR3,GR2
+    # (the original XOR 3), the others store the original LD GR3,GR1. The
+    # scalar simulator runs the patched code; the vector lanes that patched
+    # it must fault rather than run the original, and every other lane must
+    # agree with the scalar run.
+    source = """
+    PGM      START
+             LD    GR1,A
+             LD    GR2,B
+             LD    GR0,A
+             SRA   GR0,15       ; FFFF if A < 0, else 0
+             LD    GR4,FLIP
+             AND   GR4,GR0
+             XOR   GR4,ORIGINAL
+             ST    GR4,PATCH
+    PATCH    LD    GR3,GR1
+             ST    GR3,C
+             RET
+    ORIGINAL LD    GR3,GR1
+    FLIP     DC    3
+    A        DC    0
+    B        DC    0
+    C        DS    1
+             END
+    """
+    compiler = Compiler(verbose=False)
+    program = compiler.compile(source)
+    symbols = compiler.symbol_table
+    lanes = 200
+    a = rng.integers(0, 65536, lanes)
+    b = rng.integers(0, 65536, lanes)
+    vector = VectorCOMET2Simulator(lanes)
+    vector.load_program(program)
+    vector.set_memory(symbols['A'], a)
+    vector.set_memory(symbols['B'], b)
+    vector.run(max_instructions=1000)
+    silent = 0
+    for lane in range(lanes):
+        scalar = COMET2Simulator(verbose=False)
+        scalar.load_program(program)
+        scalar.memory[symbols['A']] = int(a[lane])
+        scalar.memory[symbols['B']] = int(b[lane])
+        scalar.run_turbo(max_instructions=1000)
+        patched = scalar.memory[symbols['PATCH']] != vector.image[symbols['PATCH']]
+        if patched != (vector.state[lane] == FAULTED) or not patched and (
+                list(scalar.gr) != vector.gr[lane].tolist()
+                or list(scalar.memory[0:len(program)]) != vector.memory[lane].tolist()):
+            silent += 1
+    print(f"Self-modifying lanes faulted: {int((vector.state == FAULTED).sum())}, silent mismatches: {silent}")